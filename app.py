@@ -6,13 +6,61 @@ STRIKTE DATENISOLATION: Jeder Außendienst hat eigene isolierte Daten
 """
 
 import os
+import re
+import json
+import math
+import time
+import io
+import csv
 import base64
+import bisect
 import hashlib
+import heapq
+import shutil
 import secrets
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, session, send_file
+import sqlite3
+import tempfile
+import threading
+import urllib.parse
+import urllib.request
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from queue import Empty, Queue
+import click
+import numpy as np
+from flask import Flask, g, has_request_context, request, jsonify, session, send_file, stream_with_context
+from flask.sessions import SessionInterface, SessionMixin
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 from flask_cors import CORS
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.schema import AddConstraint, CreateTable
+from sqlalchemy.sql.util import find_tables
+from werkzeug.datastructures import CallbackDict
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+try:
+    import orjson  # optional: schnellerer JSON-Encoder für große Listen
+except ImportError:
+    orjson = None
+
+try:
+    from PIL import Image, ImageOps  # optional: Vorschaubilder für Bild-Dokumente
+except ImportError:
+    Image = ImageOps = None
+
+try:
+    import fcntl  # nur POSIX: Sperrdatei für Schema-Upgrades beim Start
+except ImportError:
+    fcntl = None
 
 # ============================================================
 # KONFIGURATION
@@ -28,13 +76,17 @@ app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # SICHERHEIT: Lax statt None
 app.config['SESSION_COOKIE_SECURE'] = os.environ.get('PRODUCTION', 'false').lower() == 'true'
 app.config['SESSION_COOKIE_HTTPONLY'] = True  # SICHERHEIT: HttpOnly aktivieren
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
-app.config['SESSION_TYPE'] = 'filesystem'
+app.config['SESSION_TYPE'] = 'sqlite'
+# Serverseitige Sessions: lokale SQLite-Datei, von allen Gunicorn-Workern geteilt
+app.config['SESSION_DB_PATH'] = os.environ.get('SESSION_DB_PATH', 'customer_pro_sessions.db')
+app.config['SESSION_REAP_INTERVAL'] = int(os.environ.get('SESSION_REAP_INTERVAL', '300'))
 
 # CORS-Konfiguration - für Production anpassen!
 ALLOWED_ORIGINS = os.environ.get('ALLOWED_ORIGINS', '*').split(',')
 CORS(app, resources={r"/api/*": {"origins": ALLOWED_ORIGINS}}, supports_credentials=True, 
      allow_headers=["Content-Type", "Authorization", "X-User-ID", "X-Username"], 
-     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
+     methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
+     expose_headers=["Retry-After", "X-Archive-From"])  # 429-Wartezeit, Archiv-Zeitfenster
 
 # Datenbank
 DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///customer_pro.db')
@@ -42,7 +94,252 @@ app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
-db = SQLAlchemy(app)
+# SQLite-Profil je Verbindung (Hauptdatenbank und Shards): WAL erlaubt Lesen
+# während eines Schreibvorgangs, busy_timeout wartet auf Sperren statt sofort
+# 'database is locked' zu melden; cache_size negativ = KiB
+SQLITE_PROFILE = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', '-65536')),
+}
+# Group-Commit (optional): kleine Schreibzugriffe paralleler Requests eines
+# Prozesses teilen sich eine Transaktion und damit einen fsync
+SQLITE_GROUP_COMMIT = os.environ.get('SQLITE_GROUP_COMMIT', 'false').lower() == 'true'
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get('GROUP_COMMIT_WINDOW_MS', '2'))
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get('GROUP_COMMIT_MAX_BATCH', '64'))
+
+# Geokodierung: 'plz' (offline, PLZ-Tabelle), 'nominatim' (HTTP) oder 'none'
+GEOCODER = os.environ.get('GEOCODER', 'plz')
+GEOCODER_URL = os.environ.get('GEOCODER_URL', 'https://nominatim.openstreetmap.org/search')
+GEOCODER_PLZ_FILE = os.environ.get('GEOCODER_PLZ_FILE', 'plz_coordinates.csv')
+
+# Hintergrund-Jobs: Warteschlange in lokaler SQLite-Datei; 'thread' startet die
+# Worker in jedem Gunicorn-Prozess, 'external' überlässt sie 'flask run-jobs'
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', 'customer_pro_jobs.db')
+JOB_WORKER_MODE = os.environ.get('JOB_WORKER_MODE', 'thread')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_EXPORT_DIR = os.environ.get('JOB_EXPORT_DIR', 'customer_pro_exports')
+
+# Änderungs-Feed (SSE): lokale SQLite-Datei verteilt Ereignisse an alle Worker
+EVENT_DB_PATH = os.environ.get('EVENT_DB_PATH', 'customer_pro_events.db')
+
+# Shard-Modus (optional): Kunden, Baustellen, Touren und Dokumente jedes
+# Außendienstlers in einer eigenen SQLite-Datei unter SHARD_DIR, damit parallele
+# Schreiber sich nicht sperren. Nutzer und Kennzahlen bleiben im Katalog (DATABASE_URL).
+SHARD_MODE = os.environ.get('SHARD_MODE', 'false').lower() == 'true'
+SHARD_DIR = os.environ.get('SHARD_DIR', 'customer_pro_shards')
+SHARD_FANOUT_WORKERS = int(os.environ.get('SHARD_FANOUT_WORKERS', '8'))
+
+# Schema-Upgrade beim Start: alle Worker eines Hosts warten auf diese Sperrdatei
+STARTUP_LOCK_PATH = os.environ.get('STARTUP_LOCK_PATH', 'customer_pro_startup.lock')
+
+# Rate-Limiting für /api/*: Token-Buckets je Nutzer (bzw. IP) und für den
+# ganzen Server, Zustand in lokaler SQLite-Datei (von allen Workern geteilt).
+# RATE = Anfragen pro Sekunde im Mittel, BURST = kurzfristig erlaubte Spitze
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_DB_PATH = os.environ.get('RATE_LIMIT_DB_PATH', 'customer_pro_ratelimit.db')
+RATE_LIMIT_USER_RATE = float(os.environ.get('RATE_LIMIT_USER_RATE', '10'))
+RATE_LIMIT_USER_BURST = float(os.environ.get('RATE_LIMIT_USER_BURST', '60'))
+RATE_LIMIT_GLOBAL_RATE = float(os.environ.get('RATE_LIMIT_GLOBAL_RATE', '100'))
+RATE_LIMIT_GLOBAL_BURST = float(os.environ.get('RATE_LIMIT_GLOBAL_BURST', '300'))
+# Vorgeschaltete Proxys, deren X-Forwarded-For als Client-Adresse gilt. Ohne
+# Proxy bestimmt der Client den Header selbst, daher nur explizit einschalten
+# (Procfile: PROXY_HOPS=1 für den Router davor)
+PROXY_HOPS = int(os.environ.get('PROXY_HOPS', '0'))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+
+class ShardSession(FlaskSession):
+    """Leitet im Shard-Modus Abfragen auf Außendienst-Tabellen an die Datei des aktuellen Shards"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if SHARD_MODE and bind is None and touches_shard(mapper, clause):
+            return shard_engine(require_shard())
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={'class_': ShardSession})
+
+
+@event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """
+    SQLite prüft Fremdschlüssel (und damit ON DELETE) nur, wenn pro Verbindung
+    aktiviert; dazu das SQLITE_PROFILE (Benchmark-Verbindungen bringen ein eigenes mit).
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        for pragma, value in getattr(dbapi_connection, 'profile', SQLITE_PROFILE).items():
+            cursor.execute(f'PRAGMA {pragma}={value}')
+        cursor.close()
+
+
+# ============================================================
+# SERVERSEITIGE SESSIONS
+# ============================================================
+
+# Ablaufzeit wird höchstens alle 5 Minuten nachgezogen (spart Schreibzugriffe)
+SESSION_TOUCH_INTERVAL = 300
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session-Daten, die serverseitig unter einer zufälligen Session-ID liegen"""
+
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Neue Session-ID (z.B. beim Login gegen Session-Fixation); die alte wird beim Speichern gelöscht"""
+        if not self.new and self.replaced_sid is None:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class SQLiteSessionStore:
+    """
+    Session-Speicher in einer lokalen SQLite-Datei.
+    Alle Worker-Prozesse nutzen dieselbe Datei - Sessions sind dadurch
+    widerrufbar (Logout, Nutzer gelöscht) und gelten in jedem Worker.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._init_schema()
+
+    def _conn(self):
+        # Eine Verbindung pro Thread; nach fork() (Gunicorn) neu verbinden
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self):
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                sid TEXT PRIMARY KEY,
+                user_id INTEGER,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions (expires_at);
+            CREATE INDEX IF NOT EXISTS ix_sessions_user_id ON sessions (user_id);
+        ''')
+
+    def load(self, sid):
+        """Liefert (daten, expires_at) oder None, wenn unbekannt/abgelaufen"""
+        row = self._conn().execute(
+            'SELECT data, expires_at FROM sessions WHERE sid = ? AND expires_at > ?',
+            (sid, time.time())).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def save(self, sid, data, expires_at):
+        user_id = (data.get('user') or {}).get('id')
+        self._conn().execute(
+            'INSERT OR REPLACE INTO sessions (sid, user_id, data, expires_at) VALUES (?, ?, ?, ?)',
+            (sid, user_id, json.dumps(data), expires_at))
+
+    def touch(self, sid, expires_at):
+        self._conn().execute('UPDATE sessions SET expires_at = ? WHERE sid = ?', (expires_at, sid))
+
+    def delete(self, sid):
+        self._conn().execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def delete_for_user(self, user_id):
+        """Widerruft alle Sessions eines Nutzers"""
+        return self._conn().execute('DELETE FROM sessions WHERE user_id = ?', (user_id,)).rowcount
+
+    def purge_expired(self):
+        return self._conn().execute('DELETE FROM sessions WHERE expires_at <= ?', (time.time(),)).rowcount
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """Flask-SessionInterface: Cookie enthält nur die Session-ID"""
+
+    def __init__(self, store, reap_interval):
+        self.store = store
+        self.reap_interval = reap_interval
+        self._reaper_pid = None
+
+    def _ensure_reaper(self):
+        # Hintergrund-Thread pro Worker-Prozess, entfernt abgelaufene Sessions
+        if self._reaper_pid == os.getpid():
+            return
+        self._reaper_pid = os.getpid()
+
+        def reap():
+            while True:
+                time.sleep(self.reap_interval)
+                try:
+                    removed = self.store.purge_expired()
+                    if removed:
+                        print(f"[SESSION] {removed} abgelaufene Sessions entfernt")
+                except Exception as e:
+                    print(f"[SESSION REAPER ERROR] {str(e)}")
+
+        threading.Thread(target=reap, name='session-reaper', daemon=True).start()
+
+    def open_session(self, app, request):
+        self._ensure_reaper()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            stored = self.store.load(sid)
+            if stored is not None:
+                data, expires_at = stored
+                return ServerSession(data, sid=sid, expires_at=expires_at)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.replaced_sid:
+            self.store.delete(session.replaced_sid)
+            session.replaced_sid = None
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        expires = self.get_expiration_time(app, session)
+        expires_at = expires.timestamp() if expires else time.time() + app.permanent_session_lifetime.total_seconds()
+        if session.modified:
+            self.store.save(session.sid, dict(session), expires_at)
+        elif session.expires_at and expires_at - session.expires_at > SESSION_TOUCH_INTERVAL:
+            self.store.touch(session.sid, expires_at)
+
+        if self.should_set_cookie(app, session):
+            response.set_cookie(name, session.sid, expires=expires,
+                                httponly=self.get_cookie_httponly(app),
+                                domain=domain, path=path,
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
+
+
+SESSION_STORE = SQLiteSessionStore(app.config['SESSION_DB_PATH'])
+app.session_interface = SQLiteSessionInterface(SESSION_STORE, app.config['SESSION_REAP_INTERVAL'])
 
 
 # ============================================================
@@ -89,33 +386,321 @@ def verify_password(stored_password, provided_password):
 # AUTHENTIFIZIERUNGS-HILFSFUNKTION
 # ============================================================
 
+class LRUCache:
+    """Prozess-Cache mit Obergrenze: bei Überlauf fällt der am längsten ungenutzte Eintrag heraus"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Header-Auth: aufgelöste Nutzer kurz pro Prozess zwischenspeichern. Begrenzt,
+# da X-User-ID beliebige IDs liefern kann (auch unbekannte werden gecacht)
+USER_CACHE_TTL = 60
+USER_CACHE_SIZE = 1024
+_user_cache = LRUCache(USER_CACHE_SIZE)
+
+
+def get_cached_user(user_id):
+    """Nutzer-Datensatz (dict) aus dem Prozess-Cache oder der Datenbank"""
+    cached = _user_cache.get(user_id)
+    if cached and cached[0] > time.time():
+        return cached[1]
+    user = User.query.get(user_id)
+    record = user.to_dict() if user else None
+    _user_cache[user_id] = (time.time() + USER_CACHE_TTL, record)
+    return record
+
+
+def invalidate_user(user_id):
+    """Nutzer aus dem Cache entfernen und alle seine Sessions widerrufen"""
+    _user_cache.pop(user_id, None)
+    SESSION_STORE.delete_for_user(user_id)
+
+
 def get_current_user():
     """
     Holt den aktuellen Benutzer aus Session ODER Header.
     Unterstützt sowohl Session-Cookies als auch X-User-ID Header für file:// Zugriff.
+    Der Nutzer-Datensatz liegt beim Login direkt in der serverseitigen Session.
     """
     # Zuerst Session prüfen
-    user_id = session.get('user_id')
-    user_role = session.get('role')
-    is_admin = session.get('is_admin')
+    user = session.get('user')
     
     # Falls keine Session, Header prüfen
-    if not user_id:
+    if not user:
         header_user_id = request.headers.get('X-User-ID')
         header_username = request.headers.get('X-Username')
         
         if header_user_id and header_username:
             try:
-                user = User.query.get(int(header_user_id))
-                if user and user.username == header_username:
-                    user_id = user.id
-                    user_role = user.role
-                    is_admin = user.is_admin
-                    print(f"[AUTH] Header-Auth für: {user.username}")
+                header_user = get_cached_user(int(header_user_id))
+                if header_user and header_user['username'] == header_username:
+                    user = header_user
+                    print(f"[AUTH] Header-Auth für: {header_user['username']}")
             except (ValueError, TypeError):
                 pass
     
-    return user_id, user_role, is_admin
+    if not user:
+        return None, None, None
+    return user['id'], user['role'], user['is_admin']
+
+# ============================================================
+# ZUGANGSSTEUERUNG (RATE LIMITING)
+# ============================================================
+
+# Kosten je Endpoint in Tokens (sonst 1): volle Listen, Gesamtdaten eines
+# Außendienstlers und Downloads belasten Datenbank und Worker am stärksten
+RATE_LIMIT_COSTS = {
+    'get_aussendienst_data': 10,
+    'get_aussendienst_overview': 5,
+    'list_customers': 5,
+    'list_sites': 5,
+    'list_tours': 5,
+    'list_tour_archive': 3,
+    'list_users': 2,
+    'download_document': 5,
+    'download_job_result': 5,
+    'import_customers': 5,
+    'export_customers': 5,
+    'enqueue_duplicate_search': 5,
+}
+# Volle Buckets nach so langer Ruhe löschen (entspricht einem vollen Bucket)
+RATE_LIMIT_IDLE = 3600
+
+
+class SQLiteRateLimiter:
+    """
+    Token-Buckets in einer lokalen SQLite-Datei, geteilt von allen
+    Worker-Prozessen. Alle Buckets einer Anfrage werden in einer Transaktion
+    (BEGIN IMMEDIATE) geprüft und nur gemeinsam belastet. Gedrosselte
+    Anfragen werden je Bucket-Art, Absender und Endpoint gezählt.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._purged_at = 0
+        self._init_schema()
+
+    def _conn(self):
+        # Eine Verbindung pro Thread; nach fork() (Gunicorn) neu verbinden
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Zustand ist flüchtig: nach einem Absturz sind die Buckets höchstens zu voll
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self):
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS throttled (
+                scope TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                last_at REAL NOT NULL,
+                PRIMARY KEY (scope, subject, endpoint)
+            );
+        ''')
+
+    def acquire(self, subject, endpoint, cost, buckets):
+        """
+        buckets: [(scope, key, rate, burst)]. Zieht cost von allen Buckets ab,
+        wenn jeder genug Tokens hat, und liefert (0, None); sonst (Sekunden
+        bis zum Nachfüllen, scope des knappsten Buckets) ohne Abzug.
+        """
+        conn = self._conn()
+        now = time.time()
+        if now - self._purged_at > RATE_LIMIT_IDLE:
+            self._purged_at = now
+            conn.execute('DELETE FROM buckets WHERE updated_at < ?', (now - RATE_LIMIT_IDLE,))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            levels, waits = [], []
+            for scope, key, rate, burst in buckets:
+                row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row['tokens'] + (now - row['updated_at']) * rate)
+                # Teurer als der ganze Bucket: bei vollem Bucket trotzdem zulassen
+                needed = min(cost, burst)
+                levels.append((key, tokens - needed))
+                if tokens < needed:
+                    waits.append(((needed - tokens) / rate, scope))
+            if waits:
+                wait, scope = max(waits)
+                conn.execute(
+                    'INSERT INTO throttled (scope, subject, endpoint, count, last_at) VALUES (?, ?, ?, 1, ?) '
+                    'ON CONFLICT (scope, subject, endpoint) DO UPDATE SET count = count + 1, last_at = excluded.last_at',
+                    (scope, subject, endpoint, now))
+                conn.execute('COMMIT')
+                return wait, scope
+            conn.executemany(
+                'INSERT INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at',
+                [(key, tokens, now) for key, tokens in levels])
+            conn.execute('COMMIT')
+            return 0, None
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def metrics(self):
+        rows = self._conn().execute(
+            'SELECT scope, subject, endpoint, count, last_at FROM throttled ORDER BY count DESC').fetchall()
+        totals = Counter()
+        for row in rows:
+            totals[row['scope']] += row['count']
+        return {
+            'throttled_total': sum(totals.values()),
+            'throttled_by_scope': dict(totals),
+            'throttled': [
+                {'scope': row['scope'], 'subject': row['subject'], 'endpoint': row['endpoint'],
+                 'count': row['count'],
+                 'last_at': datetime.utcfromtimestamp(row['last_at']).strftime('%Y-%m-%d %H:%M:%S')}
+                for row in rows
+            ]
+        }
+
+    def reset_metrics(self):
+        return self._conn().execute('DELETE FROM throttled').rowcount
+
+
+RATE_LIMITER = SQLiteRateLimiter(RATE_LIMIT_DB_PATH)
+
+
+@app.before_request
+def admit_request():
+    """Token-Bucket-Prüfung vor allen anderen Hooks; über dem Limit: 429 mit Retry-After"""
+    if not RATE_LIMIT_ENABLED or request.method == 'OPTIONS' or not request.path.startswith('/api/'):
+        return None
+    user_id, user_role, is_admin = get_current_user()
+    endpoint = request.endpoint or 'unbekannt'
+    buckets = [('global', 'global', RATE_LIMIT_GLOBAL_RATE, RATE_LIMIT_GLOBAL_BURST)]
+    if user_id:
+        subject = f'user:{user_id}'
+    elif endpoint == 'login':
+        # Anmeldeversuche je (IP, Benutzername), zusätzlich begrenzt der IP-Bucket
+        # das Durchprobieren vieler Namen. Ein fremder Absender kann so keinen
+        # Benutzer aussperren, der Body allein bestimmt nie den Bucket
+        data = request.get_json(silent=True)
+        username = str(data.get('username', '')).strip().lower() if isinstance(data, dict) else ''
+        subject = f'login:{request.remote_addr}:{username}'
+        buckets.append(('ip', f'ip:{request.remote_addr}', RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST))
+    else:
+        subject = f'ip:{request.remote_addr}'
+    buckets.insert(0, ('user', subject, RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST))
+    try:
+        wait, scope = RATE_LIMITER.acquire(subject, endpoint, RATE_LIMIT_COSTS.get(endpoint, 1), buckets)
+    except sqlite3.Error as e:
+        # Ein gestörter Limiter darf die API nicht lahmlegen
+        print(f"[RATELIMIT ERROR] {str(e)}")
+        return None
+    if not wait:
+        return None
+    
+    retry_after = max(1, math.ceil(wait))
+    print(f"[RATELIMIT] {subject} gedrosselt ({scope}): {endpoint}, Retry-After {retry_after}s")
+    response = jsonify({'message': 'Zu viele Anfragen - bitte kurz warten', 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+@app.route('/api/ratelimit', methods=['GET'])
+def get_rate_limit_metrics():
+    """Admin: Limits und gedrosselte Anfragen (alle Worker); ?reset=true setzt die Zähler zurück"""
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    if not is_admin:
+        return jsonify({'message': 'Keine Berechtigung'}), 403
+    
+    metrics = RATE_LIMITER.metrics()
+    if request.args.get('reset', '').lower() == 'true':
+        RATE_LIMITER.reset_metrics()
+    return jsonify(dict(metrics, enabled=RATE_LIMIT_ENABLED, limits={
+        'user': {'rate': RATE_LIMIT_USER_RATE, 'burst': RATE_LIMIT_USER_BURST},
+        'global': {'rate': RATE_LIMIT_GLOBAL_RATE, 'burst': RATE_LIMIT_GLOBAL_BURST},
+        'costs': RATE_LIMIT_COSTS
+    })), 200
+
+
+# ============================================================
+# PAGINIERUNG (KEYSET)
+# ============================================================
+
+# Detailansichten liefern je Unterliste nur die neuesten Einträge
+DETAIL_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(sort_value, last_id):
+    payload = json.dumps([sort_value.isoformat() if hasattr(sort_value, 'isoformat') else sort_value, last_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, sort_column):
+    sort_value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    python_type = sort_column.type.python_type
+    if python_type in (datetime, date):
+        return python_type.fromisoformat(sort_value), int(last_id)
+    return python_type(sort_value), int(last_id)
+
+
+def keyset_page(query, sort_column, model, limit=DETAIL_PAGE_SIZE, cursor=None):
+    """
+    Eine Seite (neueste zuerst) über (sort_column, id) - ohne OFFSET, damit
+    auch tiefe Seiten nur den Index ab dem Cursor lesen.
+    """
+    count = query.order_by(None).count()
+    if cursor:
+        sort_value, last_id = decode_cursor(cursor, sort_column)
+        query = query.filter(db.or_(sort_column < sort_value,
+                                    db.and_(sort_column == sort_value, model.id < last_id)))
+    rows = query.order_by(sort_column.desc(), model.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], sort_column.key), rows[-1].id)
+    return {'items': rows, 'count': count, 'next_cursor': next_cursor}
+
+
+def page_summary(page):
+    return {'count': page['count'], 'next_cursor': page['next_cursor']}
+
 
 # ============================================================
 # DATENBANKMODELLE
@@ -146,16 +731,27 @@ class Customer(db.Model):
     address = db.Column(db.String(255))
     phone = db.Column(db.String(50))
     email = db.Column(db.String(120))
-    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))
+    # Denormalisiert aus visit_protocols, gepflegt von add_protocol/delete_protocol
+    last_visit_date = db.Column(db.Date)
+    visit_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     
     __table_args__ = (
         db.UniqueConstraint('customer_number', 'created_by', name='uq_customer_number_per_user'),
+        db.Index('ix_customers_geohash', 'geohash'),
+        db.Index('ix_customers_owner_geohash', 'created_by', 'geohash'),
+        db.Index('ix_customers_owner_last_visit', 'created_by', 'last_visit_date'),
     )
     
-    protocols = db.relationship('VisitProtocol', backref='customer', lazy='dynamic', cascade='all, delete-orphan')
+    protocols = db.relationship('VisitProtocol', backref='customer', lazy='dynamic', cascade='all, delete-orphan',
+                                passive_deletes=True)
     documents = db.relationship('Document', backref='customer', lazy='dynamic',
-                               foreign_keys='Document.customer_id', cascade='all, delete-orphan')
-    construction_sites = db.relationship('ConstructionSite', backref='customer', lazy='dynamic', cascade='all, delete-orphan')
+                               foreign_keys='Document.customer_id', passive_deletes=True)
+    construction_sites = db.relationship('ConstructionSite', backref='customer', lazy='dynamic', cascade='all, delete-orphan',
+                                         passive_deletes=True)
 
     def to_dict(self, include_details=False):
         data = {
@@ -165,22 +761,34 @@ class Customer(db.Model):
             'address': self.address,
             'phone': self.phone,
             'email': self.email,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'last_visit_date': self.last_visit_date.strftime('%Y-%m-%d') if self.last_visit_date else None,
+            'visit_count': self.visit_count or 0,
             'created_by': self.created_by
         }
         if include_details:
-            data['protocols'] = [p.to_dict() for p in self.protocols.order_by(VisitProtocol.visit_date.desc()).all()]
-            data['documents'] = [d.to_dict() for d in self.documents.order_by(Document.created_at.desc()).all()]
-            data['construction_sites'] = [s.to_dict() for s in self.construction_sites.all()]
+            protocols = keyset_page(self.protocols, VisitProtocol.visit_date, VisitProtocol)
+            documents = keyset_page(self.documents, Document.created_at, Document)
+            sites = keyset_page(self.construction_sites, ConstructionSite.id, ConstructionSite)
+            data['protocols'] = [p.to_dict() for p in protocols['items']]
+            data['documents'] = [d.to_dict() for d in documents['items']]
+            data['construction_sites'] = [s.to_dict() for s in sites['items']]
+            data['pagination'] = {
+                'protocols': page_summary(protocols),
+                'documents': page_summary(documents),
+                'construction_sites': page_summary(sites)
+            }
         return data
 
 
 class VisitProtocol(db.Model):
     __tablename__ = 'visit_protocols'
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customers.id', ondelete='CASCADE'), nullable=False, index=True)
     visit_date = db.Column(db.Date, nullable=False)
     summary = db.Column(db.Text, nullable=False)
-    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), index=True)
     
     def to_dict(self):
         return {
@@ -195,14 +803,23 @@ class VisitProtocol(db.Model):
 class Document(db.Model):
     __tablename__ = 'documents'
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=True)
-    construction_site_id = db.Column(db.Integer, db.ForeignKey('construction_sites.id'), nullable=True)
+    # Beim Löschen des Kunden/der Baustelle verwaist das Dokument und wird im Hintergrund entfernt
+    customer_id = db.Column(db.Integer, db.ForeignKey('customers.id', ondelete='SET NULL'), nullable=True, index=True)
+    construction_site_id = db.Column(db.Integer, db.ForeignKey('construction_sites.id', ondelete='SET NULL'),
+                                     nullable=True, index=True)
     name = db.Column(db.String(255), nullable=False)
     type = db.Column(db.String(50), nullable=False)
     file_url = db.Column(db.String(512), nullable=True)
-    file_data = db.Column(db.LargeBinary, nullable=True)
+    # Blob erst beim Zugriff laden - Listen brauchen nur has_file
+    file_data = db.deferred(db.Column(db.LargeBinary, nullable=True))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), index=True)
+    # Gesetzt, wenn Kunde/Baustelle gelöscht wurden - nur solche Dokumente entfernt der Purger
+    orphaned_at = db.Column(db.DateTime, index=True)
+
+    @property
+    def is_image(self):
+        return self.type in ('Bild', 'Foto') or os.path.splitext(self.name or '')[1].lower() in PREVIEW_EXTENSIONS
 
     def to_dict(self):
         return {
@@ -212,26 +829,58 @@ class Document(db.Model):
             'name': self.name,
             'type': self.type,
             'file_url': self.file_url or '',
-            'has_file': self.file_data is not None,
+            'has_file': bool(self.has_file),
+            'preview_url': f'/api/documents/{self.id}/preview/sm' if self.has_file and self.is_image else None,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else '',
             'created_by': self.created_by
         }
 
 
+Document.has_file = db.column_property(Document.__table__.c.file_data.isnot(None))
+
+# Vorschaugrößen (längste Kante in Pixeln)
+PREVIEW_SIZES = {'sm': 160, 'md': 480, 'lg': 1280}
+PREVIEW_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff')
+
+
+class DocumentPreview(db.Model):
+    """Verkleinerte JPEG-Fassungen eines Bild-Dokuments, neben dem Original gespeichert"""
+    __tablename__ = 'document_previews'
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id', ondelete='CASCADE'), primary_key=True)
+    size = db.Column(db.String(4), primary_key=True)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class ConstructionSite(db.Model):
     __tablename__ = 'construction_sites'
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customers.id', ondelete='CASCADE'), nullable=False, index=True)
     name = db.Column(db.String(255), nullable=False)
     address = db.Column(db.String(255), nullable=False)
     status = db.Column(db.String(50), default='Planung')
     start_date = db.Column(db.Date)
     end_date = db.Column(db.Date)
-    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_construction_sites_geohash', 'geohash'),
+        db.Index('ix_construction_sites_owner_geohash', 'created_by', 'geohash'),
+        db.Index('ix_construction_sites_owner_status', 'created_by', 'status'),
+        # Kalender: Überlappung mit einem Zeitraum direkt im Index prüfen
+        db.Index('ix_construction_sites_schedule', 'start_date', 'end_date'),
+        db.Index('ix_construction_sites_owner_schedule', 'created_by', 'start_date', 'end_date'),
+    )
     
-    notes = db.relationship('ConstructionNote', backref='construction_site', lazy='dynamic', cascade='all, delete-orphan')
+    notes = db.relationship('ConstructionNote', backref='construction_site', lazy='dynamic', cascade='all, delete-orphan',
+                           passive_deletes=True)
     documents = db.relationship('Document', backref='construction_site', lazy='dynamic',
-                               foreign_keys='Document.construction_site_id', cascade='all, delete-orphan')
+                               foreign_keys='Document.construction_site_id', passive_deletes=True)
     
     def to_dict(self, include_details=False):
         data = {
@@ -242,21 +891,31 @@ class ConstructionSite(db.Model):
             'status': self.status,
             'start_date': self.start_date.strftime('%Y-%m-%d') if self.start_date else None,
             'end_date': self.end_date.strftime('%Y-%m-%d') if self.end_date else None,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
             'created_by': self.created_by
         }
         if include_details:
-            data['notes'] = [n.to_dict() for n in self.notes.order_by(ConstructionNote.created_at.desc()).all()]
-            data['documents'] = [d.to_dict() for d in self.documents.order_by(Document.created_at.desc()).all()]
+            notes = keyset_page(self.notes.options(db.joinedload(ConstructionNote.creator)),
+                                ConstructionNote.created_at, ConstructionNote)
+            documents = keyset_page(self.documents, Document.created_at, Document)
+            data['notes'] = [n.to_dict() for n in notes['items']]
+            data['documents'] = [d.to_dict() for d in documents['items']]
+            data['pagination'] = {
+                'notes': page_summary(notes),
+                'documents': page_summary(documents)
+            }
         return data
 
 
 class ConstructionNote(db.Model):
     __tablename__ = 'construction_notes'
     id = db.Column(db.Integer, primary_key=True)
-    construction_site_id = db.Column(db.Integer, db.ForeignKey('construction_sites.id'), nullable=False)
+    construction_site_id = db.Column(db.Integer, db.ForeignKey('construction_sites.id', ondelete='CASCADE'),
+                                     nullable=False, index=True)
     note = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), index=True)
     
     creator = db.relationship('User', foreign_keys=[created_by])
     
@@ -273,11 +932,13 @@ class ConstructionNote(db.Model):
 class TourStop(db.Model):
     __tablename__ = 'tour_stops'
     id = db.Column(db.Integer, primary_key=True)
-    tour_id = db.Column(db.Integer, db.ForeignKey('tours.id', ondelete='CASCADE'), nullable=False)
+    tour_id = db.Column(db.Integer, db.ForeignKey('tours.id', ondelete='CASCADE'), nullable=False, index=True)
     customer_name = db.Column(db.String(100), nullable=False)
     address = db.Column(db.String(255), nullable=False)
     goal = db.Column(db.Text)
     order = db.Column(db.Integer, nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
 
     def to_dict(self):
         return {
@@ -285,7 +946,9 @@ class TourStop(db.Model):
             'customer_name': self.customer_name,
             'address': self.address,
             'goal': self.goal or '',
-            'order': self.order
+            'order': self.order,
+            'latitude': self.latitude,
+            'longitude': self.longitude
         }
 
 
@@ -295,10 +958,11 @@ class Tour(db.Model):
     title = db.Column(db.String(255), nullable=False)
     archived = db.Column(db.Boolean, default=False)
     completed_at = db.Column(db.DateTime, nullable=True)
-    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    stops = db.relationship('TourStop', backref='tour', lazy='dynamic', cascade='all, delete-orphan')
+    stops = db.relationship('TourStop', backref='tour', lazy='dynamic', cascade='all, delete-orphan',
+                            passive_deletes=True)
     creator = db.relationship('User', foreign_keys=[created_by])
 
     def to_dict(self):
@@ -314,744 +978,4766 @@ class Tour(db.Model):
         }
 
 
-# ============================================================
-# AUTH ROUTES
-# ============================================================
+class TourArchive(db.Model):
+    """
+    Abgeschlossene Tour in kompakter Form: eine Zeile mit Kennzahlen, die
+    Stopps als gepacktes JSON. Die Tabelle 'tours' enthält nur aktive Touren.
+    """
+    __tablename__ = 'tour_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    tour_id = db.Column(db.Integer)
+    title = db.Column(db.String(255), nullable=False)
+    stop_count = db.Column(db.Integer, nullable=False, default=0)
+    stops_payload = db.Column(db.Text, nullable=False, default='[]')
+    completed_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_tour_archive_owner_completed', 'created_by', 'completed_at'),
+        db.Index('ix_tour_archive_completed', 'completed_at'),
+    )
+    
+    creator = db.relationship('User', foreign_keys=[created_by])
 
-@app.route('/api/auth/login', methods=['POST'])
-def login():
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'success': False, 'message': 'Keine Daten'}), 400
-            
-        username = data.get('username', '').strip()
-        password = data.get('password', '')
-        
-        # SICHERHEIT: Benutzer nur nach Username suchen, Passwort separat prüfen
-        user = User.query.filter_by(username=username).first()
-        
-        if user and verify_password(user.password, password):
-            session.permanent = True
-            session['user_id'] = user.id
-            session['username'] = user.username
-            session['role'] = user.role
-            session['is_admin'] = user.is_admin
-            session.modified = True
-            print(f"[LOGIN] OK: {user.username} (ID:{user.id}, Rolle:{user.role})")
-            return jsonify({'success': True, 'user': user.to_dict()}), 200
-        
-        print(f"[LOGIN] FEHLGESCHLAGEN für: {username}")
-        return jsonify({'success': False, 'message': 'Ungültige Anmeldedaten'}), 401
-    except Exception as e:
-        print(f"[LOGIN ERROR] {str(e)}")
-        return jsonify({'success': False, 'message': str(e)}), 500
+    def to_dict(self, include_stops=True):
+        data = {
+            'id': self.id,
+            'tour_id': self.tour_id,
+            'title': self.title,
+            'archived': True,
+            'stop_count': self.stop_count,
+            'completed_at': self.completed_at.strftime('%Y-%m-%d %H:%M:%S') if self.completed_at else None,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else '',
+            'created_by': self.created_by,
+            'created_by_name': self.creator.username if self.creator else 'Unbekannt'
+        }
+        if include_stops:
+            data['stops'] = json.loads(self.stops_payload)
+        return data
 
 
-@app.route('/api/auth/logout', methods=['POST'])
-def logout():
-    print(f"[LOGOUT] {session.get('username', 'unknown')}")
-    session.clear()
-    return jsonify({'success': True}), 200
+class UserStat(db.Model):
+    """Inkrementell gepflegter Zähler je Mitarbeiter, Kennzahl und Periode"""
+    __tablename__ = 'user_stats'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    metric = db.Column(db.String(30), primary_key=True)
+    period = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
 
 
-@app.route('/api/auth/check', methods=['GET'])
-def check_auth():
-    if 'user_id' in session:
-        user = User.query.get(session['user_id'])
-        if user:
-            return jsonify({'authenticated': True, 'user': user.to_dict()}), 200
-    return jsonify({'authenticated': False}), 401
+class GeocodeCache(db.Model):
+    """Persistenter Cache: normalisierte Adresse -> Koordinaten (auch Fehltreffer)"""
+    __tablename__ = 'geocode_cache'
+    address_key = db.Column(db.String(255), primary_key=True)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    provider = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
 # ============================================================
-# CUSTOMER ROUTES - STRIKTE DATENISOLATION
+# SHARD-MODUS (OPTIONAL)
 # ============================================================
 
-@app.route('/api/customers', methods=['GET'])
-def list_customers():
-    user_id, user_role, is_admin = get_current_user()
-    
-    if not user_id:
-        return jsonify([]), 200
-    
-    try:
-        if user_role == 'Außendienst':
-            customers = Customer.query.filter_by(created_by=user_id).all()
-        else:
-            customers = Customer.query.all()
-        
-        print(f"[CUSTOMERS] User {user_id} ({user_role}): {len(customers)} Kunden")
-        return jsonify([c.to_dict() for c in customers]), 200
-    except Exception as e:
-        print(f"[CUSTOMERS ERROR] {str(e)}")
-        return jsonify([]), 200
+# Daten eines Außendienstlers; users, user_stats und geocode_cache bleiben im Katalog
+SHARDED_TABLES = frozenset({'customers', 'visit_protocols', 'documents', 'document_previews',
+                            'construction_sites', 'construction_notes', 'tours', 'tour_stops', 'tour_archive'})
+# IDs sind über alle Shards eindeutig: Shard n vergibt IDs ab n * SHARD_ID_SPAN,
+# Detail-Routen finden den Shard allein über die ID
+SHARD_ID_SPAN = 1 << 32
+SHARD_FILE_PATTERN = re.compile(r'^shard_(\d+)\.db$')
+# Routen-Parameter bzw. JSON-Felder, deren ID den Shard bestimmt
+SHARD_VIEW_ARGS = ('id', 'site_id')
+SHARD_BODY_FIELDS = ('customer_id', 'construction_site_id')
 
+_shard_engines = {}
+_shard_lock = threading.Lock()
+_shard_local = threading.local()
+_shard_executor = {'pid': None, 'pool': None}
+_UNSET = object()
 
-@app.route('/api/customers/<int:id>', methods=['GET'])
-def get_customer(id):
-    user_id, user_role, is_admin = get_current_user()
-    
-    if not user_id:
-        return jsonify({'message': 'Nicht angemeldet'}), 401
-    
-    try:
-        customer = Customer.query.get(id)
-        if not customer:
-            return jsonify({'message': 'Kunde nicht gefunden'}), 404
-        
-        if user_role == 'Außendienst' and customer.created_by != user_id:
-            return jsonify({'message': 'Keine Berechtigung'}), 403
-            
-        return jsonify(customer.to_dict(include_details=True)), 200
-    except Exception as e:
-        print(f"[CUSTOMER ERROR] {str(e)}")
-        return jsonify({'message': str(e)}), 500
+if SHARD_MODE:
+    # AUTOINCREMENT: sqlite_sequence hält den ID-Startwert des Shards
+    for table in db.metadata.sorted_tables:
+        if table.name in SHARDED_TABLES and len(table.primary_key.columns) == 1:
+            table.dialect_kwargs['sqlite_autoincrement'] = True
 
 
-@app.route('/api/customers', methods=['POST'])
-def add_customer():
-    user_id, user_role, is_admin = get_current_user()
-    if not user_id:
-        return jsonify({'message': 'Nicht angemeldet'}), 401
-    
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'message': 'Keine Daten'}), 400
-            
-        customer_number = data.get('customer_number', '').strip()
-        name = data.get('name', '').strip()
-        
-        if not customer_number or not name:
-            return jsonify({'message': 'Kundennummer und Name sind erforderlich'}), 400
+def shard_tables():
+    """Schema einer Shard-Datei: Außendienst-Tabellen plus Nutzer-Kopie"""
+    return [table for table in db.metadata.sorted_tables
+            if table.name in SHARDED_TABLES or table.name == User.__tablename__]
 
-        existing = Customer.query.filter_by(customer_number=customer_number, created_by=user_id).first()
-        if existing:
-            return jsonify({'message': 'Kundennummer existiert bereits'}), 409
 
-        new_customer = Customer(
-            customer_number=customer_number,
-            name=name,
-            address=data.get('address', '').strip() if data.get('address') else '',
-            phone=data.get('phone', '').strip() if data.get('phone') else '',
-            email=data.get('email', '').strip() if data.get('email') else '',
-            created_by=user_id
-        )
-        db.session.add(new_customer)
-        db.session.commit()
-        
-        print(f"[CUSTOMER] Erstellt: {new_customer.id} von User {user_id}")
-        return jsonify(new_customer.to_dict()), 201
-    except Exception as e:
-        db.session.rollback()
-        print(f"[CUSTOMER CREATE ERROR] {str(e)}")
-        return jsonify({'message': str(e)}), 500
+def shard_path(user_id):
+    return os.path.join(SHARD_DIR, f'shard_{user_id}.db')
 
 
-@app.route('/api/customers/<int:id>', methods=['PUT'])
-def update_customer(id):
-    user_id, user_role, is_admin = get_current_user()
-    
-    if not user_id:
-        return jsonify({'message': 'Nicht angemeldet'}), 401
+def shard_ids():
+    """Außendienstler mit vorhandener Shard-Datei"""
+    if not os.path.isdir(SHARD_DIR):
+        return []
+    return sorted(int(match.group(1)) for match in map(SHARD_FILE_PATTERN.match, os.listdir(SHARD_DIR)) if match)
+
+
+def shard_of_id(object_id):
+    """Shard eines Datensatzes aus seiner ID (None ohne Shard-Modus)"""
+    if not SHARD_MODE or not object_id or object_id < SHARD_ID_SPAN:
+        return None
+    return object_id // SHARD_ID_SPAN
+
+
+def create_shard(user_id, path):
+    """
+    Neue Shard-Datei: Schema, ID-Startwerte und eine Kopie der Nutzer (für
+    Fremdschlüssel und Ersteller-Namen). Erst vollständig aufgebaut, dann
+    per Hardlink veröffentlicht - ein parallel startender Prozess verliert
+    das Rennen, ohne eine halbe Datei zu sehen.
+    """
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(prefix='.shard_', suffix='.db', dir=SHARD_DIR)
+    os.close(handle)
+    engine = create_engine(f'sqlite:///{temp_path}')
+    try:
+        tables = shard_tables()
+        with db.engine.connect() as conn:
+            users = [dict(row, password='') for row in conn.execute(
+                db.select(User.id, User.username, User.role, User.is_admin)).mappings()]
+        with engine.begin() as conn:
+            db.metadata.create_all(conn, tables=tables)
+            conn.exec_driver_sql('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', [
+                (table.name, user_id * SHARD_ID_SPAN) for table in tables
+                if table.name in SHARDED_TABLES and table.dialect_kwargs.get('sqlite_autoincrement')])
+            if users:
+                conn.execute(db.insert(User.__table__), users)
+        engine.dispose()
+        try:
+            os.link(temp_path, path)
+            print(f"[SHARDS] Shard für User {user_id} angelegt")
+        except FileExistsError:
+            pass
+    finally:
+        engine.dispose()
+        os.remove(temp_path)
+
+
+def shard_engine(user_id):
+    """Engine des Shards (pro Prozess zwischengespeichert), legt fehlende Dateien an"""
+    key = (os.getpid(), user_id)
+    engine = _shard_engines.get(key)
+    if engine is None:
+        with _shard_lock:
+            engine = _shard_engines.get(key)
+            if engine is None:
+                path = shard_path(user_id)
+                if not os.path.exists(path):
+                    create_shard(user_id, path)
+                engine = _shard_engines[key] = create_engine(f'sqlite:///{os.path.abspath(path)}')
+    return engine
+
+
+def drop_shard(user_id):
+    """Shard-Datei eines gelöschten Nutzers entfernen (ersetzt die Kaskade im Katalog)"""
+    with _shard_lock:
+        engine = _shard_engines.pop((os.getpid(), user_id), None)
+    if engine is not None:
+        engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(shard_path(user_id) + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def mirror_user(user_id, row=None):
+    """Nutzer-Kopie in allen Shards anlegen bzw. (row=None) entfernen - samt Kaskade im Shard"""
+    users = User.__table__
+    for shard in shard_ids():
+        with shard_engine(shard).begin() as conn:
+            if row is None:
+                conn.execute(db.delete(users).where(users.c.id == user_id))
+            else:
+                conn.execute(db.insert(users).prefix_with('OR IGNORE'), dict(row, password=''))
+
+
+def current_shard():
+    """Gewählter Shard: explizit per use_shard(), sonst der des laufenden Requests"""
+    shard = getattr(_shard_local, 'shard', _UNSET)
+    if shard is not _UNSET:
+        return shard
+    return g.get('shard') if has_request_context() else None
+
+
+def require_shard():
+    shard = current_shard()
+    if shard is None:
+        raise RuntimeError('Kein Shard gewählt - Abfrage über across_shards() ausführen')
+    return shard
+
+
+@contextmanager
+def use_shard(user_id):
+    """Shard für den Block festlegen; None heißt: alle Shards (across_shards verteilt)"""
+    previous = getattr(_shard_local, 'shard', _UNSET)
+    _shard_local.shard = user_id
+    try:
+        yield
+    finally:
+        _shard_local.shard = previous
+
+
+def touches_shard(mapper, clause):
+    if mapper is not None:
+        return db.inspect(mapper).local_table.name in SHARDED_TABLES
+    if clause is None:
+        return False
+    return any(table.name in SHARDED_TABLES for table in find_tables(clause, include_crud=True))
+
+
+def fans_out():
+    """Innendienst/Admin-Übersichten: kein einzelner Shard gewählt"""
+    return SHARD_MODE and current_shard() is None
+
+
+def visible_shards():
+    if not SHARD_MODE:
+        return [None]
+    shard = current_shard()
+    return [shard] if shard is not None else shard_ids()
+
+
+def run_in_shard(shard, fn):
+    with app.app_context(), use_shard(shard):
+        return fn()
+
+
+def across_shards(fn):
+    """
+    fn im aktuellen Shard ausführen; ohne gewählten Shard (Innendienst, CLI,
+    Hintergrund-Threads) parallel in jedem Shard mit eigener Session.
+    Liefert die Einzelergebnisse als Liste - fn darf `request` nicht lesen.
+    """
+    if not fans_out():
+        return [fn()]
+    shards = shard_ids()
+    if len(shards) <= 1:
+        results = []
+        for shard in shards:
+            with use_shard(shard):
+                results.append(fn())
+        return results
+    if _shard_executor['pid'] != os.getpid():
+        _shard_executor['pid'] = os.getpid()
+        _shard_executor['pool'] = ThreadPoolExecutor(max_workers=SHARD_FANOUT_WORKERS,
+                                                     thread_name_prefix='shard-fanout')
+    return list(_shard_executor['pool'].map(lambda shard: run_in_shard(shard, fn), shards))
+
+
+def concat_shards(parts):
+    """Listen mehrerer Shards zusammenführen; IDs und damit Sortierung bleiben aufsteigend"""
+    return [item for part in parts for item in part]
+
+
+def request_shard(user_id, user_role):
+    """
+    Shard des Requests: ausgewählter Außendienstler, sonst die ID des
+    angefragten Datensatzes, sonst der eigene (Außendienst) bzw. keiner.
+    """
+    args = request.view_args or {}
+    if 'target_user_id' in args:
+        return args['target_user_id']
+    candidates = [args.get(key) for key in SHARD_VIEW_ARGS]
+    body = request.get_json(silent=True) if request.is_json else None
+    if isinstance(body, dict):
+        candidates += [body.get(key) for key in SHARD_BODY_FIELDS]
+    for candidate in candidates:
+        shard = shard_of_id(candidate) if isinstance(candidate, int) else None
+        # Unbekannter Shard: Datensatz existiert nicht, der eigene Shard liefert das 404
+        if shard is not None and os.path.exists(shard_path(shard)):
+            return shard
+    return user_id if user_role == 'Außendienst' else None
+
+
+@app.before_request
+def route_shard():
+    if SHARD_MODE and request.path.startswith('/api/'):
+        user_id, user_role, is_admin = get_current_user()
+        g.shard = request_shard(user_id, user_role) if user_id else None
+
+
+# ============================================================
+# GROUP-COMMIT FÜR KLEINE SCHREIBZUGRIFFE
+# ============================================================
+
+class GroupCommitWriter:
+    """
+    Ein Writer-Thread pro Prozess: sammelt die Aufträge paralleler Requests
+    (bis GROUP_COMMIT_WINDOW_MS bzw. GROUP_COMMIT_MAX_BATCH) und committet sie
+    gemeinsam. Scheitert ein Batch, laufen die Aufträge einzeln erneut, damit
+    ein fehlerhafter Auftrag nur seinen eigenen Request betrifft.
+    """
+
+    def __init__(self, window_ms, max_batch, session_factory=None):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        # Ohne Factory: db.session im App-Kontext des Writer-Threads
+        self.session_factory = session_factory
+        self.batches = 0
+        self.writes = 0
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, unit):
+        """unit(session) schreibt ohne Commit; liefert dessen Ergebnis nach dem Commit"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = Queue()
+                threading.Thread(target=self._run, name='group-commit', daemon=True).start()
+        future = Future()
+        self._queue.put((unit, current_shard(), future))
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                if self.session_factory is None:
+                    with app.app_context():
+                        self._commit(db.session, batch)
+                else:
+                    with self.session_factory() as session:
+                        self._commit(session, batch)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _commit(self, session, batch):
+        try:
+            results = []
+            for unit, shard, _ in batch:
+                with use_shard(shard):
+                    results.append(unit(session))
+                    session.flush()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            if len(batch) == 1:
+                batch[0][2].set_exception(e)
+                return
+            print(f"[GROUP COMMIT] Batch mit {len(batch)} Aufträgen gescheitert, einzeln wiederholt: {str(e)}")
+            for item in batch:
+                self._commit(session, [item])
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+group_writer = GroupCommitWriter(GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_BATCH)
+
+
+def commit_write(unit):
+    """
+    Kleinen Schreibzugriff ausführen: unit(session) ohne eigenen Commit. Mit
+    SQLITE_GROUP_COMMIT im Writer-Thread gebündelt - unit darf dann weder
+    `request` lesen noch Objekte der Request-Session verwenden.
+    """
+    if SQLITE_GROUP_COMMIT:
+        # Verbindung des Requests freigeben, sonst kann der Pool beim Warten leerlaufen
+        db.session.commit()
+        return group_writer.submit(unit)
+    result = unit(db.session)
+    db.session.commit()
+    return result
+
+
+# ============================================================
+# GEOKODIERUNG & RÄUMLICHER INDEX
+# ============================================================
+
+PLZ_PATTERN = re.compile(r'\b(\d{5})\b')
+
+# Grobe Rückfallebene ohne PLZ-Datei: Zentren großer Städte je PLZ-Leitregion
+PLZ_REGION_CENTERS = {
+    '01': (51.050, 13.738),  # Dresden
+    '04': (51.340, 12.375),  # Leipzig
+    '10': (52.520, 13.405),  # Berlin
+    '12': (52.520, 13.405),  # Berlin
+    '13': (52.520, 13.405),  # Berlin
+    '14': (52.391, 13.065),  # Potsdam
+    '20': (53.551, 9.994),   # Hamburg
+    '22': (53.551, 9.994),   # Hamburg
+    '28': (53.079, 8.802),   # Bremen
+    '30': (52.375, 9.732),   # Hannover
+    '40': (51.227, 6.774),   # Düsseldorf
+    '44': (51.514, 7.466),   # Dortmund
+    '45': (51.456, 7.012),   # Essen
+    '50': (50.938, 6.960),   # Köln
+    '51': (50.938, 6.960),   # Köln
+    '60': (50.110, 8.682),   # Frankfurt am Main
+    '70': (48.776, 9.183),   # Stuttgart
+    '80': (48.137, 11.576),  # München
+    '81': (48.137, 11.576),  # München
+    '90': (49.452, 11.077),  # Nürnberg
+}
+
+
+class Geocoder:
+    """Basis-Geocoder: Adresse -> (lat, lon) oder None"""
+    name = 'none'
+    # Netzwerkzugriff: nicht im Request, sondern im Job 'geocode' (siehe apply_location)
+    remote = False
+
+    def geocode(self, address):
+        return None
+
+
+class PostalCodeGeocoder(Geocoder):
+    """Offline: PLZ aus der Adresse, Koordinaten aus lokaler Tabelle (CSV: plz;lat;lon)"""
+    name = 'plz'
+
+    def __init__(self, path):
+        self.table = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    parts = line.strip().split(';')
+                    if len(parts) >= 3 and parts[0].isdigit():
+                        self.table[parts[0]] = (float(parts[1]), float(parts[2]))
+            print(f"[GEO] {len(self.table)} PLZ-Koordinaten geladen")
+
+    def geocode(self, address):
+        match = PLZ_PATTERN.search(address or '')
+        if not match:
+            return None
+        plz = match.group(1)
+        return self.table.get(plz) or PLZ_REGION_CENTERS.get(plz[:2])
+
+
+class NominatimGeocoder(Geocoder):
+    """HTTP-Geokodierung gegen eine Nominatim-kompatible API (auch lokaler Ersatzdienst)"""
+    name = 'nominatim'
+    remote = True
+
+    def __init__(self, url):
+        self.url = url
+
+    def geocode(self, address):
+        query = urllib.parse.urlencode({'q': address, 'format': 'json', 'limit': 1})
+        req = urllib.request.Request(f"{self.url}?{query}", headers={'User-Agent': 'CustomerPro/1.0'})
+        with urllib.request.urlopen(req, timeout=5) as response:
+            results = json.loads(response.read().decode('utf-8'))
+        if not results:
+            return None
+        return float(results[0]['lat']), float(results[0]['lon'])
+
+
+def create_geocoder(kind):
+    if kind == 'nominatim':
+        return NominatimGeocoder(GEOCODER_URL)
+    if kind == 'plz':
+        return PostalCodeGeocoder(GEOCODER_PLZ_FILE)
+    return Geocoder()
+
+
+geocoder = create_geocoder(GEOCODER)
+
+
+def normalize_address(address):
+    return ' '.join((address or '').lower().split())[:255]
+
+
+def geocode_address(address, remote=True):
+    """
+    Koordinaten aus dem persistenten Cache, sonst vom Geocoder (Ergebnis wird
+    gecacht). remote=False: einen Netzwerk-Geocoder nicht fragen, nur den Cache.
+    """
+    key = normalize_address(address)
+    if not key:
+        return None, None
+    cached = db.session.get(GeocodeCache, key)
+    # Fehltreffer eines anderen Geocoders erneut versuchen
+    if cached and (cached.latitude is not None or cached.provider == geocoder.name):
+        return cached.latitude, cached.longitude
+    if geocoder.remote and not remote:
+        return None, None
+    try:
+        result = geocoder.geocode(address)
+    except Exception as e:
+        # Netzwerk-/Dienstfehler nicht cachen
+        print(f"[GEO ERROR] {str(e)}")
+        return None, None
+    lat, lon = result if result else (None, None)
+    if geocoder.name != 'none':
+        db.session.merge(GeocodeCache(address_key=key, latitude=lat, longitude=lon,
+                                      provider=geocoder.name, created_at=datetime.utcnow()))
+    return lat, lon
+
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+KM_PER_DEGREE = 111.32
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            rng[0] = mid
+        else:
+            bits = bits * 2
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """(Höhe, Breite) einer Geohash-Zelle in Grad"""
+    lat_bits = 5 * precision // 2
+    lon_bits = 5 * precision - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def geohash_cover(lat, lon, radius_km):
+    """
+    Geohash-Präfixe, die den Suchkreis vollständig abdecken: feinste Zelle,
+    die mindestens so groß wie der Radius ist, plus ihre 8 Nachbarn.
+    """
+    cos_lat = max(math.cos(math.radians(lat)), 0.01)
+    precision = 1
+    for p in range(GEOHASH_PRECISION, 0, -1):
+        dlat, dlon = geohash_cell_size(p)
+        if dlat * KM_PER_DEGREE >= radius_km and dlon * KM_PER_DEGREE * cos_lat >= radius_km:
+            precision = p
+            break
+    dlat, dlon = geohash_cell_size(precision)
+    cells = set()
+    for i in (-1, 0, 1):
+        for j in (-1, 0, 1):
+            cell_lat = min(max(lat + i * dlat, -90.0), 90.0 - 1e-9)
+            cell_lon = (lon + j * dlon + 180.0) % 360.0 - 180.0
+            cells.add(geohash_encode(cell_lat, cell_lon, precision))
+    return sorted(cells)
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Luftlinie von einem Punkt zu vielen Punkten (vektorisiert)"""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2 = np.radians(np.asarray(lats, dtype=float))
+    lon2 = np.radians(np.asarray(lons, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def apply_location(obj, data):
+    """
+    Koordinaten aus dem Request übernehmen oder die Adresse geokodieren. Im
+    Request wird ein Netzwerk-Geocoder nicht gefragt (bis zu 5 s je Adresse bei
+    offener Transaktion); True heißt: nach dem Commit geocode_later aufrufen.
+    """
+    lat, lon = data.get('latitude'), data.get('longitude')
+    if lat is None or lon is None:
+        lat, lon = geocode_address(obj.address, remote=not has_request_context())
+    obj.latitude = float(lat) if lat is not None else None
+    obj.longitude = float(lon) if lon is not None else None
+    if hasattr(obj, 'geohash'):
+        obj.geohash = geohash_encode(obj.latitude, obj.longitude) if obj.latitude is not None else None
+    return obj.latitude is None and bool(obj.address) and geocoder.remote and has_request_context()
+
+
+def nearby_query(model, lat, lon, radius_km, owner_id=None):
+    """
+    Objekte im Umkreis über den Geohash-Index: nur die Kandidaten der
+    abdeckenden Zellen werden geladen, danach exakte Entfernung.
+    Liefert [(entfernung_km, objekt)] aufsteigend sortiert.
+    """
+    cells = geohash_cover(lat, lon, radius_km)
+    # Präfixsuche als Bereichsabfrage, damit jede Datenbank den Index nutzt
+    query = model.query.filter(db.or_(*[
+        db.and_(model.geohash >= cell, model.geohash < cell + '~') for cell in cells
+    ]))
+    if owner_id is not None:
+        query = query.filter(model.created_by == owner_id)
+    candidates = query.all()
+    if not candidates:
+        return []
+    distances = haversine_km(lat, lon, [c.latitude for c in candidates], [c.longitude for c in candidates])
+    hits = [(float(d), c) for d, c in zip(distances, candidates) if d <= radius_km]
+    hits.sort(key=lambda hit: hit[0])
+    return hits
+
+
+def nearby_response(model, label):
+    """Gemeinsamer Ablauf der /nearby-Endpoints"""
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify([]), 200
+    
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        radius = min(float(request.args.get('radius', 10)), 1000.0)
+        limit = int(request.args.get('limit', 50))
+    except (KeyError, ValueError):
+        return jsonify({'message': 'lat und lon erforderlich'}), 400
+    
+    try:
+        owner_id = user_id if user_role == 'Außendienst' else None
+        
+        def nearby_in_shard():
+            result = []
+            for distance, obj in nearby_query(model, lat, lon, radius, owner_id)[:limit]:
+                data = obj.to_dict()
+                data['distance_km'] = round(distance, 2)
+                result.append(data)
+            return result
+        
+        result = concat_shards(across_shards(nearby_in_shard))
+        result.sort(key=lambda data: data['distance_km'])
+        result = result[:limit]
+        print(f"[{label}] User {user_id}: {len(result)} im Umkreis {radius} km")
+        return jsonify(result), 200
+    except Exception as e:
+        print(f"[{label} ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 500
+
+
+# ============================================================
+# SCHNELLE SERIALISIERUNG FÜR LISTEN-ENDPOINTS
+# ============================================================
+
+# Kleine Chunks halten IN-Listen unter den Parameter-Limits der Datenbanken
+IN_CHUNK_SIZE = 900
+
+
+@lru_cache(maxsize=4096)
+def format_date(value):
+    return value.strftime('%Y-%m-%d') if value else None
+
+
+def format_datetime(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else None
+
+
+def format_datetime_or_empty(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else ''
+
+
+def chunked(values, size=IN_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class RowSerializer:
+    """
+    Liest nur die benötigten Spalten als Core-Rows und baut daraus dicts in
+    exakt der Form von Model.to_dict() - ohne ORM-Objekte zu hydrieren.
+    Statement und Konverter werden pro Feldauswahl einmal kompiliert.
+    """
+
+    def __init__(self, model, fields, joins=(), extras=None):
+        self.model = model
+        self.columns = {key: (expr, formatter) for key, expr, formatter in fields}
+        # Abgeleitete Felder (z.B. Tour-Stopps), nachgeladen über die ID
+        self.extras = extras or {}
+        self.default_keys = [key for key, _, _ in fields] + list(self.extras)
+        self.joins = joins
+        self._compiled = {}
+
+    def resolve_fields(self, requested=None):
+        """?fields=a,b -> gültige Schlüssel in der Reihenfolge von to_dict()"""
+        if not requested:
+            return tuple(self.default_keys)
+        wanted = {name.strip() for name in requested.split(',') if name.strip()}
+        unknown = wanted - set(self.default_keys)
+        if unknown:
+            raise ValueError(f"Unbekannte Felder: {', '.join(sorted(unknown))}")
+        return tuple(key for key in self.default_keys if key in wanted)
+
+    def _compile(self, keys):
+        compiled = self._compiled.get(keys)
+        if compiled is not None:
+            return compiled
+        column_keys = [key for key in keys if key in self.columns]
+        extras = [key for key in keys if key in self.extras]
+        # Für abgeleitete Felder wird die ID intern mitgelesen
+        hidden_id = bool(extras) and 'id' not in column_keys
+        if hidden_id:
+            column_keys.append('id')
+        stmt = db.select(*[self.columns[key][0].label(key) for key in column_keys]).select_from(self.model)
+        for target, onclause in self.joins:
+            stmt = stmt.outerjoin(target, onclause)
+        stmt = stmt.order_by(self.model.id)
+        formatters = [(i, self.columns[key][1]) for i, key in enumerate(column_keys) if self.columns[key][1]]
+        column_keys = tuple(column_keys)
+
+        def convert(rows):
+            if not formatters:
+                return [dict(zip(column_keys, row)) for row in rows]
+            items = []
+            for row in rows:
+                values = list(row)
+                for i, formatter in formatters:
+                    values[i] = formatter(values[i])
+                items.append(dict(zip(column_keys, values)))
+            return items
+
+        compiled = self._compiled[keys] = (stmt, convert, extras, hidden_id)
+        return compiled
+
+    def statement(self, *criteria, fields=None):
+        """(Statement, Konverter, Nachbearbeitung) für eigene Ausführung, z.B. Streaming"""
+        stmt, convert, extras, hidden_id = self._compile(self.resolve_fields(fields))
+
+        def finish(items):
+            for key in extras:
+                self.extras[key](items)
+            if hidden_id:
+                for item in items:
+                    del item['id']
+            return items
+
+        return stmt.where(*criteria), convert, finish
+
+    def fetch(self, *criteria, fields=None):
+        stmt, convert, finish = self.statement(*criteria, fields=fields)
+        return finish(convert(db.session.execute(stmt).all()))
+
+
+stop_serializer = RowSerializer(TourStop, [
+    ('id', TourStop.id, None),
+    ('customer_name', TourStop.customer_name, None),
+    ('address', TourStop.address, None),
+    ('goal', db.func.coalesce(TourStop.goal, ''), None),
+    ('order', TourStop.order, None),
+    ('latitude', TourStop.latitude, None),
+    ('longitude', TourStop.longitude, None),
+    # Nur zur Zuordnung, wird vor der Ausgabe entfernt
+    ('tour_id', TourStop.tour_id, None),
+])
+
+
+def attach_tour_stops(tours):
+    """Stopps aller Touren mit einer Abfrage pro Chunk statt einer pro Tour"""
+    by_tour = {tour['id']: [] for tour in tours}
+    stmt, convert, finish = stop_serializer.statement()
+    stmt = stmt.order_by(None).order_by(TourStop.tour_id, TourStop.order, TourStop.id)
+    for ids in chunked(list(by_tour)):
+        for stop in convert(db.session.execute(stmt.where(TourStop.tour_id.in_(ids))).all()):
+            by_tour[stop.pop('tour_id')].append(stop)
+    for tour in tours:
+        tour['stops'] = by_tour[tour['id']]
+
+
+user_serializer = RowSerializer(User, [
+    ('id', User.id, None),
+    ('username', User.username, None),
+    ('role', User.role, None),
+    ('is_admin', User.is_admin, None),
+])
+
+customer_serializer = RowSerializer(Customer, [
+    ('id', Customer.id, None),
+    ('customer_number', Customer.customer_number, None),
+    ('name', Customer.name, None),
+    ('address', Customer.address, None),
+    ('phone', Customer.phone, None),
+    ('email', Customer.email, None),
+    ('latitude', Customer.latitude, None),
+    ('longitude', Customer.longitude, None),
+    ('last_visit_date', Customer.last_visit_date, format_date),
+    ('visit_count', db.func.coalesce(Customer.visit_count, 0), None),
+    ('created_by', Customer.created_by, None),
+])
+
+site_serializer = RowSerializer(ConstructionSite, [
+    ('id', ConstructionSite.id, None),
+    ('customer_id', ConstructionSite.customer_id, None),
+    ('name', ConstructionSite.name, None),
+    ('address', ConstructionSite.address, None),
+    ('status', ConstructionSite.status, None),
+    ('start_date', ConstructionSite.start_date, format_date),
+    ('end_date', ConstructionSite.end_date, format_date),
+    ('latitude', ConstructionSite.latitude, None),
+    ('longitude', ConstructionSite.longitude, None),
+    ('created_by', ConstructionSite.created_by, None),
+])
+
+tour_serializer = RowSerializer(Tour, [
+    ('id', Tour.id, None),
+    ('title', Tour.title, None),
+    ('archived', Tour.archived, None),
+    ('completed_at', Tour.completed_at, format_datetime),
+    ('created_at', Tour.created_at, format_datetime_or_empty),
+    ('created_by', Tour.created_by, None),
+    ('created_by_name', db.func.coalesce(User.username, 'Unbekannt'), None),
+], joins=[(User, User.id == Tour.created_by)], extras={'stops': attach_tour_stops})
+
+
+def attach_archive_stops(entries):
+    """Gepackte Stopps der Archiv-Einträge nachladen und entpacken"""
+    payloads = {}
+    for ids in chunked([entry['id'] for entry in entries]):
+        payloads.update(db.session.execute(
+            db.select(TourArchive.id, TourArchive.stops_payload).where(TourArchive.id.in_(ids))
+        ).all())
+    for entry in entries:
+        entry['stops'] = json.loads(payloads[entry['id']])
+
+
+archive_serializer = RowSerializer(TourArchive, [
+    ('id', TourArchive.id, None),
+    ('tour_id', TourArchive.tour_id, None),
+    ('title', TourArchive.title, None),
+    ('archived', db.literal(True), None),
+    ('stop_count', TourArchive.stop_count, None),
+    ('completed_at', TourArchive.completed_at, format_datetime),
+    ('created_at', TourArchive.created_at, format_datetime_or_empty),
+    ('created_by', TourArchive.created_by, None),
+    ('created_by_name', db.func.coalesce(User.username, 'Unbekannt'), None),
+], joins=[(User, User.id == TourArchive.created_by)], extras={'stops': attach_archive_stops})
+
+
+# orjson weicht von jsonify ab: UTF-8 statt Escapes für alles außerhalb von ' '..'~',
+# und Gleitkommazahlen mit Exponent oder zwischen 1e-5 und 1e-4 ('1e-7' statt '1e-07')
+NON_ASCII_JSON = re.compile(r'[^\x00-\x7e]')
+JSON_FLOAT_HINT = re.compile(rb'\de|0\.0000')
+JSON_STRING_OR_NUMBER = re.compile(r'"(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?:e[+-]?\d+)?')
+
+
+def escape_json_char(match):
+    code = ord(match.group())
+    if code > 0xFFFF:
+        # Außerhalb der BMP wie json.dumps als Surrogatpaar
+        code -= 0x10000
+        return '\\u%04x\\u%04x' % (0xD800 + (code >> 10), 0xDC00 + (code & 0x3FF))
+    return '\\u%04x' % code
+
+
+def format_json_number(match):
+    token = match.group()
+    if token.startswith('"') or ('.' not in token and 'e' not in token):
+        return token
+    return repr(float(token))
+
+
+def ascii_json(body):
+    """
+    orjson-Ausgabe Byte für Byte an json.dumps/jsonify angleichen. Der
+    Normalfall (ASCII, keine auffälligen Zahlen) wird nur geprüft, nicht kopiert.
+    """
+    if not body.isascii() or b'\x7f' in body:
+        body = NON_ASCII_JSON.sub(escape_json_char, body.decode('utf-8')).encode('ascii')
+    if JSON_FLOAT_HINT.search(body):
+        body = JSON_STRING_OR_NUMBER.sub(format_json_number, body.decode('ascii')).encode('ascii')
+    return body
+
+
+def encode_json(data):
+    """
+    Kompaktes JSON mit sortierten Schlüsseln, Byte für Byte wie
+    json.dumps(ensure_ascii=True) bzw. jsonify im kompakten Modus (ohne
+    Zeilenumbruch) - mit und ohne orjson, z.B. 'Müller' als 'M\\u00fcller'.
+    Geprüft mit `flask check-json`.
+    """
+    if orjson is not None:
+        return ascii_json(orjson.dumps(data, option=orjson.OPT_SORT_KEYS))
+    return json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+# Zeilen pro Batch beim Streaming (Server-Cursor)
+STREAM_BATCH_SIZE = 500
+
+
+def wants_stream():
+    return request.args.get('stream', 'false').lower() == 'true'
+
+
+def stream_json_array(stmt, convert, finish, label, batch_size=STREAM_BATCH_SIZE):
+    """
+    JSON-Array stückweise senden: der Server-Cursor liefert Batches, jeder
+    Batch wird serialisiert und sofort geschrieben - der Speicherbedarf pro
+    Request bleibt unabhängig von der Ergebnisgröße konstant.
+    """
+    def generate():
+        yield b'['
+        count = 0
+        result = db.session.execute(stmt.execution_options(yield_per=batch_size))
+        for rows in result.partitions():
+            chunk = b','.join(encode_json(item) for item in finish(convert(rows)))
+            yield (b',' + chunk) if count else chunk
+            count += len(rows)
+        yield b']\n'
+        print(f"[{label}] {count} Einträge gestreamt")
+
+    return app.response_class(stream_with_context(generate()), mimetype='application/json')
+
+
+def jsonify_is_compact():
+    """jsonify schreibt kompakt, sortiert und ASCII - außer z.B. unter app.debug (eingerückt)"""
+    provider = app.json
+    compact = getattr(provider, 'compact', None)
+    return (compact or (compact is None and not app.debug)) and getattr(provider, 'sort_keys', False) \
+        and getattr(provider, 'ensure_ascii', False)
+
+
+def json_response(data, status=200):
+    """
+    JSON-Antwort über orjson (falls installiert), sonst über jsonify - in beiden
+    Fällen dieselben Bytes. Formatiert jsonify anders (Debug), gilt jsonify.
+    """
+    if orjson is None or not jsonify_is_compact():
+        return jsonify(data), status
+    body = ascii_json(orjson.dumps(data, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE))
+    return app.response_class(body, status=status, mimetype='application/json')
+
+
+# ============================================================
+# AUTH ROUTES
+# ============================================================
+
+@app.route('/api/auth/login', methods=['POST'])
+def login():
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'success': False, 'message': 'Keine Daten'}), 400
+            
+        username = data.get('username', '').strip()
+        password = data.get('password', '')
+        
+        # SICHERHEIT: Benutzer nur nach Username suchen, Passwort separat prüfen
+        user = User.query.filter_by(username=username).first()
+        
+        if user and verify_password(user.password, password):
+            # SICHERHEIT: Neue Session-ID, eine vorher untergeschobene ID wird wertlos
+            session.clear()
+            session.regenerate()
+            session.permanent = True
+            session['user'] = user.to_dict()
+            print(f"[LOGIN] OK: {user.username} (ID:{user.id}, Rolle:{user.role})")
+            return jsonify({'success': True, 'user': user.to_dict()}), 200
+        
+        print(f"[LOGIN] FEHLGESCHLAGEN für: {username}")
+        return jsonify({'success': False, 'message': 'Ungültige Anmeldedaten'}), 401
+    except Exception as e:
+        print(f"[LOGIN ERROR] {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/api/auth/logout', methods=['POST'])
+def logout():
+    print(f"[LOGOUT] {(session.get('user') or {}).get('username', 'unknown')}")
+    session.clear()
+    return jsonify({'success': True}), 200
+
+
+@app.route('/api/auth/check', methods=['GET'])
+def check_auth():
+    user = session.get('user')
+    if user:
+        return jsonify({'authenticated': True, 'user': user}), 200
+    return jsonify({'authenticated': False}), 401
+
+
+# ============================================================
+# CUSTOMER ROUTES - STRIKTE DATENISOLATION
+# ============================================================
+
+@app.route('/api/customers', methods=['GET'])
+def list_customers():
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify([]), 200
+    
+    try:
+        criteria = [Customer.created_by == user_id] if user_role == 'Außendienst' else []
+        fields = request.args.get('fields')
+        if wants_stream() and not fans_out():
+            return stream_json_array(*customer_serializer.statement(*criteria, fields=fields), label='CUSTOMERS')
+        customers = concat_shards(across_shards(lambda: customer_serializer.fetch(*criteria, fields=fields)))
+        
+        print(f"[CUSTOMERS] User {user_id} ({user_role}): {len(customers)} Kunden")
+        return json_response(customers)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        print(f"[CUSTOMERS ERROR] {str(e)}")
+        return jsonify([]), 200
+
+
+@app.route('/api/customers/nearby', methods=['GET'])
+def nearby_customers():
+    """Kunden im Umkreis (lat, lon, radius in km) - z.B. rund um eine Baustelle"""
+    return nearby_response(Customer, 'NEARBY CUSTOMERS')
+
+
+@app.route('/api/customers/overdue', methods=['GET'])
+def list_overdue_customers():
+    """
+    Kunden ohne Besuch seit ?days=N Tagen (Standard 30), am längsten nicht
+    besuchte zuerst - nie besuchte ganz vorne. Liest nur den Index
+    (created_by, last_visit_date), nicht die Besuchsprotokolle.
+    """
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        days = max(int(request.args.get('days', 30)), 0)
+        limit = min(max(int(request.args.get('limit', 50)), 1), MAX_PAGE_SIZE)
+        today = date.today()
+        criteria = [db.or_(Customer.last_visit_date.is_(None),
+                           Customer.last_visit_date < today - timedelta(days=days))]
+        if user_role == 'Außendienst':
+            criteria.append(Customer.created_by == user_id)
+        
+        
+        def overdue_in_shard():
+            count = db.session.execute(db.select(db.func.count(Customer.id)).where(*criteria)).scalar()
+            stmt, convert, finish = customer_serializer.statement(*criteria)
+            stmt = stmt.order_by(None).order_by(Customer.last_visit_date.asc().nulls_first(), Customer.id).limit(limit)
+            return count, finish(convert(db.session.execute(stmt).all()))
+        
+        parts = across_shards(overdue_in_shard)
+        count = sum(part_count for part_count, _ in parts)
+        customers = concat_shards(items for _, items in parts)
+        if len(parts) > 1:
+            customers.sort(key=lambda customer: (customer['last_visit_date'] or '', customer['id']))
+            customers = customers[:limit]
+        for customer in customers:
+            last = customer['last_visit_date']
+            customer['days_since_visit'] = (today - date.fromisoformat(last)).days if last else None
+        
+        return json_response({'days': days, 'count': count, 'items': customers})
+    except (ValueError, TypeError) as e:
+        return jsonify({'message': f'Ungültige Parameter: {str(e)}'}), 400
+    except Exception as e:
+        print(f"[CUSTOMERS ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/customers/<int:id>', methods=['GET'])
+def get_customer(id):
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        customer = Customer.query.get(id)
+        if not customer:
+            return jsonify({'message': 'Kunde nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and customer.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+            
+        return jsonify(customer.to_dict(include_details=True)), 200
+    except Exception as e:
+        print(f"[CUSTOMER ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 500
+
+
+def paged_children(parent_model, parent_id, not_found_message, children, sort_column, model):
+    """Gemeinsamer Ablauf der seitenweisen Unterlisten (?limit=&cursor=)"""
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        parent = parent_model.query.get(parent_id)
+        if not parent:
+            return jsonify({'message': not_found_message}), 404
+        
+        if user_role == 'Außendienst' and parent.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+        
+        limit = min(max(int(request.args.get('limit', DETAIL_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        page = keyset_page(children(parent), sort_column, model, limit, request.args.get('cursor'))
+        return jsonify({
+            'items': [item.to_dict() for item in page['items']],
+            'count': page['count'],
+            'next_cursor': page['next_cursor']
+        }), 200
+    except (ValueError, TypeError) as e:
+        return jsonify({'message': f'Ungültige Parameter: {str(e)}'}), 400
+    except Exception as e:
+        print(f"[PAGINATION ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/customers/<int:id>/protocols', methods=['GET'])
+def list_customer_protocols(id):
+    """Besuchsprotokolle eines Kunden seitenweise (neueste zuerst)"""
+    return paged_children(Customer, id, 'Kunde nicht gefunden', lambda c: c.protocols,
+                          VisitProtocol.visit_date, VisitProtocol)
+
+
+@app.route('/api/customers/<int:id>/documents', methods=['GET'])
+def list_customer_documents(id):
+    """Dokumente eines Kunden seitenweise (neueste zuerst)"""
+    return paged_children(Customer, id, 'Kunde nicht gefunden', lambda c: c.documents,
+                          Document.created_at, Document)
+
+
+@app.route('/api/customers/<int:id>/constructionsites', methods=['GET'])
+def list_customer_sites(id):
+    """Baustellen eines Kunden seitenweise (neueste zuerst)"""
+    return paged_children(Customer, id, 'Kunde nicht gefunden', lambda c: c.construction_sites,
+                          ConstructionSite.id, ConstructionSite)
+
+
+@app.route('/api/customers', methods=['POST'])
+def add_customer():
+    user_id, user_role, is_admin = get_current_user()
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'message': 'Keine Daten'}), 400
+            
+        customer_number = data.get('customer_number', '').strip()
+        name = data.get('name', '').strip()
+        
+        if not customer_number or not name:
+            return jsonify({'message': 'Kundennummer und Name sind erforderlich'}), 400
+
+        existing = Customer.query.filter_by(customer_number=customer_number, created_by=user_id).first()
+        if existing:
+            return jsonify({'message': 'Kundennummer existiert bereits'}), 409
+
+        new_customer = Customer(
+            customer_number=customer_number,
+            name=name,
+            address=data.get('address', '').strip() if data.get('address') else '',
+            phone=data.get('phone', '').strip() if data.get('phone') else '',
+            email=data.get('email', '').strip() if data.get('email') else '',
+            created_by=user_id
+        )
+        geocode_pending = apply_location(new_customer, data)
+        db.session.add(new_customer)
+        bump_stats({(user_id, STAT_LAST_VISIT, STAT_NEVER): 1})
+        db.session.commit()
+        if geocode_pending:
+            geocode_later(Customer, [new_customer.id])
+        
+        print(f"[CUSTOMER] Erstellt: {new_customer.id} von User {user_id}")
+        return jsonify(new_customer.to_dict()), 201
+    except Exception as e:
+        db.session.rollback()
+        print(f"[CUSTOMER CREATE ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/customers/<int:id>', methods=['PUT'])
+def update_customer(id):
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        customer = Customer.query.get(id)
+        if not customer:
+            return jsonify({'message': 'Kunde nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and customer.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+
+        data = request.get_json()
+        
+        new_number = data.get('customer_number', '').strip()
+        if new_number and new_number != customer.customer_number:
+            existing = Customer.query.filter_by(customer_number=new_number, created_by=customer.created_by).first()
+            if existing:
+                return jsonify({'message': 'Kundennummer existiert bereits'}), 409
+            customer.customer_number = new_number
+
+        if data.get('name'):
+            customer.name = data['name'].strip()
+        if 'address' in data:
+            customer.address = data['address'].strip() if data['address'] else ''
+        if 'phone' in data:
+            customer.phone = data['phone'].strip() if data['phone'] else ''
+        if 'email' in data:
+            customer.email = data['email'].strip() if data['email'] else ''
+        geocode_pending = ('address' in data or 'latitude' in data) and apply_location(customer, data)
+            
+        db.session.commit()
+        if geocode_pending:
+            geocode_later(Customer, [customer.id])
+        return jsonify(customer.to_dict()), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/customers/<int:id>', methods=['DELETE'])
+def delete_customer(id):
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        customer = Customer.query.get(id)
+        if not customer:
+            return jsonify({'message': 'Kunde nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and customer.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+        
+        # Kinder löscht die Datenbank (ON DELETE CASCADE), Dokument-Blobs der Purger
+        track_customer_removal(customer)
+        documents = documents_attached_to(customers=Customer.id == customer.id)
+        db.session.delete(customer)
+        mark_orphaned_documents(documents)
+        db.session.commit()
+        document_purger.wake()
+        return jsonify({'message': 'Kunde gelöscht'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+
+# ============================================================
+# KUNDEN-VORSCHLÄGE (TYPEAHEAD)
+# ============================================================
+
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+SUGGEST_MIN_SIMILARITY = 0.3
+SUGGEST_CACHE_SIZE = 256
+# Obergrenze, falls ein Ereignis im Änderungs-Feed verloren ging
+SUGGEST_INDEX_TTL = 600
+# Indizes je Außendienstler pro Prozess; selten genutzte fallen heraus
+SUGGEST_INDEX_CACHE_SIZE = 64
+WORD_PATTERN = re.compile(r'\w+')
+UMLAUT_FOLDING = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+
+
+def normalize_search(text):
+    return ' '.join((text or '').casefold().translate(UMLAUT_FOLDING).split())
+
+
+@lru_cache(maxsize=65536)
+def word_trigrams(word):
+    """Trigramme wie pg_trgm: zwei Leerzeichen vor, eines nach dem Wort"""
+    padded = f'  {word} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def prefix_range(keys, prefix):
+    """Positionen aller Schlüssel einer sortierten Liste, die mit prefix beginnen"""
+    start = bisect.bisect_left(keys, prefix)
+    end = start
+    while end < len(keys) and keys[end].startswith(prefix):
+        end += 1
+    return range(start, end)
+
+
+class CustomerSuggestIndex:
+    """
+    Präfix- und Trigramm-Index über Name und Kundennummer der für einen Nutzer
+    sichtbaren Kunden: sortierte Schlüssel für Präfixe (Binärsuche), Trigramme
+    je Wort des Vokabulars für Tippfehler, Wort -> Kunden als Postings.
+    Antworten werden je Anfrage gecacht.
+    """
+
+    def __init__(self, rows, event_id):
+        # Nach Name sortiert: gleich gute Treffer erscheinen alphabetisch
+        rows = sorted(rows, key=lambda row: (normalize_search(row[2]), row[0]))
+        self.entries = [{'id': id, 'customer_number': number, 'name': name, 'address': address or ''}
+                        for id, number, name, address in rows]
+        self.positions = {entry['id']: position for position, entry in enumerate(self.entries)}
+        self.event_id = event_id
+        self.built_at = time.time()
+        # Schon nach Name sortiert, also direkt für Präfixsuche nutzbar
+        self.names = names = [normalize_search(entry['name']) for entry in self.entries]
+        numbers = sorted((normalize_search(entry['customer_number']), position)
+                         for position, entry in enumerate(self.entries))
+        self.numbers = [number for number, _ in numbers]
+        self.number_positions = [position for _, position in numbers]
+        self.postings = {}
+        for position, name in enumerate(names):
+            for word in set(WORD_PATTERN.findall(name)):
+                self.postings.setdefault(word, []).append(position)
+        self.vocabulary = sorted(self.postings)
+        self.grams = {}
+        for word in self.vocabulary:
+            for gram in word_trigrams(word):
+                self.grams.setdefault(gram, []).append(word)
+        self._cache = {}
+
+    def matches(self, rows):
+        """Stimmen die indizierten Felder dieser (id, nummer, name, adresse)-Zeilen noch?"""
+        for id, number, name, address in rows:
+            position = self.positions.get(id)
+            if position is None:
+                return False
+            entry = self.entries[position]
+            if (entry['customer_number'], entry['name'], entry['address']) != (number, name, address or ''):
+                return False
+        return True
+
+    def _word_scores(self, token):
+        """{Wort: Güte}: Wortanfänge 1.0, ähnliche Wörter (Tippfehler) ihre Trigramm-Ähnlichkeit"""
+        scores = {}
+        if len(token) >= 3:
+            grams = word_trigrams(token)
+            shared = Counter()
+            for gram in grams:
+                shared.update(self.grams.get(gram, ()))
+            for word, count in shared.items():
+                similarity = count / (len(grams) + len(word_trigrams(word)) - count)
+                if similarity >= SUGGEST_MIN_SIMILARITY:
+                    scores[word] = similarity
+        for index in prefix_range(self.vocabulary, token):
+            scores[self.vocabulary[index]] = 1.0
+        return scores
+
+    def search(self, query, limit):
+        query = normalize_search(query)
+        key = (query, limit)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        # Jedes Suchwort muss ein Wort des Namens treffen; Güte = Mittel der Suchwörter
+        tokens = WORD_PATTERN.findall(query)
+        scores = None
+        for token in tokens:
+            token_scores = {}
+            for word, score in self._word_scores(token).items():
+                for position in self.postings[word]:
+                    if score > token_scores.get(position, 0):
+                        token_scores[position] = score
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {position: score + token_scores[position]
+                          for position, score in scores.items() if position in token_scores}
+        scores = {position: score / len(tokens) for position, score in (scores or {}).items()}
+        # Ganzer Name bzw. Kundennummer beginnt mit der Eingabe: vorne einsortieren
+        for position in prefix_range(self.names, query):
+            scores[position] = scores.get(position, 0) + 1.5
+        for index in prefix_range(self.numbers, query):
+            position = self.number_positions[index]
+            scores[position] = scores.get(position, 0) + 2.0
+        best = heapq.nsmallest(limit, scores.items(), key=lambda hit: (-hit[1], hit[0]))
+        result = [self.entries[position] for position, _ in best]
+        if len(self._cache) >= SUGGEST_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[key] = result
+        return result
+
+
+_suggest_indexes = LRUCache(SUGGEST_INDEX_CACHE_SIZE)
+_suggest_lock = threading.Lock()
+
+
+def suggest_rows(*criteria):
+    stmt = db.select(Customer.id, Customer.customer_number, Customer.name, Customer.address).where(*criteria)
+    return concat_shards(across_shards(lambda: db.session.execute(stmt).all()))
+
+
+def customer_suggest_index(owner_id):
+    """
+    Index für einen Außendienstler (owner_id) bzw. alle Kunden (None). Der
+    Änderungs-Feed meldet Kundenänderungen auch aus anderen Worker-Prozessen;
+    neu aufgebaut wird nur, wenn sich Name, Nummer oder Adresse geändert haben
+    (nicht z.B. bei neuen Besuchen).
+    """
+    latest = EVENT_BUS.latest_id()
+    with _suggest_lock:
+        index = _suggest_indexes.get(owner_id)
+        if index is not None and time.time() - index.built_at > SUGGEST_INDEX_TTL:
+            index = None
+        if index is not None and latest > index.event_id:
+            events = EVENT_BUS.since(index.event_id)
+            changed = [event for event in events
+                       if event['entity'] == 'customer' and owner_id in (None, event['owner'])]
+            if len(events) >= EVENT_BUFFER_SIZE or any(event['op'] != 'updated' for event in changed):
+                index = None
+            elif changed and not index.matches(suggest_rows(Customer.id.in_({e['entity_id'] for e in changed}))):
+                index = None
+            else:
+                index.event_id = latest
+        if index is None:
+            criteria = [Customer.created_by == owner_id] if owner_id is not None else []
+            index = _suggest_indexes[owner_id] = CustomerSuggestIndex(suggest_rows(*criteria), latest)
+        return index
+
+
+@app.route('/api/customers/suggest', methods=['GET'])
+def suggest_customers():
+    """Typeahead: ?q=Anfang von Name/Kundennummer (Tippfehler toleriert), ?limit=N"""
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        query = request.args.get('q', '')
+        limit = min(max(int(request.args.get('limit', SUGGEST_LIMIT)), 1), SUGGEST_MAX_LIMIT)
+        if not query.strip():
+            return jsonify([]), 200
+        index = customer_suggest_index(user_id if user_role == 'Außendienst' else None)
+        return json_response(index.search(query, limit))
+    except ValueError as e:
+        return jsonify({'message': f'Ungültige Parameter: {str(e)}'}), 400
+    except Exception as e:
+        print(f"[SUGGEST ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 500
+
+
+# ============================================================
+# PROTOCOL ROUTES
+# ============================================================
+
+@app.route('/api/protocols', methods=['POST'])
+def add_protocol():
+    user_id, user_role, is_admin = get_current_user()
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        data = request.get_json()
+        customer = Customer.query.get(data['customer_id'])
+        # Wie get_customer: Außendienst nur eigene Kunden (Besuchszähler und Kennzahlen hängen daran)
+        if not customer or (user_role == 'Außendienst' and customer.created_by != user_id):
+            return jsonify({'message': 'Kunde nicht gefunden'}), 404
+        
+        customer_id = customer.id
+        visit_date = datetime.strptime(data['visit_date'], '%Y-%m-%d').date()
+        summary = data['summary']
+        
+        def write(session):
+            new_protocol = VisitProtocol(customer_id=customer_id, visit_date=visit_date,
+                                         summary=summary, created_by=user_id)
+            session.add(new_protocol)
+            session.flush()
+            track_visit(new_protocol, session.get(Customer, customer_id), 1, session)
+            return new_protocol.to_dict()
+        
+        return jsonify(commit_write(write)), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 400
+
+
+@app.route('/api/protocols/<int:id>', methods=['DELETE'])
+def delete_protocol(id):
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        protocol = VisitProtocol.query.get(id)
+        if not protocol:
+            return jsonify({'message': 'Protokoll nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and protocol.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+        
+        def write(session):
+            protocol = session.get(VisitProtocol, id)
+            if protocol is None:
+                return False
+            customer = protocol.customer
+            session.delete(protocol)
+            session.flush()
+            track_visit(protocol, customer, -1, session)
+            return True
+        
+        if not commit_write(write):
+            return jsonify({'message': 'Protokoll nicht gefunden'}), 404
+        return jsonify({'message': 'Protokoll gelöscht'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+
+# ============================================================
+# DOCUMENT ROUTES
+# ============================================================
+
+@app.route('/api/documents', methods=['POST'])
+def add_document():
+    user_id, user_role, is_admin = get_current_user()
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        data = request.get_json()
+        
+        new_document = Document(
+            customer_id=data.get('customer_id'),
+            construction_site_id=data.get('construction_site_id'),
+            name=data['name'],
+            type=data['type'],
+            file_url=data.get('file_url', ''),
+            created_by=user_id
+        )
+        
+        if data.get('file_data'):
+            file_data_str = data['file_data']
+            if ',' in file_data_str:
+                file_data_str = file_data_str.split(',')[1]
+            new_document.file_data = base64.b64decode(file_data_str)
+        
+        db.session.add(new_document)
+        db.session.commit()
+        
+        result = new_document.to_dict()
+        # Vorschaubilder im Hintergrund; fehlen sie noch, erzeugt sie der erste Abruf
+        if new_document.file_data is not None and new_document.is_image and Image is not None:
+            result['preview_job_id'] = enqueue_job('document-previews', {'document_id': new_document.id},
+                                                   owner_id=user_id, priority=1,
+                                                   key=f'document-previews:{new_document.id}')
+        
+        print(f"[DOCUMENT] Erstellt: {new_document.name} (ID:{new_document.id})")
+        return jsonify(result), 201
+    except Exception as e:
+        db.session.rollback()
+        print(f"[DOCUMENT ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 400
+
+
+@app.route('/api/documents/<int:id>', methods=['DELETE'])
+def delete_document(id):
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        document = Document.query.get(id)
+        if not document:
+            return jsonify({'message': 'Dokument nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and document.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+        
+        db.session.delete(document)
+        db.session.commit()
+        return jsonify({'message': 'Dokument gelöscht'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/documents/<int:id>/download', methods=['GET'])
+def download_document(id):
+    try:
+        document = Document.query.get(id)
+        # Verwaiste Dokumente (Kunde/Baustelle gelöscht) warten nur noch auf den Purger
+        if not document or not document.file_data or document.orphaned_at is not None:
+            return jsonify({'message': 'Dokument nicht gefunden'}), 404
+        
+        return jsonify({
+            'name': document.name,
+            'type': document.type,
+            'data': base64.b64encode(document.file_data).decode('utf-8')
+        }), 200
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+
+def render_previews(blob):
+    """
+    Alle Vorschaugrößen aus einem Dekodiervorgang: JPEGs werden per draft()
+    schon beim Laden verkleinert, danach geht es von groß nach klein.
+    """
+    image = Image.open(io.BytesIO(blob))
+    largest = max(PREVIEW_SIZES.values())
+    image.draft('RGB', (largest, largest))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    previews = {}
+    for size, edge in sorted(PREVIEW_SIZES.items(), key=lambda item: -item[1]):
+        image.thumbnail((edge, edge), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=80, optimize=True, progressive=edge >= 480)
+        previews[size] = (image.width, image.height, buffer.getvalue())
+    return previews
+
+
+def ensure_previews(document):
+    """Vorschaubilder eines Dokuments anlegen, falls noch nicht vorhanden; False ohne Pillow/Bild"""
+    if Image is None or not document.is_image or document.file_data is None:
+        return False
+    existing = db.session.execute(
+        db.select(db.func.count()).select_from(DocumentPreview).where(DocumentPreview.document_id == document.id)
+    ).scalar()
+    if existing == len(PREVIEW_SIZES):
+        return True
+    db.session.execute(db.delete(DocumentPreview).where(DocumentPreview.document_id == document.id))
+    db.session.execute(db.insert(DocumentPreview), [
+        {'document_id': document.id, 'size': size, 'width': width, 'height': height, 'data': data}
+        for size, (width, height, data) in render_previews(document.file_data).items()
+    ])
+    db.session.commit()
+    return True
+
+
+@app.route('/api/documents/<int:id>/preview/<size>', methods=['GET'])
+def document_preview(id, size):
+    """Vorschaubild (sm/md/lg) als JPEG; <img> schickt das Session-Cookie mit"""
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    if size not in PREVIEW_SIZES:
+        return jsonify({'message': f"Größe muss eine von {', '.join(PREVIEW_SIZES)} sein"}), 400
+    
+    try:
+        document = Document.query.get(id)
+        if not document or document.orphaned_at is not None:
+            return jsonify({'message': 'Dokument nicht gefunden'}), 404
+        
+        # Wie get_customer/get_construction_site: maßgeblich ist der Eigentümer des
+        # Kunden bzw. der Baustelle (z.B. nach einer Zusammenführung), nicht der Hochlader
+        parent = document.customer or document.construction_site
+        owner_id = parent.created_by if parent else document.created_by
+        if user_role == 'Außendienst' and owner_id != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+        
+        preview = DocumentPreview.query.get((id, size))
+        if preview is None:
+            try:
+                ensure_previews(document)
+            except Exception as e:
+                # z.B. kein lesbares Bild, oder der Job hat parallel dieselben Zeilen angelegt
+                db.session.rollback()
+                print(f"[PREVIEW ERROR] Dokument {id}: {str(e)}")
+            preview = DocumentPreview.query.get((id, size))
+            if preview is None:
+                return jsonify({'message': 'Keine Vorschau verfügbar'}), 404
+        
+        response = send_file(io.BytesIO(preview.data), mimetype='image/jpeg', etag=f'{id}-{size}',
+                             last_modified=preview.created_at, conditional=True)
+        # Dokumente werden nie verändert, nur gelöscht; privat, da nutzerabhängig geprüft
+        response.headers['Cache-Control'] = 'private, max-age=86400'
+        return response
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+
+# ============================================================
+# CONSTRUCTION SITE ROUTES - STRIKTE ISOLATION
+# ============================================================
+
+@app.route('/api/constructionsites', methods=['GET'])
+def list_sites():
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify([]), 200
+    
+    try:
+        criteria = [ConstructionSite.created_by == user_id] if user_role == 'Außendienst' else []
+        fields = request.args.get('fields')
+        if wants_stream() and not fans_out():
+            return stream_json_array(*site_serializer.statement(*criteria, fields=fields), label='SITES')
+        sites = concat_shards(across_shards(lambda: site_serializer.fetch(*criteria, fields=fields)))
+        
+        print(f"[SITES] User {user_id} ({user_role}): {len(sites)} Baustellen")
+        return json_response(sites)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify([]), 200
+
+
+@app.route('/api/constructionsites/nearby', methods=['GET'])
+def nearby_sites():
+    """Baustellen im Umkreis (lat, lon, radius in km)"""
+    return nearby_response(ConstructionSite, 'NEARBY SITES')
+
+
+def parse_calendar_range(args):
+    """?week=2025-W42 oder ?from=...&to=... (YYYY-MM-DD, jeweils einschließlich)"""
+    if args.get('week'):
+        year, week = args['week'].upper().split('-W')
+        start = date.fromisocalendar(int(year), int(week), 1)
+        return start, start + timedelta(days=6)
+    if not args.get('from') or not args.get('to'):
+        raise ValueError('from und to (YYYY-MM-DD) oder week (YYYY-Www) angeben')
+    start = datetime.strptime(args['from'], '%Y-%m-%d').date()
+    end = datetime.strptime(args['to'], '%Y-%m-%d').date()
+    if end < start:
+        raise ValueError('to liegt vor from')
+    return start, end
+
+
+@app.route('/api/constructionsites/calendar', methods=['GET'])
+def site_calendar():
+    """
+    Baustellen, deren Laufzeit den Zeitraum überschneidet, nach Status
+    gruppiert. Ohne Enddatum gilt eine Baustelle als laufend, ohne
+    Startdatum ist sie nicht eingeplant und fehlt im Kalender.
+    """
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        start, end = parse_calendar_range(request.args)
+        criteria = [ConstructionSite.created_by == user_id] if user_role == 'Außendienst' else []
+        if request.args.get('status'):
+            criteria.append(ConstructionSite.status == request.args['status'])
+        # start_date <= Ende und end_date >= Anfang: beides aus ix_construction_sites_(owner_)schedule
+        criteria += [ConstructionSite.start_date.isnot(None), ConstructionSite.start_date <= end,
+                     db.or_(ConstructionSite.end_date.is_(None), ConstructionSite.end_date >= start)]
+        stmt, convert, finish = site_serializer.statement(*criteria)
+        stmt = stmt.order_by(None).order_by(ConstructionSite.start_date, ConstructionSite.id)
+        sites = concat_shards(across_shards(lambda: finish(convert(db.session.execute(stmt).all()))))
+        if fans_out():
+            sites.sort(key=lambda site: (site['start_date'], site['id']))
+        
+        statuses = {}
+        for site in sites:
+            statuses.setdefault(site['status'] or 'Unbekannt', []).append(site)
+        
+        print(f"[SITES] Kalender {start} - {end} User {user_id} ({user_role}): {len(sites)} Baustellen")
+        return json_response({
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'total': len(sites),
+            'counts': {status: len(items) for status, items in statuses.items()},
+            'statuses': statuses
+        })
+    except ValueError as e:
+        return jsonify({'message': f'Ungültiger Zeitraum: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/constructionsites/<int:id>', methods=['GET'])
+def get_site(id):
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        site = ConstructionSite.query.get(id)
+        if not site:
+            return jsonify({'message': 'Baustelle nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and site.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+            
+        return jsonify(site.to_dict(include_details=True)), 200
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/constructionsites/<int:id>/notes', methods=['GET'])
+def list_site_notes(id):
+    """Notizen einer Baustelle seitenweise (neueste zuerst, Ersteller per JOIN)"""
+    return paged_children(ConstructionSite, id, 'Baustelle nicht gefunden',
+                          lambda s: s.notes.options(db.joinedload(ConstructionNote.creator)),
+                          ConstructionNote.created_at, ConstructionNote)
+
+
+@app.route('/api/constructionsites/<int:id>/documents', methods=['GET'])
+def list_site_documents(id):
+    """Dokumente einer Baustelle seitenweise (neueste zuerst)"""
+    return paged_children(ConstructionSite, id, 'Baustelle nicht gefunden', lambda s: s.documents,
+                          Document.created_at, Document)
+
+
+@app.route('/api/constructionsites', methods=['POST'])
+def add_site():
+    user_id, user_role, is_admin = get_current_user()
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        data = request.get_json()
+        
+        start_date = None
+        end_date = None
+        if data.get('start_date'):
+            start_date = datetime.strptime(data['start_date'], '%Y-%m-%d').date()
+        if data.get('end_date'):
+            end_date = datetime.strptime(data['end_date'], '%Y-%m-%d').date()
+        
+        new_site = ConstructionSite(
+            customer_id=data['customer_id'],
+            name=data['name'],
+            address=data['address'],
+            status=data.get('status', 'Planung'),
+            start_date=start_date,
+            end_date=end_date,
+            created_by=user_id
+        )
+        geocode_pending = apply_location(new_site, data)
+        db.session.add(new_site)
+        bump_stats({(user_id, STAT_SITES, new_site.status or 'Unbekannt'): 1})
+        db.session.commit()
+        if geocode_pending:
+            geocode_later(ConstructionSite, [new_site.id])
+        return jsonify(new_site.to_dict()), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 400
+
+
+@app.route('/api/constructionsites/<int:id>', methods=['PUT'])
+def update_site(id):
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        site = ConstructionSite.query.get(id)
+        if not site:
+            return jsonify({'message': 'Baustelle nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and site.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+
+        data = request.get_json()
+        
+        if data.get('name'):
+            site.name = data['name']
+        if data.get('address'):
+            site.address = data['address']
+        if data.get('status') and data['status'] != site.status:
+            bump_stats(Counter({(site.created_by, STAT_SITES, site.status or 'Unbekannt'): -1,
+                                (site.created_by, STAT_SITES, data['status']): 1}))
+            site.status = data['status']
+        if data.get('start_date'):
+            site.start_date = datetime.strptime(data['start_date'], '%Y-%m-%d').date()
+        if data.get('end_date'):
+            site.end_date = datetime.strptime(data['end_date'], '%Y-%m-%d').date()
+        geocode_pending = (data.get('address') or 'latitude' in data) and apply_location(site, data)
+            
+        db.session.commit()
+        if geocode_pending:
+            geocode_later(ConstructionSite, [site.id])
+        return jsonify(site.to_dict()), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/constructionsites/<int:id>', methods=['DELETE'])
+def delete_site(id):
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        site = ConstructionSite.query.get(id)
+        if not site:
+            return jsonify({'message': 'Baustelle nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and site.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+            
+        bump_stats({(site.created_by, STAT_SITES, site.status or 'Unbekannt'): -1})
+        documents = documents_attached_to(sites=ConstructionSite.id == site.id)
+        db.session.delete(site)
+        mark_orphaned_documents(documents)
+        db.session.commit()
+        document_purger.wake()
+        return jsonify({'message': 'Baustelle gelöscht'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+
+# ============================================================
+# CONSTRUCTION NOTES ROUTES
+# ============================================================
+
+@app.route('/api/constructionsites/<int:site_id>/notes', methods=['POST'])
+def add_construction_note(site_id):
+    user_id, user_role, is_admin = get_current_user()
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        note = request.get_json()['note']
+        
+        def write(session):
+            new_note = ConstructionNote(construction_site_id=site_id, note=note, created_by=user_id)
+            session.add(new_note)
+            session.flush()
+            return new_note.to_dict()
+        
+        return jsonify(commit_write(write)), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 400
+
+
+@app.route('/api/constructionnotes/<int:id>', methods=['DELETE'])
+def delete_construction_note(id):
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        note = ConstructionNote.query.get(id)
+        if not note:
+            return jsonify({'message': 'Notiz nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and note.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+        
+        def write(session):
+            note = session.get(ConstructionNote, id)
+            if note is not None:
+                session.delete(note)
+        
+        commit_write(write)
+        return jsonify({'message': 'Notiz gelöscht'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+
+# ============================================================
+# TOUR ROUTES - STRIKTE ISOLATION
+# ============================================================
+
+@app.route('/api/tours', methods=['GET'])
+def list_tours():
+    archived = request.args.get('archived', 'false').lower() == 'true'
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify([]), 200
+    
+    try:
+        # Abgeschlossene Touren liegen im Archiv (?from=&to= grenzen ein); ohne
+        # Zeitraum nur die letzten ARCHIVE_DEFAULT_DAYS - ältere seitenweise über
+        # /api/tours/archive. Der Header X-Archive-From nennt den Beginn des Fensters
+        window_start = None
+        if archived:
+            serializer, criteria = archive_serializer, archive_criteria(user_id, user_role)
+            if not request.args.get('from') and not request.args.get('to'):
+                window_start = (datetime.utcnow() - timedelta(days=ARCHIVE_DEFAULT_DAYS)).date()
+                criteria.append(TourArchive.completed_at >= window_start)
+        else:
+            serializer, criteria = tour_serializer, [Tour.archived == False]
+            if user_role == 'Außendienst':
+                criteria.append(Tour.created_by == user_id)
+        fields = request.args.get('fields')
+        if wants_stream() and not fans_out():
+            response = stream_json_array(*serializer.statement(*criteria, fields=fields), label='TOURS')
+        else:
+            tours = concat_shards(across_shards(lambda: serializer.fetch(*criteria, fields=fields)))
+            print(f"[TOURS] User {user_id}: {len(tours)} (archived={archived})")
+            response = app.make_response(json_response(tours))
+        if window_start:
+            response.headers['X-Archive-From'] = window_start.isoformat()
+        return response
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify([]), 200
+
+
+def build_stop_row(tour_id, stop_data, order):
+    """Zeile für den Bulk-Insert eines Tour-Stopps (Koordinaten aus Request oder Cache)"""
+    lat, lon = stop_data.get('latitude'), stop_data.get('longitude')
+    if lat is None or lon is None:
+        lat, lon = geocode_address(stop_data['address'], remote=False)
+    return {
+        'tour_id': tour_id,
+        'customer_name': stop_data['customer_name'],
+        'address': stop_data['address'],
+        'goal': stop_data.get('goal', ''),
+        'order': order,
+        'latitude': lat,
+        'longitude': lon
+    }
+
+
+@app.route('/api/tours', methods=['POST'])
+def add_tour():
+    user_id, user_role, is_admin = get_current_user()
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        data = request.get_json()
+        
+        if not data or not data.get('title') or not data.get('stops'):
+            return jsonify({'message': 'Titel und Stopps erforderlich'}), 400
+            
+        tour = Tour(title=data['title'], created_by=user_id)
+        db.session.add(tour)
+        db.session.flush()
+        
+        # Alle Stopps in einem Bulk-Insert statt einzeln per session.add
+        rows = [build_stop_row(tour.id, stop_data, idx + 1) for idx, stop_data in enumerate(data['stops'])]
+        db.session.execute(db.insert(TourStop), rows)
+        record_change('tour', tour.id, 'created', tour.created_by)
+        
+        db.session.commit()
+        if any(row['latitude'] is None for row in rows):
+            geocode_later(TourStop, [tour.id], key='tour_id')
+        print(f"[TOUR] Erstellt: {tour.id} von User {user_id}")
+        return jsonify(tour.to_dict()), 201
+    except Exception as e:
+        db.session.rollback()
+        print(f"[TOUR ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 400
+
+
+def stop_index(position, sequence):
+    """Position ab 1 (1 .. len(sequence) + 1) als Listenindex, sonst None"""
+    if isinstance(position, bool) or not isinstance(position, (int, str)):
+        return None
+    try:
+        position = int(position)
+    except ValueError:
+        return None
+    return position - 1 if 1 <= position <= len(sequence) + 1 else None
+
+
+@app.route('/api/tours/<int:id>', methods=['PATCH'])
+def patch_tour(id):
+    """
+    Tour inkrementell bearbeiten. Operationen (Positionen ab 1):
+      {"op": "remove", "id": 5}
+      {"op": "insert", "position": 2, "stop": {...}}
+      {"op": "move", "id": 5, "position": 1}
+      {"op": "reorder", "ids": [7, 5, 6]}
+    Nur geänderte Stopps werden geschrieben - alles in einer Transaktion.
+    """
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        tour = Tour.query.get(id)
+        if not tour:
+            return jsonify({'message': 'Tour nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and tour.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+        
+        if tour.archived:
+            return jsonify({'message': 'Archivierte Touren können nicht bearbeitet werden'}), 400
+        
+        data = request.get_json()
+        if not data:
+            return jsonify({'message': 'Keine Daten'}), 400
+        
+        current = db.session.execute(
+            db.select(TourStop.id, TourStop.order).where(TourStop.tour_id == id).order_by(TourStop.order)
+        ).all()
+        old_order = {row.id: row.order for row in current}
+        # Neue Stopps stehen als ('neu', n) in der Sequenz, bestehende als ID
+        sequence = [row.id for row in current]
+        new_stops = {}
+        
+        for op in data.get('operations', []):
+            kind = op.get('op')
+            if kind in ('remove', 'move') and op.get('id') not in sequence:
+                return jsonify({'message': f"Stopp {op.get('id')} gehört nicht zur Tour"}), 400
+            if kind == 'remove':
+                sequence.remove(op['id'])
+            elif kind == 'move':
+                sequence.remove(op['id'])
+                index = stop_index(op.get('position'), sequence)
+                if index is None:
+                    return jsonify({'message': f"Ungültige Position: {op.get('position')}"}), 400
+                sequence.insert(index, op['id'])
+            elif kind == 'insert':
+                stop_data = op.get('stop') or {}
+                if not stop_data.get('customer_name') or not stop_data.get('address'):
+                    return jsonify({'message': 'Kunde und Adresse für neuen Stopp erforderlich'}), 400
+                index = stop_index(op.get('position', len(sequence) + 1), sequence)
+                if index is None:
+                    return jsonify({'message': f"Ungültige Position: {op.get('position')}"}), 400
+                key = ('neu', len(new_stops))
+                new_stops[key] = stop_data
+                sequence.insert(index, key)
+            elif kind == 'reorder':
+                ids = op.get('ids') or []
+                existing = [sid for sid in sequence if isinstance(sid, int)]
+                if sorted(ids) != sorted(existing):
+                    return jsonify({'message': 'Reihenfolge muss alle Stopps der Tour enthalten'}), 400
+                ordered = iter(ids)
+                sequence = [next(ordered) if isinstance(sid, int) else sid for sid in sequence]
+            else:
+                return jsonify({'message': f'Unbekannte Operation: {kind}'}), 400
+        
+        if not sequence:
+            return jsonify({'message': 'Eine Tour braucht mindestens einen Stopp'}), 400
+        
+        removed = set(old_order) - {sid for sid in sequence if isinstance(sid, int)}
+        if removed:
+            db.session.execute(db.delete(TourStop).where(TourStop.id.in_(removed)))
+        
+        moved = [{'id': sid, 'order': position} for position, sid in enumerate(sequence, 1)
+                 if isinstance(sid, int) and old_order[sid] != position]
+        if moved:
+            db.session.execute(db.update(TourStop), moved)
+        
+        inserted = [build_stop_row(id, new_stops[key], position) for position, key in enumerate(sequence, 1)
+                    if not isinstance(key, int)]
+        if inserted:
+            db.session.execute(db.insert(TourStop), inserted)
+        
+        if data.get('title'):
+            tour.title = data['title'].strip()
+        
+        record_change('tour', tour.id, 'updated', tour.created_by)
+        db.session.commit()
+        if any(row['latitude'] is None for row in inserted):
+            geocode_later(TourStop, [tour.id], key='tour_id')
+        print(f"[TOUR] Bearbeitet: {id} (-{len(removed)} +{len(inserted)} ~{len(moved)})")
+        return jsonify(tour.to_dict()), 200
+    except (KeyError, ValueError, TypeError) as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"[TOUR ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/tours/<int:id>/clone', methods=['POST'])
+def clone_tour(id):
+    """Tour kopieren (z.B. wiederkehrende Wochentour); Stopps per INSERT ... SELECT"""
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        tour = Tour.query.get(id)
+        if not tour:
+            return jsonify({'message': 'Tour nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and tour.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+        
+        data = request.get_json(silent=True) or {}
+        clone = Tour(title=(data.get('title') or f"{tour.title} (Kopie)").strip(), created_by=user_id)
+        db.session.add(clone)
+        db.session.flush()
+        
+        columns = ['customer_name', 'address', 'goal', 'order', 'latitude', 'longitude']
+        stops_table = TourStop.__table__
+        db.session.execute(stops_table.insert().from_select(
+            ['tour_id'] + columns,
+            db.select(db.literal(clone.id), *[stops_table.c[name] for name in columns])
+              .where(stops_table.c.tour_id == id)
+        ))
+        
+        db.session.commit()
+        print(f"[TOUR] Kopiert: {id} -> {clone.id} von User {user_id}")
+        return jsonify(clone.to_dict()), 201
+    except Exception as e:
+        db.session.rollback()
+        print(f"[TOUR ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/tours/<int:id>/complete', methods=['POST'])
+def complete_tour(id):
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        tour = Tour.query.get(id)
+        if not tour:
+            return jsonify({'message': 'Tour nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and tour.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+        
+        entry = archive_tour(tour)
+        db.session.commit()
+        print(f"[TOUR] Archiviert: {id} -> Archiv {entry.id} ({entry.stop_count} Stopps)")
+        # id bleibt wie bisher die Tour-ID; der Archiveintrag steht unter archive_id
+        return jsonify(dict(entry.to_dict(), id=entry.tour_id, archive_id=entry.id)), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/tours/<int:id>', methods=['DELETE'])
+def delete_tour(id):
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        tour = Tour.query.get(id)
+        if not tour:
+            return jsonify({'message': 'Tour nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and tour.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+            
+        db.session.delete(tour)
+        db.session.commit()
+        return jsonify({'message': 'Tour gelöscht'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+
+# ============================================================
+# TOUR-ARCHIV
+# ============================================================
+
+def archive_tour(tour, completed_at=None):
+    """Tour ins Archiv verschieben: Stopps packen, aktive Zeilen löschen"""
+    stops = [stop.to_dict() for stop in tour.stops.order_by(TourStop.order).all()]
+    entry = TourArchive(tour_id=tour.id, title=tour.title, stop_count=len(stops),
+                        stops_payload=encode_json(stops).decode('utf-8'),
+                        completed_at=completed_at or tour.completed_at or datetime.utcnow(),
+                        created_at=tour.created_at, created_by=tour.created_by)
+    db.session.add(entry)
+    db.session.delete(tour)
+    db.session.flush()
+    bump_stats({(entry.created_by, STAT_TOURS_COMPLETED, stat_week(entry.completed_at)): 1})
+    return entry
+
+
+# Zeitfenster für /api/tours?archived=true ohne from/to (die Liste ist nicht paginiert)
+ARCHIVE_DEFAULT_DAYS = 90
+
+
+def archive_criteria(user_id, user_role):
+    """Sichtbarkeit plus Zeitraum ?from=YYYY-MM-DD&to=YYYY-MM-DD (inklusive)"""
+    criteria = []
+    if user_role == 'Außendienst':
+        criteria.append(TourArchive.created_by == user_id)
+    if request.args.get('from'):
+        criteria.append(TourArchive.completed_at >= datetime.strptime(request.args['from'], '%Y-%m-%d'))
+    if request.args.get('to'):
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d') + timedelta(days=1)
+        criteria.append(TourArchive.completed_at < end)
+    return criteria
+
+
+def get_archive_entry(id, user_id, user_role):
+    """(Eintrag, None) oder (None, Fehlerantwort)"""
+    entry = TourArchive.query.get(id)
+    if not entry:
+        return None, (jsonify({'message': 'Archivierte Tour nicht gefunden'}), 404)
+    if user_role == 'Außendienst' and entry.created_by != user_id:
+        return None, (jsonify({'message': 'Keine Berechtigung'}), 403)
+    return entry, None
+
+
+@app.route('/api/tours/archive', methods=['GET'])
+def list_tour_archive():
+    """
+    Archiv seitenweise, zuletzt abgeschlossene zuerst:
+    ?from=&to=&limit=&cursor= und ?stops=true für die entpackten Stopps.
+    """
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        include_stops = request.args.get('stops', 'false').lower() == 'true'
+        limit = min(max(int(request.args.get('limit', DETAIL_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        criteria, cursor = archive_criteria(user_id, user_role), request.args.get('cursor')
+        
+        def archive_page():
+            query = TourArchive.query.filter(*criteria)
+            if include_stops:
+                query = query.options(db.joinedload(TourArchive.creator))
+            else:
+                query = query.options(db.joinedload(TourArchive.creator), db.defer(TourArchive.stops_payload))
+            page = keyset_page(query, TourArchive.completed_at, TourArchive, limit, cursor)
+            page['items'] = [(entry.completed_at, entry.id, entry.to_dict(include_stops=include_stops))
+                             for entry in page['items']]
+            return page
+        
+        # Mehrere Shards: Seiten nach (completed_at, id) mischen, Cursor gilt für alle
+        pages = across_shards(archive_page)
+        entries = sorted(concat_shards(page['items'] for page in pages), reverse=True, key=lambda e: e[:2])
+        next_cursor = pages[0]['next_cursor'] if len(pages) == 1 else None
+        if len(pages) > 1 and (len(entries) > limit or any(page['next_cursor'] for page in pages)):
+            entries = entries[:limit]
+            next_cursor = encode_cursor(entries[-1][0], entries[-1][1])
+        return jsonify({
+            'items': [data for _, _, data in entries],
+            'count': sum(page['count'] for page in pages),
+            'next_cursor': next_cursor
+        }), 200
+    except (ValueError, TypeError) as e:
+        return jsonify({'message': f'Ungültige Parameter: {str(e)}'}), 400
+    except Exception as e:
+        print(f"[ARCHIVE ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/tours/archive/<int:id>', methods=['GET'])
+def get_tour_archive(id):
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        entry, error = get_archive_entry(id, user_id, user_role)
+        if error:
+            return error
+        return jsonify(entry.to_dict()), 200
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/tours/archive/<int:id>/clone', methods=['POST'])
+def clone_tour_archive(id):
+    """Abgeschlossene Tour als neue aktive Tour wieder aufnehmen"""
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        entry, error = get_archive_entry(id, user_id, user_role)
+        if error:
+            return error
+        
+        data = request.get_json(silent=True) or {}
+        tour = Tour(title=(data.get('title') or entry.title).strip(), created_by=user_id)
+        db.session.add(tour)
+        db.session.flush()
+        
+        rows = [build_stop_row(tour.id, stop, idx + 1) for idx, stop in enumerate(json.loads(entry.stops_payload))]
+        if rows:
+            db.session.execute(db.insert(TourStop), rows)
+        record_change('tour', tour.id, 'created', tour.created_by)
+        
+        db.session.commit()
+        if any(row['latitude'] is None for row in rows):
+            geocode_later(TourStop, [tour.id], key='tour_id')
+        print(f"[TOUR] Aus Archiv {id} neu angelegt: {tour.id} von User {user_id}")
+        return jsonify(tour.to_dict()), 201
+    except Exception as e:
+        db.session.rollback()
+        print(f"[TOUR ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/tours/archive/<int:id>', methods=['DELETE'])
+def delete_tour_archive(id):
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        entry, error = get_archive_entry(id, user_id, user_role)
+        if error:
+            return error
+        
+        bump_stats({(entry.created_by, STAT_TOURS_COMPLETED, stat_week(entry.completed_at)): -1})
+        db.session.delete(entry)
+        db.session.commit()
+        return jsonify({'message': 'Tour gelöscht'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+
+def archive_legacy_tours(batch_size=200, attempts=5):
+    """
+    Altbestand: noch in 'tours' als archiviert markierte Touren umziehen.
+    Läuft beim Start unter startup_lock(); zusätzlich ist jeder Batch eine
+    Transaktion, deren DELETE die Touren beansprucht - hat ein anderer
+    Prozess sie schon verschoben, wird der ganze Batch (samt Archivzeilen)
+    verworfen und neu gelesen.
+    """
+    moved = 0
+    while True:
+        tours = Tour.query.filter(Tour.archived == True).limit(batch_size).all()
+        if not tours:
+            break
+        try:
+            for tour in tours:
+                archive_tour(tour)
+            db.session.commit()
+        except (StaleDataError, OperationalError) as e:
+            db.session.rollback()
+            attempts -= 1
+            if attempts <= 0:
+                raise
+            print(f"[DB] Archiv-Umzug kollidiert, neuer Versuch: {str(e)}")
+            time.sleep(0.1)
+            continue
+        moved += len(tours)
+    if moved:
+        print(f"[DB] {moved} archivierte Touren ins Archiv verschoben")
+
+
+# ============================================================
+# ROUTENOPTIMIERUNG
+# ============================================================
+
+EARTH_RADIUS_KM = 6371.0
+# Straßen sind im Schnitt deutlich länger als die Luftlinie
+ROAD_DETOUR_FACTOR = 1.3
+# Strafkosten für Verspätung bei Zeitfenstern (km pro Minute)
+LATE_PENALTY_KM_PER_MIN = 5.0
+DEFAULT_SERVICE_MINUTES = 30
+DEFAULT_SPEED_KMH = 50.0
+
+
+def distance_matrix(lats, lons):
+    """Vektorisierte Haversine-Distanzmatrix in km (inkl. Straßenfaktor)"""
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lon = np.radians(np.asarray(lons, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))) * ROAD_DETOUR_FACTOR
+
+
+def route_length(dist, route):
+    """Gesamtlänge einer offenen Route (Liste von Knoten-Indizes)"""
+    route = np.asarray(route, dtype=int)
+    if len(route) < 2:
+        return 0.0
+    return float(dist[route[:-1], route[1:]].sum())
+
+
+def parse_clock(value):
+    """'HH:MM' -> Minuten ab Mitternacht"""
+    if value in (None, ''):
+        return None
+    hours, minutes = str(value).split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def format_clock(minutes):
+    minutes = int(round(minutes))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class RouteOptimizer:
+    """
+    Reihenfolge-Optimierung für eine offene Tour (erste Station != letzte Station).
+    Startlösung per Nearest-Neighbour, danach 2-opt und Or-opt, bis keine
+    Verbesserung mehr gefunden wird oder das Zeitbudget aufgebraucht ist.
+    Optional: feste erste/letzte Station und Zeitfenster (Minuten ab 0:00).
+    """
+
+    EPS = 1e-9
+    # Bei Zeitfenstern werden nur die besten Kandidaten voll bewertet
+    WINDOW_CANDIDATES = 5
+
+    def __init__(self, dist, earliest=None, latest=None, service_minutes=None,
+                 departure=480, speed_kmh=DEFAULT_SPEED_KMH,
+                 fixed_start=False, fixed_end=False, time_budget=0.8):
+        n = len(dist)
+        self.n = n
+        # Dummy-Knoten n mit Distanz 0 zu allen: Routenenden brauchen keine Sonderfälle
+        self.d = np.zeros((n + 1, n + 1))
+        self.d[:n, :n] = dist
+        self.earliest = np.full(n, -np.inf) if earliest is None else np.asarray(earliest, dtype=float)
+        self.latest = np.full(n, np.inf) if latest is None else np.asarray(latest, dtype=float)
+        self.service = np.zeros(n) if service_minutes is None else np.asarray(service_minutes, dtype=float)
+        self.has_windows = bool(np.isfinite(self.earliest).any() or np.isfinite(self.latest).any())
+        self.departure = departure
+        self.minutes_per_km = 60.0 / speed_kmh
+        self.fixed_start = fixed_start and n > 1
+        self.fixed_end = fixed_end and n > 1
+        self.time_budget = time_budget
+        self.deadline = None
+
+    # --- Bewertung ---------------------------------------------------------
+
+    def schedule(self, route):
+        """Ankunftszeiten und Verspätung (Minuten) entlang der Route"""
+        t = float(self.departure)
+        lateness = 0.0
+        late_nodes = []
+        arrivals = []
+        prev = None
+        for node in route:
+            if prev is not None:
+                t += self.d[prev, node] * self.minutes_per_km
+            t = max(t, self.earliest[node])
+            if t > self.latest[node]:
+                lateness += t - self.latest[node]
+                late_nodes.append(int(node))
+            arrivals.append(t)
+            t += self.service[node]
+            prev = node
+        return arrivals, lateness, late_nodes
+
+    def cost(self, route):
+        c = route_length(self.d, route)
+        if self.has_windows:
+            c += LATE_PENALTY_KM_PER_MIN * self.schedule(route)[1]
+        return c
+
+    def _accept(self, route, candidates):
+        """Erste Kandidaten-Route, die die Gesamtkosten senkt (Zeitfenster-Modus)"""
+        current = self.cost(route)
+        for candidate in candidates[:self.WINDOW_CANDIDATES]:
+            if self.cost(candidate) < current - self.EPS:
+                return candidate
+        return None
+
+    # --- Startlösung -------------------------------------------------------
+
+    def nearest_neighbour(self, first):
+        n = self.n
+        visited = np.zeros(n, dtype=bool)
+        visited[first] = True
+        last = n - 1 if self.fixed_end else None
+        if last is not None:
+            visited[last] = True
+        route = [first]
+        t = float(max(self.departure, self.earliest[first])) + self.service[first]
+        while not visited.all():
+            row = self.d[route[-1], :n].copy()
+            row[visited] = np.inf
+            if self.has_windows:
+                travel = t + row * self.minutes_per_km
+                # Wartezeit vor Fensterbeginn wie Fahrstrecke bewerten
+                row = row + np.maximum(self.earliest - travel, 0.0) / self.minutes_per_km
+                # Stopps, die nach einem weiteren Zwischenstopp zu spät kämen, haben Vorrang
+                slack = self.latest - np.maximum(travel, self.earliest)
+                detour = np.median(row[~visited]) * self.minutes_per_km + self.service.max()
+                urgent = ~visited & (slack < detour)
+                if urgent.any():
+                    row[~urgent] = np.inf
+            nxt = int(np.argmin(row))
+            t = max(t + self.d[route[-1], nxt] * self.minutes_per_km, self.earliest[nxt]) + self.service[nxt]
+            visited[nxt] = True
+            route.append(nxt)
+        if last is not None and last != first:
+            route.append(last)
+        return np.array(route, dtype=int)
+
+    # --- Verbesserung ------------------------------------------------------
+
+    def _bounds(self):
+        lo = 1 if self.fixed_start else 0
+        hi = self.n - 2 if self.fixed_end else self.n - 1
+        return lo, hi
+
+    def two_opt(self, r):
+        """Segmente umdrehen; Kantendeltas pro Startposition vektorisiert"""
+        n, d = self.n, self.d
+        lo, hi = self._bounds()
+        improved = False
+        for i in range(lo, hi):
+            if time.perf_counter() > self.deadline:
+                break
+            r_ext = np.append(r, n)
+            prev = r[i - 1] if i > 0 else n
+            js = np.arange(i + 1, hi + 1)
+            ends = r[js]
+            nxt = r_ext[js + 1]
+            delta = d[prev, ends] + d[r[i], nxt] - d[prev, r[i]] - d[ends, nxt]
+            order = np.argsort(delta)
+            order = order[delta[order] < -self.EPS]
+            if not len(order):
+                continue
+            if self.has_windows:
+                candidates = []
+                for k in order[:self.WINDOW_CANDIDATES]:
+                    c = r.copy()
+                    c[i:js[k] + 1] = c[i:js[k] + 1][::-1]
+                    candidates.append(c)
+                chosen = self._accept(r, candidates)
+                if chosen is None:
+                    continue
+                r[:] = chosen
+            else:
+                j = js[order[0]]
+                r[i:j + 1] = r[i:j + 1][::-1]
+            improved = True
+        return improved
+
+    def or_opt(self, r):
+        """Segmente der Länge 1-3 (ggf. umgedreht) an die beste Stelle verschieben"""
+        n, d = self.n, self.d
+        lo, hi = self._bounds()
+        improved = False
+        for k in (1, 2, 3):
+            i = lo
+            while i + k - 1 <= hi:
+                if time.perf_counter() > self.deadline:
+                    return r, improved
+                seg = r[i:i + k]
+                prev = r[i - 1] if i > 0 else n
+                nxt = r[i + k] if i + k < n else n
+                gain = d[prev, seg[0]] + d[seg[-1], nxt] - d[prev, nxt]
+                rest = np.concatenate([r[:i], r[i + k:]])
+                u = np.concatenate([[n], rest])
+                v = np.concatenate([rest, [n]])
+                forward = d[u, seg[0]] + d[seg[-1], v] - d[u, v]
+                backward = d[u, seg[-1]] + d[seg[0], v] - d[u, v]
+                delta = np.minimum(forward, backward) - gain
+                # Einfügen vor fixem Start bzw. hinter fixem Ende verbieten
+                if self.fixed_start:
+                    delta[0] = np.inf
+                if self.fixed_end:
+                    delta[-1] = np.inf
+                order = np.argsort(delta)
+                order = order[delta[order] < -self.EPS]
+                chosen = None
+                if len(order):
+                    candidates = []
+                    for e in order[:self.WINDOW_CANDIDATES if self.has_windows else 1]:
+                        piece = seg if forward[e] <= backward[e] else seg[::-1]
+                        candidates.append(np.concatenate([rest[:e], piece, rest[e:]]))
+                    chosen = self._accept(r, candidates) if self.has_windows else candidates[0]
+                if chosen is not None:
+                    r = chosen
+                    improved = True
+                else:
+                    i += 1
+        return r, improved
+
+    def solve(self):
+        """Liefert die optimierte Reihenfolge als Liste von Indizes"""
+        self.deadline = time.perf_counter() + self.time_budget
+        n = self.n
+        if n <= 2:
+            return list(range(n))
+        if self.fixed_start:
+            starts = [0]
+        else:
+            # Mehrere Startpunkte probieren, bei großen Touren nur eine Stichprobe
+            pool = n - 1 if self.fixed_end else n
+            starts = sorted(set(np.linspace(0, pool - 1, min(pool, 8)).astype(int).tolist()))
+        route = min((self.nearest_neighbour(s) for s in starts), key=self.cost)
+        while time.perf_counter() < self.deadline:
+            improved = self.two_opt(route)
+            route, moved = self.or_opt(route)
+            if not (improved or moved):
+                break
+        return route.tolist()
+
+
+def optimize_stops(stops, options):
+    """
+    Optimiert eine Liste von Stopps (dicts mit lat/lon, optional
+    window_start/window_end 'HH:MM' und service_minutes).
+    Gibt die neue Reihenfolge samt Kennzahlen zurück.
+    """
+    dist = distance_matrix([float(s['lat']) for s in stops], [float(s['lon']) for s in stops])
+    earliest = [parse_clock(s.get('window_start')) for s in stops]
+    latest = [parse_clock(s.get('window_end')) for s in stops]
+    optimizer = RouteOptimizer(
+        dist,
+        earliest=[-np.inf if e is None else e for e in earliest],
+        latest=[np.inf if l is None else l for l in latest],
+        service_minutes=[float(s.get('service_minutes', DEFAULT_SERVICE_MINUTES)) for s in stops],
+        departure=parse_clock(options.get('departure')) or 8 * 60,
+        speed_kmh=float(options.get('speed_kmh', DEFAULT_SPEED_KMH)),
+        fixed_start=bool(options.get('fixed_start')),
+        fixed_end=bool(options.get('fixed_end')),
+    )
+    started = time.perf_counter()
+    route = optimizer.solve()
+    runtime_ms = (time.perf_counter() - started) * 1000
+    arrivals, _, late_nodes = optimizer.schedule(route)
+
+    result_stops = []
+    for position, (idx, arrival) in enumerate(zip(route, arrivals)):
+        stop = dict(stops[idx])
+        stop['order'] = position + 1
+        stop['arrival'] = format_clock(arrival)
+        result_stops.append(stop)
+
+    naive_km = route_length(dist, range(len(stops)))
+    total_km = route_length(dist, route)
+    return {
+        'stops': result_stops,
+        'total_km': round(total_km, 2),
+        'naive_km': round(naive_km, 2),
+        'saved_km': round(naive_km - total_km, 2),
+        'late_stops': [stops[i].get('customer_name', '') for i in late_nodes],
+        'runtime_ms': round(runtime_ms, 1)
+    }
+
+
+def locate_stops(stops):
+    """
+    Ergänzt lat/lon für jeden Stopp: aus dem Request, aus gespeicherten
+    Koordinaten oder per Geokodierung. Gibt (stopps, nicht gefundene Adressen) zurück.
+    """
+    located = []
+    missing = []
+    for stop in stops:
+        stop = dict(stop)
+        if stop.get('lat') is None or stop.get('lon') is None:
+            stop['lat'], stop['lon'] = stop.get('latitude'), stop.get('longitude')
+        if stop['lat'] is None or stop['lon'] is None:
+            stop['lat'], stop['lon'] = geocode_address(stop.get('address'))
+        if stop['lat'] is None or stop['lon'] is None:
+            missing.append(stop.get('address') or stop.get('customer_name', ''))
+        located.append(stop)
+    db.session.commit()  # neue Geocode-Cache-Einträge sichern
+    return located, missing
+
+
+@app.route('/api/tours/optimize', methods=['POST'])
+def optimize_tour():
+    """Schlägt eine kürzere Reihenfolge für die übergebenen Stopps vor"""
+    user_id, user_role, is_admin = get_current_user()
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        data = request.get_json()
+        if not data or not data.get('stops'):
+            return jsonify({'message': 'Stopps erforderlich'}), 400
+        
+        stops, missing = locate_stops(data['stops'])
+        if missing:
+            return jsonify({'message': 'Adressen nicht gefunden', 'addresses': missing}), 400
+        
+        result = optimize_stops(stops, data)
+        print(f"[ROUTE] {len(stops)} Stopps: {result['naive_km']} -> {result['total_km']} km ({result['runtime_ms']} ms)")
+        return jsonify(result), 200
+    except Exception as e:
+        print(f"[ROUTE ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 400
+
+
+@app.route('/api/tours/<int:id>/optimize', methods=['POST'])
+def optimize_saved_tour(id):
+    """Optimierungsvorschlag für eine gespeicherte Tour (wird nicht gespeichert)"""
+    user_id, user_role, is_admin = get_current_user()
+    
+    if not user_id:
+        return jsonify({'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        tour = Tour.query.get(id)
+        if not tour:
+            return jsonify({'message': 'Tour nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and tour.created_by != user_id:
+            return jsonify({'message': 'Keine Berechtigung'}), 403
+        
+        options = request.get_json(silent=True) or {}
+        stops, missing = locate_stops([s.to_dict() for s in tour.stops.order_by(TourStop.order).all()])
+        if missing:
+            return jsonify({'message': 'Adressen nicht gefunden', 'addresses': missing}), 400
+        
+        result = optimize_stops(stops, options)
+        print(f"[ROUTE] Tour {id}: {result['naive_km']} -> {result['total_km']} km ({result['runtime_ms']} ms)")
+        return jsonify(result), 200
+    except Exception as e:
+        db.session.rollback()
+        print(f"[ROUTE ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 500
+
+
+JSON_CHECK_SAMPLES = [
+    'Müller & Söhne', 'Straße 1\n2. OG', 'Emoji \U0001F600 und \U00010348', 'Zeilen\u2028trenner\u2029',
+    '</script>', 'Steuerzeichen \x00\x1f\x7f', 'Anführung "x" und \\', '\ufeffBOM',
+    0.1, 1e-05, 1.5e-05, 0.0001, 1e-07, 1e16, -2.5e22, 3e-300, 123456789.123, 2 ** 53, -0.0, True, None,
+]
+
+
+@app.cli.command('check-json')
+@click.option('--runs', default=3, help='Wiederholungen für die Zeitmessung')
+def check_json(runs):
+    """Prüft encode_json/json_response (orjson) gegen json.dumps(ensure_ascii=True) auf echten Zeilen"""
+    with use_shard(None):
+        rows = [item for serializer in (customer_serializer, site_serializer, tour_serializer, archive_serializer)
+                for item in concat_shards(across_shards(serializer.fetch))]
+    rows.append({'samples': JSON_CHECK_SAMPLES, **{str(i): value for i, value in enumerate(JSON_CHECK_SAMPLES)}})
+    
+    def reference(data):
+        return json.dumps(data, ensure_ascii=True, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    
+    mismatches = [row for row in rows if encode_json(row) != reference(row)]
+    for row in mismatches[:5]:
+        print(f"[JSON] Abweichung:\n  json.dumps  {reference(row)[:200]!r}\n  encode_json {encode_json(row)[:200]!r}")
+    with app.test_request_context():
+        body = json_response(rows)
+        body = (body[0] if isinstance(body, tuple) else body).get_data()
+        expected = jsonify(rows).get_data()
+    print(f"[JSON] orjson {'aktiv' if orjson is not None else 'nicht installiert'} | {len(rows)} Zeilen | "
+          f"{len(mismatches)} Abweichungen | json_response wie jsonify: {body == expected}")
+    for label, encode in (('json.dumps', reference), ('encode_json', encode_json)):
+        started = time.perf_counter()
+        for _ in range(runs):
+            for row in rows:
+                encode(row)
+        print(f"[JSON] {label:12s} {(time.perf_counter() - started) / runs * 1000:8.1f} ms je Durchlauf")
+    if mismatches or body != expected:
+        raise click.ClickException('orjson-Ausgabe weicht von jsonify ab')
+
+
+@app.cli.command('bench-route')
+@click.option('--stops', default=120, help='Anzahl Stopps pro Tour')
+@click.option('--runs', default=5, help='Anzahl zufälliger Touren')
+def bench_route(stops, runs):
+    """Benchmark: optimierte vs. eingegebene Reihenfolge"""
+    rng = np.random.default_rng(42)
+    for run in range(runs):
+        # Zufällige Stopps im Raum Berlin/Brandenburg
+        lats = rng.uniform(51.8, 53.2, stops)
+        lons = rng.uniform(12.2, 14.6, stops)
+        started = time.perf_counter()
+        dist = distance_matrix(lats, lons)
+        route = RouteOptimizer(dist).solve()
+        runtime_ms = (time.perf_counter() - started) * 1000
+        naive_km = route_length(dist, range(stops))
+        total_km = route_length(dist, route)
+        print(f"Lauf {run + 1}: {stops} Stopps | naiv {naive_km:8.1f} km | "
+              f"optimiert {total_km:8.1f} km ({100 * (1 - total_km / naive_km):4.1f}% kürzer) | {runtime_ms:6.1f} ms")
+
+
+# ============================================================
+# INNENDIENST SPEZIAL-ENDPOINT
+# ============================================================
+
+@app.route('/api/users/aussendienst/<int:target_user_id>/data', methods=['GET'])
+def get_aussendienst_data(target_user_id):
+    """Innendienst: Lädt ALLE Daten eines Außendienst-Mitarbeiters"""
+    current_user_id, user_role, is_admin = get_current_user()
+    # KORREKTUR: Die Zeile 'current_role = session.get('role')' wurde entfernt,
+    # da sie den korrekten user_role-Wert (aus dem Header) überschreiben würde.
+    
+    # Graceful: Bei fehlender Anmeldung leere Daten zurückgeben
+    if not current_user_id:
+        return jsonify({
+            'user': {},
+            'customers': [],
+            'active_tours': [],
+            'archived_tours': [],
+            'construction_sites': []
+        }), 200
+    
+    # Nur Innendienst oder Admin dürfen zugreifen
+    if user_role != 'Innendienst' and not is_admin:
+        return jsonify({
+            'user': {},
+            'customers': [],
+            'active_tours': [],
+            'archived_tours': [],
+            'construction_sites': []
+        }), 200
     
     try:
-        customer = Customer.query.get(id)
-        if not customer:
-            return jsonify({'message': 'Kunde nicht gefunden'}), 404
+        target_user = User.query.get(target_user_id)
+        if not target_user:
+            return jsonify({
+                'user': {},
+                'customers': [],
+                'active_tours': [],
+                'archived_tours': [],
+                'construction_sites': []
+            }), 200
         
-        if user_role == 'Außendienst' and customer.created_by != user_id:
-            return jsonify({'message': 'Keine Berechtigung'}), 403
-
-        data = request.get_json()
+        customers = customer_serializer.fetch(Customer.created_by == target_user_id)
+        active_tours = tour_serializer.fetch(Tour.created_by == target_user_id, Tour.archived == False)
+        # Archiv nur die zuletzt abgeschlossenen; weitere über /api/tours/archive
+        archive_page = keyset_page(TourArchive.query.filter(TourArchive.created_by == target_user_id)
+                                   .options(db.joinedload(TourArchive.creator)),
+                                   TourArchive.completed_at, TourArchive)
+        archived_tours = [entry.to_dict() for entry in archive_page['items']]
+        construction_sites = site_serializer.fetch(ConstructionSite.created_by == target_user_id)
         
-        new_number = data.get('customer_number', '').strip()
-        if new_number and new_number != customer.customer_number:
-            existing = Customer.query.filter_by(customer_number=new_number, created_by=customer.created_by).first()
-            if existing:
-                return jsonify({'message': 'Kundennummer existiert bereits'}), 409
-            customer.customer_number = new_number
-
-        if data.get('name'):
-            customer.name = data['name'].strip()
-        if 'address' in data:
-            customer.address = data['address'].strip() if data['address'] else ''
-        if 'phone' in data:
-            customer.phone = data['phone'].strip() if data['phone'] else ''
-        if 'email' in data:
-            customer.email = data['email'].strip() if data['email'] else ''
-            
-        db.session.commit()
-        return jsonify(customer.to_dict()), 200
+        print(f"[INNENDIENST] Daten für {target_user.username}: {len(customers)} Kunden, {len(active_tours)} aktive, {len(archived_tours)} archiviert, {len(construction_sites)} Baustellen")
+        
+        return json_response({
+            'user': target_user.to_dict(),
+            'customers': customers,
+            'active_tours': active_tours,
+            'archived_tours': archived_tours,
+            'archived_pagination': page_summary(archive_page),
+            'construction_sites': construction_sites
+        })
     except Exception as e:
-        db.session.rollback()
-        return jsonify({'message': str(e)}), 500
+        print(f"[INNENDIENST ERROR] {str(e)}")
+        return jsonify({
+            'user': {},
+            'customers': [],
+            'active_tours': [],
+            'archived_tours': [],
+            'construction_sites': []
+        }), 200
 
 
-@app.route('/api/customers/<int:id>', methods=['DELETE'])
-def delete_customer(id):
+# Übersicht aller Außendienstler: pro Prozess zwischengespeichert und mit der
+# letzten Ereignis-ID des Änderungs-Feeds verknüpft. Der Feed ist für alle
+# Worker gemeinsam, jede committete Änderung an Kunden, Touren, Baustellen usw.
+# verwirft den Cache also überall; die TTL fängt Massen-Updates am Feed vorbei ab.
+OVERVIEW_CACHE_TTL = 30
+_overview_cache = {'expires': 0, 'data': None, 'event_id': None}
+_overview_lock = threading.Lock()
+
+
+def grouped_by_owner(owner_column, value, *criteria):
+    """{created_by: Aggregat} mit einer gruppierten Abfrage"""
+    return dict(db.session.execute(
+        db.select(owner_column, value).where(owner_column.isnot(None), *criteria).group_by(owner_column)
+    ).all())
+
+
+def overview_aggregates():
+    """Gruppierte Zählungen eines Shards (bzw. der einzigen Datenbank)"""
+    customers = grouped_by_owner(Customer.created_by, db.func.count(Customer.id))
+    active_tours = grouped_by_owner(Tour.created_by, db.func.count(Tour.id), Tour.archived == False)
+    archived_tours = grouped_by_owner(TourArchive.created_by, db.func.count(TourArchive.id))
+    sites = {}
+    for owner, status, count in db.session.execute(
+        db.select(ConstructionSite.created_by, ConstructionSite.status, db.func.count(ConstructionSite.id))
+          .group_by(ConstructionSite.created_by, ConstructionSite.status)
+    ):
+        sites.setdefault(owner, {})[status or 'Unbekannt'] = count
+    
+    # Letzte Aktivität: jüngster Zeitstempel über alle Tabellen mit Ersteller
+    activity = {}
+    sources = [
+        (VisitProtocol.created_by, VisitProtocol.visit_date),
+        (Tour.created_by, Tour.created_at),
+        (TourArchive.created_by, TourArchive.completed_at),
+        (ConstructionNote.created_by, ConstructionNote.created_at),
+        (Document.created_by, Document.created_at),
+    ]
+    for owner_column, time_column in sources:
+        for owner, latest in grouped_by_owner(owner_column, db.func.max(time_column)).items():
+            if latest is None:
+                continue
+            if not isinstance(latest, datetime):
+                latest = datetime.combine(latest, datetime.min.time())
+            if owner not in activity or latest > activity[owner]:
+                activity[owner] = latest
+    return customers, active_tours, archived_tours, sites, activity
+
+
+def build_overview():
+    """Kennzahlen je Außendienstler aus wenigen gruppierten Abfragen statt N Datenabzügen"""
+    users = db.session.execute(
+        db.select(User.id, User.username).where(User.role == 'Außendienst').order_by(User.username)
+    ).all()
+    customers, active_tours, archived_tours, sites, activity = Counter(), Counter(), Counter(), {}, {}
+    # Ein Shard kann auch Einträge anderer Ersteller enthalten: zusammenführen statt überschreiben
+    for part in across_shards(overview_aggregates):
+        for total, counts in zip((customers, active_tours, archived_tours), part[:3]):
+            total.update(counts)
+        for owner, by_status in part[3].items():
+            sites.setdefault(owner, {}).update(by_status)
+        for owner, latest in part[4].items():
+            if owner not in activity or latest > activity[owner]:
+                activity[owner] = latest
+    
+    return [{
+        'user_id': user_id,
+        'username': username,
+        'customers': customers.get(user_id, 0),
+        'active_tours': active_tours.get(user_id, 0),
+        'archived_tours': archived_tours.get(user_id, 0),
+        'sites_by_status': sites.get(user_id, {}),
+        'last_activity': format_datetime(activity.get(user_id))
+    } for user_id, username in users]
+
+
+@app.route('/api/users/aussendienst/overview', methods=['GET'])
+def get_aussendienst_overview():
+    """Innendienst: Kennzahlen aller Außendienst-Mitarbeiter in einem Aufruf"""
     user_id, user_role, is_admin = get_current_user()
     
     if not user_id:
         return jsonify({'message': 'Nicht angemeldet'}), 401
     
+    if user_role != 'Innendienst' and not is_admin:
+        return jsonify({'message': 'Keine Berechtigung'}), 403
+    
     try:
-        customer = Customer.query.get(id)
-        if not customer:
-            return jsonify({'message': 'Kunde nicht gefunden'}), 404
-        
-        if user_role == 'Außendienst' and customer.created_by != user_id:
-            return jsonify({'message': 'Keine Berechtigung'}), 403
-        
-        db.session.delete(customer)
-        db.session.commit()
-        return jsonify({'message': 'Kunde gelöscht'}), 200
+        with _overview_lock:
+            # Vor der Berechnung lesen: Änderungen währenddessen haben eine höhere ID
+            event_id = EVENT_BUS.latest_id()
+            data = _overview_cache['data']
+            if _overview_cache['event_id'] != event_id or _overview_cache['expires'] < time.time():
+                # Auch Admins (eigener Shard) sehen alle Außendienstler
+                with use_shard(None):
+                    data = build_overview()
+                _overview_cache.update(data=data, event_id=event_id,
+                                       expires=time.time() + OVERVIEW_CACHE_TTL)
+        return json_response(data)
     except Exception as e:
-        db.session.rollback()
+        print(f"[INNENDIENST ERROR] {str(e)}")
         return jsonify({'message': str(e)}), 500
 
 
 # ============================================================
-# PROTOCOL ROUTES
+# KENNZAHLEN (INKREMENTELL GEPFLEGT)
 # ============================================================
 
-@app.route('/api/protocols', methods=['POST'])
-def add_protocol():
+# Kennzahlen und ihre Perioden in user_stats:
+#   visits           ISO-Woche des Besuchs ('2025-W03'), je Protokoll-Ersteller
+#   tours_completed  ISO-Woche des Abschlusses, je Tour-Ersteller
+#   sites            Status der Baustelle (Bestand, kein Zeitbezug)
+#   last_visit       Datum des letzten Besuchs je Kunde oder 'nie' (Histogramm)
+STAT_VISITS = 'visits'
+STAT_TOURS_COMPLETED = 'tours_completed'
+STAT_SITES = 'sites'
+STAT_LAST_VISIT = 'last_visit'
+STAT_NEVER = 'nie'
+
+
+def stat_week(value):
+    year, week, _ = value.isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+def bump_stats(deltas, session=None):
+    """
+    Zähler in der laufenden Transaktion anpassen: {(user_id, metric, period): delta}.
+    Upsert, damit parallele Worker sich nicht gegenseitig überschreiben.
+    """
+    session = session or db.session
+    rows = [{'user_id': user, 'metric': metric, 'period': period, 'value': delta}
+            for (user, metric, period), delta in deltas.items() if user and delta]
+    if not rows:
+        return
+    dialect = postgresql if session.get_bind(UserStat).dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(UserStat)
+    stmt = stmt.on_conflict_do_update(index_elements=['user_id', 'metric', 'period'],
+                                      set_={'value': UserStat.__table__.c.value + stmt.excluded.value})
+    session.execute(stmt, rows)
+
+
+def last_visit_bucket(last_visit_date):
+    return last_visit_date.isoformat() if last_visit_date else STAT_NEVER
+
+
+def track_visit(protocol, customer, sign, session=None):
+    """
+    Neuen (sign=1) oder gelöschten (sign=-1) Besuch nach dem Flush verbuchen:
+    visit_count/last_visit_date am Kunden und die Kennzahlen, im selben Commit.
+    session: die Session, die protocol und customer geladen hat (commit_write).
+    """
+    session = session or db.session
+    bucket_before = last_visit_bucket(customer.last_visit_date)
+    # Als SQL-Ausdruck, damit parallele Requests keine Zählerstände überschreiben
+    customer.visit_count = db.func.coalesce(Customer.visit_count, 0) + sign
+    customer.last_visit_date = (db.select(db.func.max(VisitProtocol.visit_date))
+                                  .where(VisitProtocol.customer_id == customer.id).scalar_subquery())
+    session.flush()
+    
+    deltas = Counter()
+    deltas[(protocol.created_by, STAT_VISITS, stat_week(protocol.visit_date))] += sign
+    bucket_after = last_visit_bucket(customer.last_visit_date)
+    if bucket_after != bucket_before:
+        deltas[(customer.created_by, STAT_LAST_VISIT, bucket_before)] -= 1
+        deltas[(customer.created_by, STAT_LAST_VISIT, bucket_after)] += 1
+    bump_stats(deltas, session)
+
+
+def track_customer_removal(customer):
+    """Vor dem Löschen: Kunde samt kaskadierten Besuchen und Baustellen austragen"""
+    deltas = Counter({(customer.created_by, STAT_LAST_VISIT, last_visit_bucket(customer.last_visit_date)): -1})
+    visits = db.session.execute(
+        db.select(VisitProtocol.created_by, VisitProtocol.visit_date, db.func.count())
+          .where(VisitProtocol.customer_id == customer.id)
+          .group_by(VisitProtocol.created_by, VisitProtocol.visit_date)
+    )
+    for user, visit_date, count in visits:
+        deltas[(user, STAT_VISITS, stat_week(visit_date))] -= count
+    sites = db.session.execute(
+        db.select(ConstructionSite.created_by, ConstructionSite.status, db.func.count())
+          .where(ConstructionSite.customer_id == customer.id)
+          .group_by(ConstructionSite.created_by, ConstructionSite.status)
+    )
+    for user, status, count in sites:
+        deltas[(user, STAT_SITES, status or 'Unbekannt')] -= count
+    bump_stats(deltas)
+
+
+def collect_stat_deltas():
+    """Zählerstände aus den Quelltabellen eines Shards (bzw. der einzigen Datenbank)"""
+    deltas = Counter()
+    visits = db.session.execute(
+        db.select(VisitProtocol.created_by, VisitProtocol.visit_date, db.func.count())
+          .where(VisitProtocol.created_by.isnot(None))
+          .group_by(VisitProtocol.created_by, VisitProtocol.visit_date)
+    )
+    for user, visit_date, count in visits:
+        deltas[(user, STAT_VISITS, stat_week(visit_date))] += count
+    last_visits = db.session.execute(
+        db.select(Customer.created_by, db.func.max(VisitProtocol.visit_date))
+          .outerjoin(VisitProtocol, VisitProtocol.customer_id == Customer.id)
+          .group_by(Customer.id, Customer.created_by)
+    )
+    for owner, last in last_visits:
+        deltas[(owner, STAT_LAST_VISIT, last.isoformat() if last else STAT_NEVER)] += 1
+    sites = db.session.execute(
+        db.select(ConstructionSite.created_by, ConstructionSite.status, db.func.count())
+          .group_by(ConstructionSite.created_by, ConstructionSite.status)
+    )
+    for user, status, count in sites:
+        deltas[(user, STAT_SITES, status or 'Unbekannt')] += count
+    completed = db.session.execute(
+        db.select(TourArchive.created_by, TourArchive.completed_at).execution_options(yield_per=1000)
+    )
+    for user, completed_at in completed:
+        deltas[(user, STAT_TOURS_COMPLETED, stat_week(completed_at))] += 1
+    return deltas
+
+
+def rebuild_stats():
+    """Alle Zähler aus den Quelltabellen neu berechnen (Backfill/Reparatur)"""
+    deltas = Counter()
+    for part in across_shards(collect_stat_deltas):
+        deltas.update(part)
+    
+    db.session.execute(db.delete(UserStat))
+    rows = [{'user_id': user, 'metric': metric, 'period': period, 'value': value}
+            for (user, metric, period), value in deltas.items() if user and value]
+    if rows:
+        db.session.execute(db.insert(UserStat), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def stats_for_users(user_ids, weeks, days):
+    """Kennzahlen je Mitarbeiter, nur aus user_stats gelesen (user_ids=None: alle)"""
+    today = date.today()
+    week_keys = [stat_week(today - timedelta(weeks=i)) for i in reversed(range(weeks))]
+    cutoff = (today - timedelta(days=days)).isoformat()
+    scope = [UserStat.user_id.in_(user_ids)] if user_ids is not None else []
+    
+    result = {}
+    
+    def entry(user):
+        if user not in result:
+            result[user] = {
+                'visits_per_week': dict.fromkeys(week_keys, 0),
+                'tours_completed_per_week': dict.fromkeys(week_keys, 0),
+                'tours_completed_total': 0,
+                'sites_by_status': {},
+                'customers_without_visit': 0
+            }
+        return result[user]
+    
+    rows = db.session.execute(
+        db.select(UserStat.user_id, UserStat.metric, UserStat.period, UserStat.value).where(
+            *scope,
+            db.or_(db.and_(UserStat.metric == STAT_VISITS, UserStat.period.in_(week_keys)),
+                   db.and_(UserStat.metric == STAT_TOURS_COMPLETED, UserStat.period.in_(week_keys)),
+                   UserStat.metric == STAT_SITES)
+        )
+    )
+    for user, metric, period, value in rows:
+        stats = entry(user)
+        if metric == STAT_VISITS:
+            stats['visits_per_week'][period] = value
+        elif metric == STAT_TOURS_COMPLETED:
+            stats['tours_completed_per_week'][period] = value
+        elif value:
+            stats['sites_by_status'][period] = value
+    
+    totals = db.session.execute(
+        db.select(UserStat.user_id, UserStat.metric, db.func.sum(UserStat.value)).where(
+            *scope,
+            db.or_(UserStat.metric == STAT_TOURS_COMPLETED,
+                   db.and_(UserStat.metric == STAT_LAST_VISIT,
+                           db.or_(UserStat.period < cutoff, UserStat.period == STAT_NEVER)))
+        ).group_by(UserStat.user_id, UserStat.metric)
+    )
+    for user, metric, value in totals:
+        key = 'tours_completed_total' if metric == STAT_TOURS_COMPLETED else 'customers_without_visit'
+        entry(user)[key] = int(value or 0)
+    
+    return week_keys, result
+
+
+def combine_stats(per_user):
+    """Firmenweite Summe der Kennzahlen"""
+    total = {'visits_per_week': Counter(), 'tours_completed_per_week': Counter(),
+             'tours_completed_total': 0, 'sites_by_status': Counter(), 'customers_without_visit': 0}
+    for stats in per_user:
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                total[key].update(value)
+            else:
+                total[key] += value
+    return {key: dict(value) if isinstance(value, Counter) else value for key, value in total.items()}
+
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """
+    Vertriebs-Kennzahlen: ?weeks=8 (Besuche/Touren je Woche), ?days=30 (Kunden
+    ohne Besuch seit N Tagen). Außendienst sieht nur sich selbst, Innendienst
+    und Admin alle Mitarbeiter plus Firmensumme (?user_id= für einen).
+    """
     user_id, user_role, is_admin = get_current_user()
+    
     if not user_id:
         return jsonify({'message': 'Nicht angemeldet'}), 401
     
+    try:
+        weeks = min(max(int(request.args.get('weeks', 8)), 1), 52)
+        days = max(int(request.args.get('days', 30)), 0)
+        if user_role == 'Außendienst' and not is_admin:
+            user_ids = [user_id]
+        elif request.args.get('user_id'):
+            user_ids = [int(request.args['user_id'])]
+        else:
+            user_ids = None
+        
+        week_keys, per_user = stats_for_users(user_ids, weeks, days)
+        names = dict(db.session.execute(
+            db.select(User.id, User.username).where(User.id.in_(list(per_user)))
+        ).all())
+        users = [{'user_id': user, 'username': names.get(user, 'Unbekannt'), **stats}
+                 for user, stats in sorted(per_user.items())]
+        return json_response({
+            'weeks': week_keys,
+            'days': days,
+            'total': combine_stats(per_user.values()),
+            'users': users
+        })
+    except (ValueError, TypeError) as e:
+        return jsonify({'message': f'Ungültige Parameter: {str(e)}'}), 400
+    except Exception as e:
+        print(f"[STATS ERROR] {str(e)}")
+        return jsonify({'message': str(e)}), 500
+
+
+def check_visit_summary(repair=False):
+    """
+    visit_count/last_visit_date gegen visit_protocols prüfen; mit repair=True
+    abweichende Kunden korrigieren und die Kennzahlen neu aufbauen.
+    """
+    
+    def drift_in_shard():
+        actual = (db.select(VisitProtocol.customer_id,
+                            db.func.count(VisitProtocol.id).label('visits'),
+                            db.func.max(VisitProtocol.visit_date).label('last_visit'))
+                    .group_by(VisitProtocol.customer_id).subquery())
+        visits = db.func.coalesce(actual.c.visits, 0)
+        drift = db.session.execute(
+            db.select(Customer.id, visits, actual.c.last_visit, Customer.created_by)
+              .outerjoin(actual, actual.c.customer_id == Customer.id)
+              .where(db.or_(db.func.coalesce(Customer.visit_count, -1) != visits,
+                            Customer.last_visit_date.is_distinct_from(actual.c.last_visit)))
+        ).all()
+        if repair and drift:
+            db.session.execute(db.update(Customer), [
+                {'id': customer_id, 'visit_count': count, 'last_visit_date': last_visit}
+                for customer_id, count, last_visit, _ in drift
+            ])
+            record_changes('customer', [(row[0], row[3]) for row in drift], 'updated')
+            db.session.commit()
+        return [row[0] for row in drift]
+    
+    drifted = concat_shards(across_shards(drift_in_shard))
+    if repair and drifted:
+        rebuild_stats()
+    return drifted
+
+
+@app.cli.command('check-visits')
+@click.option('--repair', is_flag=True, help='Abweichungen korrigieren')
+def check_visits_command(repair):
+    """Denormalisierte Besuchsdaten der Kunden auf Abweichungen prüfen"""
+    drifted = check_visit_summary(repair=repair)
+    action = 'korrigiert' if repair else 'gefunden (--repair zum Korrigieren)'
+    print(f"[VISITS] {len(drifted)} Abweichungen {action}")
+    if drifted and not repair:
+        print(f"[VISITS] Kunden: {', '.join(map(str, drifted[:50]))}")
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Kennzahlen-Zähler aus den Quelltabellen neu aufbauen"""
+    started = time.perf_counter()
+    count = rebuild_stats()
+    print(f"[STATS] {count} Zähler neu berechnet in {time.perf_counter() - started:.2f}s")
+
+
+# ============================================================
+# USER ROUTES
+# ============================================================
+
+@app.route('/api/users', methods=['GET'])
+def list_users():
+    try:
+        if wants_stream():
+            return stream_json_array(*user_serializer.statement(fields=request.args.get('fields')), label='USERS')
+        return json_response(user_serializer.fetch(fields=request.args.get('fields')))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify([]), 200
+
+
+@app.route('/api/users', methods=['POST'])
+def create_user():
     try:
         data = request.get_json()
-        new_protocol = VisitProtocol(
-            customer_id=data['customer_id'],
-            visit_date=datetime.strptime(data['visit_date'], '%Y-%m-%d').date(),
-            summary=data['summary'],
-            created_by=user_id
+        
+        if not data.get('username') or not data.get('password'):
+            return jsonify({'message': 'Nutzername und Passwort erforderlich'}), 400
+        
+        if User.query.filter_by(username=data['username']).first():
+            return jsonify({'message': 'Nutzername existiert bereits'}), 409
+            
+        new_user = User(
+            username=data['username'],
+            password=data['password'],
+            role=data.get('role', 'Außendienst'),
+            is_admin=data.get('is_admin', False)
         )
-        db.session.add(new_protocol)
+        db.session.add(new_user)
         db.session.commit()
-        return jsonify(new_protocol.to_dict()), 201
+        if SHARD_MODE:
+            mirror_user(new_user.id, new_user.to_dict())
+        return jsonify(new_user.to_dict()), 201
     except Exception as e:
         db.session.rollback()
-        return jsonify({'message': str(e)}), 400
+        return jsonify({'message': str(e)}), 500
+
+
+@app.route('/api/users/<int:id>', methods=['DELETE'])
+def delete_user(id):
+    try:
+        user = User.query.get(id)
+        if not user:
+            return jsonify({'message': 'Nutzer nicht gefunden'}), 404
+        if user.id == 1:
+            return jsonify({'message': 'System-Admin kann nicht gelöscht werden'}), 403
+        # Kunden, Baustellen und Touren des Nutzers entfernt die Datenbank per Kaskade
+        # (im Shard-Modus verschwinden die Dokumente mit der Shard-Datei)
+        documents = [] if SHARD_MODE else documents_attached_to(customers=Customer.created_by == id,
+                                                                  sites=ConstructionSite.created_by == id)
+        db.session.delete(user)
+        mark_orphaned_documents(documents)
+        db.session.commit()
+        if SHARD_MODE:
+            # Im Shard-Modus ersetzt das Entfernen der Shard-Datei die Kaskade
+            drop_shard(id)
+            mirror_user(id)
+        invalidate_user(id)
+        document_purger.wake()
+        return jsonify({'message': 'Nutzer gelöscht'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+
+# ============================================================
+# HINTERGRUND-BEREINIGUNG VERWAISTER DOKUMENTE
+# ============================================================
+
+DOCUMENT_PURGE_BATCH = 200
+DOCUMENT_PURGE_INTERVAL = int(os.environ.get('DOCUMENT_PURGE_INTERVAL', '600'))
+
+
+def documents_attached_to(customers=None, sites=None, session=None):
+    """
+    Vor dem Löschen: IDs der Dokumente an den Kunden (Kriterium auf Customer,
+    samt deren Baustellen) bzw. Baustellen (Kriterium auf ConstructionSite)
+    """
+    session = session or db.session
+    conditions = []
+    if customers is not None:
+        customer_ids = db.select(Customer.id).where(customers)
+        conditions += [Document.customer_id.in_(customer_ids),
+                       Document.construction_site_id.in_(
+                           db.select(ConstructionSite.id).where(ConstructionSite.customer_id.in_(customer_ids)))]
+    if sites is not None:
+        conditions.append(Document.construction_site_id.in_(db.select(ConstructionSite.id).where(sites)))
+    return session.execute(db.select(Document.id).where(db.or_(*conditions))).scalars().all()
+
+
+def mark_orphaned_documents(document_ids, session=None):
+    """Nach dem Löschen (im selben Commit): Dokumente, die an nichts mehr hängen, für den Purger markieren"""
+    session = session or db.session
+    session.flush()
+    now = datetime.utcnow()
+    for ids in chunked(list(document_ids)):
+        rows = session.execute(
+            db.select(Document.id, Document.created_by)
+              .where(Document.id.in_(ids), Document.orphaned_at.is_(None),
+                     Document.customer_id.is_(None), Document.construction_site_id.is_(None))
+        ).all()
+        if not rows:
+            continue
+        session.execute(
+            db.update(Document).where(Document.id.in_([row_id for row_id, _ in rows])).values(orphaned_at=now)
+              .execution_options(synchronize_session=False))
+        record_changes('document', rows, 'updated', session)
+
+
+def purge_orphaned_documents(session=None, batch_size=DOCUMENT_PURGE_BATCH):
+    """
+    Löscht Dokumente samt Blob, deren Kunde/Baustelle gelöscht wurde (von
+    mark_orphaned_documents markiert). Dokumente, die schon beim Anlegen an
+    nichts hingen, bleiben erhalten. Kleine Batches mit eigenem Commit halten
+    Sperren kurz.
+    """
+    session = session or db.session
+    orphaned = db.and_(Document.orphaned_at.isnot(None),
+                       Document.customer_id.is_(None), Document.construction_site_id.is_(None))
+    total = 0
+    while True:
+        ids = session.execute(db.select(Document.id).where(orphaned).limit(batch_size)).scalars().all()
+        if not ids:
+            return total
+        # Nur tatsächlich gelöschte Zeilen melden (ein paralleler Purger kann schneller sein)
+        rows = session.execute(db.delete(Document).where(Document.id.in_(ids))
+                                 .returning(Document.id, Document.created_by)).all()
+        record_changes('document', rows, 'deleted', session)
+        session.commit()
+        total += len(rows)
+
+
+class DocumentPurger:
+    """Hintergrund-Thread pro Worker-Prozess; wird nach Löschungen sofort geweckt"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._wake = None
+        self._pid = None
+
+    def wake(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            threading.Thread(target=self._run, name='document-purger', daemon=True).start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    removed = sum(across_shards(purge_orphaned_documents))
+                if removed:
+                    print(f"[PURGE] {removed} verwaiste Dokumente entfernt")
+            except Exception as e:
+                print(f"[PURGE ERROR] {str(e)}")
+
+
+document_purger = DocumentPurger(DOCUMENT_PURGE_INTERVAL)
+
+
+@app.cli.command('purge-documents')
+def purge_documents():
+    """Verwaiste Dokumente sofort entfernen"""
+    print(f"[PURGE] {sum(across_shards(purge_orphaned_documents))} verwaiste Dokumente entfernt")
+
+
+# ============================================================
+# HINTERGRUND-JOBS
+# ============================================================
+
+JOB_POLL_INTERVAL = 2
+JOB_RETRY_DELAY = 5
+# Läuft ein Job so lange ohne Fortschrittsmeldung, gilt sein Worker als abgestürzt
+JOB_STALE_TIMEOUT = 600
+# Abgeschlossene Jobs (und damit ihre Idempotenz-Schlüssel) so lange aufbewahren
+JOB_RETENTION = 24 * 3600
+
+
+class SQLiteJobStore:
+    """
+    Job-Warteschlange in einer lokalen SQLite-Datei, geteilt von allen
+    Worker-Prozessen. Jobs werden per BEGIN IMMEDIATE exklusiv übernommen.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._init_schema()
+
+    def _conn(self):
+        # Eine Verbindung pro Thread; nach fork() (Gunicorn) neu verbinden
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self):
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                job_key TEXT UNIQUE,
+                owner_id INTEGER,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                progress REAL NOT NULL DEFAULT 0,
+                message TEXT,
+                result TEXT,
+                error TEXT,
+                run_after REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS ix_jobs_queue ON jobs (status, priority, run_after);
+            CREATE INDEX IF NOT EXISTS ix_jobs_finished_at ON jobs (finished_at);
+        ''')
+
+    def enqueue(self, kind, params, owner_id=None, priority=0, key=None, max_attempts=3):
+        """
+        Job einreihen und seine ID liefern. Gleicher Schlüssel -> bestehender
+        Job (fehlgeschlagene werden neu eingereiht statt doppelt angelegt).
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if key:
+                row = conn.execute('SELECT id, status FROM jobs WHERE job_key = ?', (key,)).fetchone()
+                if row:
+                    if row['status'] == 'failed':
+                        conn.execute(
+                            "UPDATE jobs SET status = 'queued', attempts = 0, progress = 0, error = NULL, "
+                            "message = NULL, run_after = ?, updated_at = ?, finished_at = NULL WHERE id = ?",
+                            (now, now, row['id']))
+                    conn.execute('COMMIT')
+                    return row['id']
+            job_id = secrets.token_urlsafe(12)
+            conn.execute(
+                'INSERT INTO jobs (id, kind, job_key, owner_id, params, status, priority, max_attempts, '
+                "run_after, created_at, updated_at) VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, kind, key, owner_id, json.dumps(params), priority, max_attempts, now, now, now))
+            conn.execute('COMMIT')
+            return job_id
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def claim(self):
+        """Dringendsten fälligen Job übernehmen (höchste Priorität, dann älteste)"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Jobs abgestürzter Worker wieder freigeben - aber nicht endlos: ein Job,
+            # der seinen Worker abschießt, erreicht fail() nie
+            conn.execute("UPDATE jobs SET status = 'failed', error = 'Worker abgebrochen', finished_at = ? "
+                         "WHERE status = 'running' AND updated_at < ? AND attempts >= max_attempts",
+                         (now, now - JOB_STALE_TIMEOUT))
+            conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated_at < ?",
+                         (now - JOB_STALE_TIMEOUT,))
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' AND run_after <= ? "
+                'ORDER BY priority DESC, created_at LIMIT 1', (now,)).fetchone()
+            if row:
+                conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? "
+                             'WHERE id = ?', (now, row['id']))
+                row = conn.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone()
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if not row:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        return job
+
+    def report(self, job_id, progress, message=None):
+        self._conn().execute('UPDATE jobs SET progress = ?, message = ?, updated_at = ? WHERE id = ?',
+                             (min(max(progress, 0.0), 1.0), message, time.time(), job_id))
+
+    def finish(self, job_id, result):
+        now = time.time()
+        self._conn().execute(
+            "UPDATE jobs SET status = 'done', progress = 1, result = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+            (json.dumps(result), now, now, job_id))
+
+    def fail(self, job_id, error):
+        """Fehlschlag: mit wachsendem Abstand erneut versuchen, bis max_attempts erreicht ist"""
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute('SELECT attempts, max_attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row and row['attempts'] < row['max_attempts']:
+            conn.execute("UPDATE jobs SET status = 'queued', error = ?, run_after = ?, updated_at = ? WHERE id = ?",
+                         (error, now + JOB_RETRY_DELAY * 2 ** (row['attempts'] - 1), now, job_id))
+            return True
+        conn.execute("UPDATE jobs SET status = 'failed', error = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+                     (error, now, now, job_id))
+        return False
+
+    def get(self, job_id):
+        row = self._conn().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def purge_finished(self, older_than=JOB_RETENTION):
+        """Alte erledigte Jobs löschen, samt ihrer Ergebnisdatei in JOB_EXPORT_DIR"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute("SELECT id, result FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                                (time.time() - older_than,)).fetchall()
+            conn.executemany('DELETE FROM jobs WHERE id = ?', [(row['id'],) for row in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        for row in rows:
+            filename = (json.loads(row['result']) if row['result'] else {}).get('file')
+            if filename:
+                try:
+                    os.remove(os.path.join(JOB_EXPORT_DIR, os.path.basename(filename)))
+                except FileNotFoundError:
+                    pass
+        return len(rows)
+
+
+JOB_HANDLERS = {}
+
+
+def job_handler(kind):
+    """Registriert fn(params, report) für eine Job-Art; report(anteil, text) meldet Fortschritt"""
+    def register(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+class JobWorkerPool:
+    """Worker-Threads pro Prozess; enqueue() weckt sie sofort, sonst wird gepollt"""
+
+    def __init__(self, store, size):
+        self.store = store
+        self.size = size
+        self._wake = threading.Event()
+        self._pid = None
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._wake = threading.Event()
+        for number in range(self.size):
+            threading.Thread(target=self._run, name=f'job-worker-{number}', daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        last_cleanup = 0
+        while True:
+            try:
+                if time.time() - last_cleanup > 3600:
+                    self.store.purge_finished()
+                    last_cleanup = time.time()
+                job = self.store.claim()
+            except Exception as e:
+                print(f"[JOBS ERROR] {str(e)}")
+                job = None
+            if job is None:
+                self._wake.wait(JOB_POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            self.run_job(job)
+
+    def run_job(self, job):
+        handler = JOB_HANDLERS.get(job['kind'])
+
+        def report(progress, message=None):
+            self.store.report(job['id'], progress, message)
+
+        try:
+            if handler is None:
+                raise ValueError(f"Unbekannte Job-Art: {job['kind']}")
+            with app.app_context(), use_shard(job['params'].get('shard')):
+                result = handler(job['params'], report)
+            self.store.finish(job['id'], result)
+            print(f"[JOBS] {job['kind']} {job['id']} erledigt")
+        except Exception as e:
+            retry = self.store.fail(job['id'], str(e))
+            print(f"[JOBS ERROR] {job['kind']} {job['id']} (Versuch {job['attempts']}): {str(e)}"
+                  f"{' - neuer Versuch geplant' if retry else ''}")
+
+
+JOB_STORE = SQLiteJobStore(JOB_DB_PATH)
+job_pool = JobWorkerPool(JOB_STORE, JOB_WORKERS)
+
+
+@app.before_request
+def start_job_workers():
+    if JOB_WORKER_MODE == 'thread':
+        job_pool.start()
 
 
-@app.route('/api/protocols/<int:id>', methods=['DELETE'])
-def delete_protocol(id):
-    user_id, user_role, is_admin = get_current_user()
-    
-    if not user_id:
-        return jsonify({'message': 'Nicht angemeldet'}), 401
-    
-    try:
-        protocol = VisitProtocol.query.get(id)
-        if not protocol:
-            return jsonify({'message': 'Protokoll nicht gefunden'}), 404
-        
-        if user_role == 'Außendienst' and protocol.created_by != user_id:
-            return jsonify({'message': 'Keine Berechtigung'}), 403
-        
-        db.session.delete(protocol)
-        db.session.commit()
-        return jsonify({'message': 'Protokoll gelöscht'}), 200
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'message': str(e)}), 500
+def enqueue_job(kind, params, owner_id=None, priority=0, key=None):
+    if SHARD_MODE:
+        # Der Job arbeitet im Shard des auslösenden Requests (None: alle Shards)
+        params = dict(params, shard=current_shard())
+    job_id = JOB_STORE.enqueue(kind, params, owner_id=owner_id, priority=priority, key=key)
+    job_pool.wake()
+    return job_id
 
 
-# ============================================================
-# DOCUMENT ROUTES
-# ============================================================
+def idempotency_key(user_id, kind, payload=None):
+    """Schlüssel aus Header 'Idempotency-Key' oder dem Inhalt (doppelt abgeschickte Importe)"""
+    header = request.headers.get('Idempotency-Key')
+    if header:
+        return f'{user_id}:{kind}:{header}'
+    if payload is not None:
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        return f'{user_id}:{kind}:{digest}'
+    return None
 
-@app.route('/api/documents', methods=['POST'])
-def add_document():
+
+def job_accepted(job_id):
+    return jsonify({'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'}), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
     user_id, user_role, is_admin = get_current_user()
+    
     if not user_id:
         return jsonify({'message': 'Nicht angemeldet'}), 401
     
-    try:
-        data = request.get_json()
-        
-        new_document = Document(
-            customer_id=data.get('customer_id'),
-            construction_site_id=data.get('construction_site_id'),
-            name=data['name'],
-            type=data['type'],
-            file_url=data.get('file_url', ''),
-            created_by=user_id
-        )
-        
-        if data.get('file_data'):
-            file_data_str = data['file_data']
-            if ',' in file_data_str:
-                file_data_str = file_data_str.split(',')[1]
-            new_document.file_data = base64.b64decode(file_data_str)
-        
-        db.session.add(new_document)
-        db.session.commit()
-        
-        print(f"[DOCUMENT] Erstellt: {new_document.name} (ID:{new_document.id})")
-        return jsonify(new_document.to_dict()), 201
-    except Exception as e:
-        db.session.rollback()
-        print(f"[DOCUMENT ERROR] {str(e)}")
-        return jsonify({'message': str(e)}), 400
+    job = JOB_STORE.get(job_id)
+    if not job:
+        return jsonify({'message': 'Job nicht gefunden'}), 404
+    
+    if job['owner_id'] != user_id and not is_admin:
+        return jsonify({'message': 'Keine Berechtigung'}), 403
+    
+    return jsonify({
+        'id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': round(job['progress'], 3),
+        'message': job['message'],
+        'attempts': job['attempts'],
+        'result': job['result'],
+        'error': job['error'],
+        'created_at': datetime.utcfromtimestamp(job['created_at']).strftime('%Y-%m-%d %H:%M:%S'),
+        'finished_at': (datetime.utcfromtimestamp(job['finished_at']).strftime('%Y-%m-%d %H:%M:%S')
+                        if job['finished_at'] else None)
+    }), 200
 
 
-@app.route('/api/documents/<int:id>', methods=['DELETE'])
-def delete_document(id):
+@app.route('/api/jobs/<job_id>/download', methods=['GET'])
+def download_job_result(job_id):
+    """Ergebnisdatei eines Export-Jobs"""
     user_id, user_role, is_admin = get_current_user()
     
     if not user_id:
         return jsonify({'message': 'Nicht angemeldet'}), 401
     
-    try:
-        document = Document.query.get(id)
-        if not document:
-            return jsonify({'message': 'Dokument nicht gefunden'}), 404
-        
-        if user_role == 'Außendienst' and document.created_by != user_id:
-            return jsonify({'message': 'Keine Berechtigung'}), 403
-        
-        db.session.delete(document)
+    job = JOB_STORE.get(job_id)
+    if not job or job['status'] != 'done' or not (job['result'] or {}).get('file'):
+        return jsonify({'message': 'Keine Datei vorhanden'}), 404
+    
+    if job['owner_id'] != user_id and not is_admin:
+        return jsonify({'message': 'Keine Berechtigung'}), 403
+    
+    path = os.path.join(JOB_EXPORT_DIR, job['result']['file'])
+    if not os.path.exists(path):
+        return jsonify({'message': 'Datei nicht mehr vorhanden'}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=job['result']['file'])
+
+
+# --- Job-Arten ---
+
+IMPORT_FIELDS = ('customer_number', 'name', 'address', 'phone', 'email')
+IMPORT_BATCH = 100
+
+
+@job_handler('import-customers')
+def run_customer_import(params, report):
+    """Kunden in Batches anlegen (inkl. Geokodierung); vorhandene Nummern überspringen"""
+    owner_id, rows = params['user_id'], params['rows']
+    created, skipped, invalid = 0, [], 0
+    for start in range(0, len(rows), IMPORT_BATCH):
+        batch = rows[start:start + IMPORT_BATCH]
+        numbers = [str(row.get('customer_number') or '').strip() for row in batch]
+        existing = set(db.session.execute(
+            db.select(Customer.customer_number)
+              .where(Customer.created_by == owner_id, Customer.customer_number.in_(numbers))
+        ).scalars())
+        batch_created = 0
+        for number, row in zip(numbers, batch):
+            name = str(row.get('name') or '').strip()
+            if not number or not name:
+                invalid += 1
+                continue
+            if number in existing:
+                skipped.append(number)
+                continue
+            existing.add(number)
+            customer = Customer(customer_number=number, name=name, created_by=owner_id,
+                                **{field: str(row.get(field) or '').strip() for field in IMPORT_FIELDS[2:]})
+            apply_location(customer, row)
+            db.session.add(customer)
+            batch_created += 1
+        bump_stats({(owner_id, STAT_LAST_VISIT, STAT_NEVER): batch_created})
         db.session.commit()
-        return jsonify({'message': 'Dokument gelöscht'}), 200
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'message': str(e)}), 500
+        created += batch_created
+        report((start + len(batch)) / len(rows), f'{start + len(batch)} von {len(rows)} Zeilen')
+    return {'created': created, 'skipped': skipped, 'invalid_rows': invalid}
 
 
-@app.route('/api/documents/<int:id>/download', methods=['GET'])
-def download_document(id):
-    try:
-        document = Document.query.get(id)
-        if not document or not document.file_data:
-            return jsonify({'message': 'Dokument nicht gefunden'}), 404
-        
-        return jsonify({
-            'name': document.name,
-            'type': document.type,
-            'data': base64.b64encode(document.file_data).decode('utf-8')
-        }), 200
-    except Exception as e:
-        return jsonify({'message': str(e)}), 500
+@job_handler('export-customers')
+def run_customer_export(params, report):
+    """Kunden (sichtbar für den Auftraggeber) als CSV-Datei schreiben"""
+    criteria = [Customer.created_by == params['user_id']] if params['role'] == 'Außendienst' else []
+    total = sum(across_shards(lambda: db.session.execute(
+        db.select(db.func.count(Customer.id)).where(*criteria)).scalar()))
+    stmt, convert, finish = customer_serializer.statement(*criteria)
+    os.makedirs(JOB_EXPORT_DIR, exist_ok=True)
+    filename = f"kunden_{params['user_id']}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"
+    written = 0
+    with open(os.path.join(JOB_EXPORT_DIR, filename), 'w', newline='', encoding='utf-8') as handle:
+        writer = csv.DictWriter(handle, fieldnames=customer_serializer.resolve_fields(), delimiter=';')
+        writer.writeheader()
+        # Shards nacheinander, damit die Datei nach ID sortiert bleibt
+        for shard in visible_shards():
+            with use_shard(shard):
+                for rows in db.session.execute(stmt.execution_options(yield_per=STREAM_BATCH_SIZE)).partitions():
+                    writer.writerows(finish(convert(rows)))
+                    written += len(rows)
+                    report(written / total if total else 1.0, f'{written} von {total} Kunden')
+    return {'file': filename, 'rows': written}
 
 
-# ============================================================
-# CONSTRUCTION SITE ROUTES - STRIKTE ISOLATION
-# ============================================================
+def geocode_later(model, ids, key='id'):
+    """Ohne Koordinaten gespeicherte Zeilen im Job nachgeokodieren (nur Netzwerk-Geocoder)"""
+    if geocoder.remote and ids:
+        enqueue_job('geocode', {'model': model.__name__, 'key': key, 'ids': sorted(set(ids))}, priority=-1)
 
-@app.route('/api/constructionsites', methods=['GET'])
-def list_sites():
-    user_id, user_role, is_admin = get_current_user()
-    
-    if not user_id:
-        return jsonify([]), 200
-    
-    try:
-        if user_role == 'Außendienst':
-            sites = ConstructionSite.query.filter_by(created_by=user_id).all()
-        else:
-            sites = ConstructionSite.query.all()
-        
-        print(f"[SITES] User {user_id} ({user_role}): {len(sites)} Baustellen")
-        return jsonify([s.to_dict() for s in sites]), 200
-    except Exception as e:
-        return jsonify([]), 200
 
+@job_handler('geocode')
+def run_geocode(params, report):
+    model = {cls.__name__: cls for cls in (Customer, ConstructionSite, TourStop)}[params['model']]
+    rows = model.query.filter(getattr(model, params['key']).in_(params['ids']), model.latitude.is_(None)).all()
+    for row in rows:
+        apply_location(row, {})
+    db.session.commit()
+    return {'geocoded': sum(1 for row in rows if row.latitude is not None), 'total': len(rows)}
 
-@app.route('/api/constructionsites/<int:id>', methods=['GET'])
-def get_site(id):
-    user_id, user_role, is_admin = get_current_user()
-    
-    if not user_id:
-        return jsonify({'message': 'Nicht angemeldet'}), 401
-    
-    try:
-        site = ConstructionSite.query.get(id)
-        if not site:
-            return jsonify({'message': 'Baustelle nicht gefunden'}), 404
-        
-        if user_role == 'Außendienst' and site.created_by != user_id:
-            return jsonify({'message': 'Keine Berechtigung'}), 403
-            
-        return jsonify(site.to_dict(include_details=True)), 200
-    except Exception as e:
-        return jsonify({'message': str(e)}), 500
 
+@job_handler('document-previews')
+def run_document_previews(params, report):
+    document = Document.query.get(params['document_id'])
+    if not document:
+        return {'created': False}
+    return {'created': ensure_previews(document)}
 
-@app.route('/api/constructionsites', methods=['POST'])
-def add_site():
-    user_id, user_role, is_admin = get_current_user()
-    if not user_id:
-        return jsonify({'message': 'Nicht angemeldet'}), 401
-    
-    try:
-        data = request.get_json()
-        
-        start_date = None
-        end_date = None
-        if data.get('start_date'):
-            start_date = datetime.strptime(data['start_date'], '%Y-%m-%d').date()
-        if data.get('end_date'):
-            end_date = datetime.strptime(data['end_date'], '%Y-%m-%d').date()
-        
-        new_site = ConstructionSite(
-            customer_id=data['customer_id'],
-            name=data['name'],
-            address=data['address'],
-            status=data.get('status', 'Planung'),
-            start_date=start_date,
-            end_date=end_date,
-            created_by=user_id
-        )
-        db.session.add(new_site)
-        db.session.commit()
-        return jsonify(new_site.to_dict()), 201
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'message': str(e)}), 400
 
+@job_handler('purge-documents')
+def run_document_purge(params, report):
+    with use_shard(None):
+        removed = sum(across_shards(purge_orphaned_documents))
+    return {'removed': removed}
 
-@app.route('/api/constructionsites/<int:id>', methods=['PUT'])
-def update_site(id):
+
+@app.route('/api/customers/import', methods=['POST'])
+def import_customers():
+    """
+    Massenimport als Job: JSON {"customers": [...]} oder CSV-Datei (Feld 'file',
+    Spalten customer_number;name;address;phone;email). Antwort sofort mit Job-ID.
+    """
     user_id, user_role, is_admin = get_current_user()
-    
     if not user_id:
         return jsonify({'message': 'Nicht angemeldet'}), 401
     
     try:
-        site = ConstructionSite.query.get(id)
-        if not site:
-            return jsonify({'message': 'Baustelle nicht gefunden'}), 404
-        
-        if user_role == 'Außendienst' and site.created_by != user_id:
-            return jsonify({'message': 'Keine Berechtigung'}), 403
-
-        data = request.get_json()
+        if 'file' in request.files:
+            text = request.files['file'].read().decode('utf-8-sig')
+            dialect = csv.Sniffer().sniff(text.splitlines()[0], delimiters=';,\t') if text.strip() else csv.excel
+            rows = list(csv.DictReader(io.StringIO(text), dialect=dialect))
+        else:
+            rows = (request.get_json(silent=True) or {}).get('customers') or []
+        rows = [{field: row.get(field) for field in IMPORT_FIELDS + ('latitude', 'longitude') if row.get(field)}
+                for row in rows]
+        if not rows:
+            return jsonify({'message': 'Keine Kunden zum Importieren'}), 400
         
-        if data.get('name'):
-            site.name = data['name']
-        if data.get('address'):
-            site.address = data['address']
-        if data.get('status'):
-            site.status = data['status']
-        if data.get('start_date'):
-            site.start_date = datetime.strptime(data['start_date'], '%Y-%m-%d').date()
-        if data.get('end_date'):
-            site.end_date = datetime.strptime(data['end_date'], '%Y-%m-%d').date()
-            
-        db.session.commit()
-        return jsonify(site.to_dict()), 200
+        key = idempotency_key(user_id, 'import-customers', rows)
+        job_id = enqueue_job('import-customers', {'user_id': user_id, 'rows': rows}, owner_id=user_id, key=key)
+        print(f"[JOBS] Import von {len(rows)} Kunden eingereiht: {job_id} (User {user_id})")
+        return job_accepted(job_id)
+    except (ValueError, csv.Error) as e:
+        return jsonify({'message': f'Ungültige Importdatei: {str(e)}'}), 400
     except Exception as e:
-        db.session.rollback()
         return jsonify({'message': str(e)}), 500
 
 
-@app.route('/api/constructionsites/<int:id>', methods=['DELETE'])
-def delete_site(id):
+@app.route('/api/customers/export', methods=['POST'])
+def export_customers():
     user_id, user_role, is_admin = get_current_user()
-    
     if not user_id:
         return jsonify({'message': 'Nicht angemeldet'}), 401
     
     try:
-        site = ConstructionSite.query.get(id)
-        if not site:
-            return jsonify({'message': 'Baustelle nicht gefunden'}), 404
-        
-        if user_role == 'Außendienst' and site.created_by != user_id:
-            return jsonify({'message': 'Keine Berechtigung'}), 403
-            
-        db.session.delete(site)
-        db.session.commit()
-        return jsonify({'message': 'Baustelle gelöscht'}), 200
+        job_id = enqueue_job('export-customers', {'user_id': user_id, 'role': user_role}, owner_id=user_id,
+                             priority=-1, key=idempotency_key(user_id, 'export-customers'))
+        return job_accepted(job_id)
     except Exception as e:
-        db.session.rollback()
         return jsonify({'message': str(e)}), 500
 
 
-# ============================================================
-# CONSTRUCTION NOTES ROUTES
-# ============================================================
-
-@app.route('/api/constructionsites/<int:site_id>/notes', methods=['POST'])
-def add_construction_note(site_id):
+@app.route('/api/jobs/purge-documents', methods=['POST'])
+def enqueue_document_purge():
+    """Admin: Bereinigung verwaister Dokumente als Job anstoßen"""
     user_id, user_role, is_admin = get_current_user()
     if not user_id:
         return jsonify({'message': 'Nicht angemeldet'}), 401
     
-    try:
-        data = request.get_json()
-        new_note = ConstructionNote(
-            construction_site_id=site_id,
-            note=data['note'],
-            created_by=user_id
-        )
-        db.session.add(new_note)
-        db.session.commit()
-        return jsonify(new_note.to_dict()), 201
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'message': str(e)}), 400
+    if not is_admin:
+        return jsonify({'message': 'Keine Berechtigung'}), 403
+    
+    job_id = enqueue_job('purge-documents', {}, owner_id=user_id, priority=-5,
+                         key=idempotency_key(user_id, 'purge-documents'))
+    return job_accepted(job_id)
 
 
-@app.route('/api/constructionnotes/<int:id>', methods=['DELETE'])
-def delete_construction_note(id):
-    user_id, user_role, is_admin = get_current_user()
-    
-    if not user_id:
-        return jsonify({'message': 'Nicht angemeldet'}), 401
-    
-    try:
-        note = ConstructionNote.query.get(id)
-        if not note:
-            return jsonify({'message': 'Notiz nicht gefunden'}), 404
-        
-        if user_role == 'Außendienst' and note.created_by != user_id:
-            return jsonify({'message': 'Keine Berechtigung'}), 403
-        
-        db.session.delete(note)
-        db.session.commit()
-        return jsonify({'message': 'Notiz gelöscht'}), 200
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'message': str(e)}), 500
+@app.cli.command('run-jobs')
+@click.option('--workers', default=JOB_WORKERS, show_default=True, help='Anzahl Worker-Threads')
+def run_jobs(workers):
+    """Job-Worker im Vordergrund betreiben (für JOB_WORKER_MODE=external)"""
+    print(f"[JOBS] {workers} Worker gestartet ({JOB_DB_PATH})")
+    JobWorkerPool(JOB_STORE, workers).start()
+    while True:
+        time.sleep(3600)
 
 
 # ============================================================
-# TOUR ROUTES - STRIKTE ISOLATION
+# DUBLETTEN-ERKENNUNG
 # ============================================================
 
-@app.route('/api/tours', methods=['GET'])
-def list_tours():
-    archived = request.args.get('archived', 'false').lower() == 'true'
-    user_id, user_role, is_admin = get_current_user()
+DUPLICATE_MIN_SCORE = 0.5
+DUPLICATE_MAX_PAIRS = 500
+# Größere Blöcke (häufige Namensteile, volle PLZ-Gebiete) werden nicht paarweise,
+# sondern nach Name sortiert nur mit den nächsten Nachbarn verglichen
+DUPLICATE_BLOCK_SIZE = 100
+DUPLICATE_WINDOW = 10
+DUPLICATE_WEIGHTS = {'name': 0.6, 'phone': 0.3, 'email': 0.3, 'plz': 0.15}
+# Rechtsformen und Füllwörter tragen nichts zur Unterscheidung bei
+NAME_STOPWORDS = frozenset({'gmbh', 'mbh', 'ag', 'kg', 'ohg', 'gbr', 'ug', 'ek', 'e', 'k', 'v', 'co', 'und',
+                            'haftungsbeschraenkt', 'se', 'inh', 'firma'})
+
+
+def phone_digits(phone):
+    """Rufnummer ohne Formatierung und Landes-/Verkehrsausscheidungsziffern ('+49 30 1' == '030 1')"""
+    digits = re.sub(r'\D', '', phone or '')
+    for prefix in ('0049', '49', '0'):
+        if digits.startswith(prefix):
+            digits = digits[len(prefix):]
+            break
+    return digits if len(digits) >= 6 else None
+
+
+def duplicate_record(row):
+    id, number, name, address, phone, email, created_by = row
+    tokens = [token for token in WORD_PATTERN.findall(normalize_search(name)) if token not in NAME_STOPWORDS]
+    plz = PLZ_PATTERN.search(address or '')
+    return {
+        'customer': {'id': id, 'customer_number': number, 'name': name, 'address': address or '',
+                     'phone': phone or '', 'email': email or '', 'created_by': created_by},
+        'sort_key': ' '.join(tokens),
+        'tokens': tokens,
+        # Auch zusammengeschrieben, damit 'Haus-Technik' und 'Haustechnik' sich gleichen
+        'grams': frozenset().union(word_trigrams(''.join(tokens)), *map(word_trigrams, tokens)),
+        'phone': phone_digits(phone),
+        'email': normalize_search(email) or None,
+        'plz': plz.group(1) if plz else None,
+    }
+
+
+def blocking_keys(record):
+    keys = {f'name:{token}' for token in record['tokens'] if len(token) >= 3}
+    for field in ('phone', 'plz'):
+        if record[field]:
+            keys.add(f'{field}:{record[field]}')
+    return keys
+
+
+def candidate_pairs(records):
+    """Paare, die sich mindestens einen Blockschlüssel teilen - statt aller n² Paare"""
+    blocks = {}
+    for position, record in enumerate(records):
+        for key in blocking_keys(record):
+            blocks.setdefault(key, []).append(position)
+    pairs = set()
+    for members in blocks.values():
+        if len(members) <= DUPLICATE_BLOCK_SIZE:
+            pairs.update((a, b) for index, a in enumerate(members) for b in members[index + 1:])
+            continue
+        members = sorted(members, key=lambda position: records[position]['sort_key'])
+        for index, a in enumerate(members):
+            pairs.update((min(a, b), max(a, b)) for b in members[index + 1:index + 1 + DUPLICATE_WINDOW])
+    return pairs
+
+
+def duplicate_score(a, b):
+    """Gewichtete Übereinstimmung (0..1) und die Merkmale, die übereinstimmen"""
+    shared = len(a['grams'] & b['grams'])
+    union = len(a['grams']) + len(b['grams']) - shared
+    name = shared / union if union else 0.0
+    score = DUPLICATE_WEIGHTS['name'] * name
+    reasons = ['name'] if name >= 0.5 else []
+    for field in ('phone', 'email', 'plz'):
+        if a[field] and a[field] == b[field]:
+            score += DUPLICATE_WEIGHTS[field]
+            reasons.append(field)
+    return min(score, 1.0), round(name, 3), reasons
+
+
+def find_duplicates(rows, min_score=DUPLICATE_MIN_SCORE, report=None):
+    records = [duplicate_record(row) for row in rows]
+    pairs = candidate_pairs(records)
+    if report:
+        report(0.3, f'{len(pairs)} Kandidatenpaare aus {len(records)} Kunden')
+    found = []
+    for a, b in pairs:
+        score, name_similarity, reasons = duplicate_score(records[a], records[b])
+        if score >= min_score:
+            found.append({'score': round(score, 3), 'name_similarity': name_similarity, 'reasons': reasons,
+                          'customers': [records[a]['customer'], records[b]['customer']]})
+    found.sort(key=lambda pair: (-pair['score'], pair['customers'][0]['id'], pair['customers'][1]['id']))
+    return {'customers': len(records), 'candidates': len(pairs), 'total': len(found),
+            'pairs': found[:DUPLICATE_MAX_PAIRS]}
+
+
+@job_handler('find-duplicates')
+def run_duplicate_search(params, report):
+    """Dubletten unter den für den Auftraggeber sichtbaren Kunden"""
+    criteria = [Customer.created_by == params['user_id']] if params['role'] == 'Außendienst' else []
+    stmt = db.select(Customer.id, Customer.customer_number, Customer.name, Customer.address, Customer.phone,
+                     Customer.email, Customer.created_by).where(*criteria)
+    rows = concat_shards(across_shards(lambda: db.session.execute(stmt).all()))
+    return find_duplicates(rows, params.get('min_score', DUPLICATE_MIN_SCORE), report)
+
+
+def merge_customers(customer, duplicate):
+    """
+    Dublette in customer überführen (laufende Transaktion): Protokolle,
+    Dokumente und Baustellen umhängen, fehlende Kontaktdaten übernehmen,
+    Besuchszähler und Kennzahlen nachziehen, Dublette löschen. Beide Kunden
+    gehören demselben Außendienstler (siehe merge_customer).
+    """
+    moved = {}
+    for model in (VisitProtocol, Document, ConstructionSite):
+        rows = db.session.execute(
+            db.select(model.id, model.created_by).where(model.customer_id == duplicate.id)
+        ).all()
+        if rows:
+            db.session.execute(
+                db.update(model).where(model.id.in_([row_id for row_id, _ in rows])).values(customer_id=customer.id)
+                  .execution_options(synchronize_session=False))
+        # Massen-Update läuft am after_flush-Hook vorbei: Feed-Ereignisse selbst vormerken
+        record_changes(CHANGE_FEED_MODELS[model.__name__][0], rows, 'updated')
+        moved[model.__tablename__] = len(rows)
     
-    if not user_id:
-        return jsonify([]), 200
+    if not customer.address and duplicate.address:
+        customer.address, customer.latitude, customer.longitude, customer.geohash = (
+            duplicate.address, duplicate.latitude, duplicate.longitude, duplicate.geohash)
+    customer.phone = customer.phone or duplicate.phone
+    customer.email = customer.email or duplicate.email
     
-    try:
-        if user_role == 'Außendienst':
-            tours = Tour.query.filter_by(archived=archived, created_by=user_id).all()
-        else:
-            tours = Tour.query.filter_by(archived=archived).all()
-        
-        print(f"[TOURS] User {user_id}: {len(tours)} (archived={archived})")
-        return jsonify([t.to_dict() for t in tours]), 200
-    except Exception as e:
-        return jsonify([]), 200
+    bucket_before = last_visit_bucket(customer.last_visit_date)
+    customer.visit_count = (customer.visit_count or 0) + (duplicate.visit_count or 0)
+    customer.last_visit_date = max(filter(None, (customer.last_visit_date, duplicate.last_visit_date)), default=None)
+    deltas = Counter()
+    deltas[(duplicate.created_by, STAT_LAST_VISIT, last_visit_bucket(duplicate.last_visit_date))] -= 1
+    deltas[(customer.created_by, STAT_LAST_VISIT, bucket_before)] -= 1
+    deltas[(customer.created_by, STAT_LAST_VISIT, last_visit_bucket(customer.last_visit_date))] += 1
+    bump_stats(deltas)
+    
+    db.session.delete(duplicate)
+    return moved
 
 
-@app.route('/api/tours', methods=['POST'])
-def add_tour():
+@app.route('/api/customers/duplicates', methods=['POST'])
+def enqueue_duplicate_search():
+    """Dublettensuche als Job; Ergebnis (Paare mit Score) unter /api/jobs/<id>"""
     user_id, user_role, is_admin = get_current_user()
     if not user_id:
         return jsonify({'message': 'Nicht angemeldet'}), 401
     
     try:
-        data = request.get_json()
-        
-        if not data or not data.get('title') or not data.get('stops'):
-            return jsonify({'message': 'Titel und Stopps erforderlich'}), 400
-            
-        tour = Tour(title=data['title'], created_by=user_id)
-        db.session.add(tour)
-        db.session.flush()
-        
-        for idx, stop_data in enumerate(data['stops']):
-            stop = TourStop(
-                tour_id=tour.id,
-                customer_name=stop_data['customer_name'],
-                address=stop_data['address'],
-                goal=stop_data.get('goal', ''),
-                order=idx + 1
-            )
-            db.session.add(stop)
-        
-        db.session.commit()
-        print(f"[TOUR] Erstellt: {tour.id} von User {user_id}")
-        return jsonify(tour.to_dict()), 201
+        data = request.get_json(silent=True) or {}
+        min_score = float(data.get('min_score', DUPLICATE_MIN_SCORE))
+        if not 0 <= min_score <= 1:
+            return jsonify({'message': 'min_score muss zwischen 0 und 1 liegen'}), 400
+        params = {'user_id': user_id, 'role': user_role, 'min_score': min_score}
+        job_id = enqueue_job('find-duplicates', params, owner_id=user_id, priority=-1,
+                             key=idempotency_key(user_id, 'find-duplicates'))
+        return job_accepted(job_id)
+    except (TypeError, ValueError) as e:
+        return jsonify({'message': f'Ungültige Parameter: {str(e)}'}), 400
     except Exception as e:
-        db.session.rollback()
-        print(f"[TOUR ERROR] {str(e)}")
-        return jsonify({'message': str(e)}), 400
+        return jsonify({'message': str(e)}), 500
 
 
-@app.route('/api/tours/<int:id>/complete', methods=['POST'])
-def complete_tour(id):
+@app.route('/api/customers/<int:id>/merge', methods=['POST'])
+def merge_customer(id):
+    """Dublette (JSON duplicate_id) in diesen Kunden überführen"""
     user_id, user_role, is_admin = get_current_user()
     
     if not user_id:
         return jsonify({'message': 'Nicht angemeldet'}), 401
     
     try:
-        tour = Tour.query.get(id)
-        if not tour:
-            return jsonify({'message': 'Tour nicht gefunden'}), 404
+        duplicate_id = (request.get_json(silent=True) or {}).get('duplicate_id')
+        if not isinstance(duplicate_id, int) or duplicate_id == id:
+            return jsonify({'message': 'duplicate_id fehlt oder ist ungültig'}), 400
         
-        if user_role == 'Außendienst' and tour.created_by != user_id:
+        if shard_of_id(duplicate_id) != shard_of_id(id):
+            # Datensätze wandern nicht zwischen Shard-Dateien
+            return jsonify({'message': 'Kunden verschiedener Außendienstler können im Shard-Modus '
+                                       'nicht zusammengeführt werden'}), 409
+        
+        customer = db.session.get(Customer, id)
+        duplicate = db.session.get(Customer, duplicate_id)
+        if not customer or not duplicate:
+            return jsonify({'message': 'Kunde nicht gefunden'}), 404
+        
+        if user_role == 'Außendienst' and (customer.created_by != user_id or duplicate.created_by != user_id):
             return jsonify({'message': 'Keine Berechtigung'}), 403
         
-        tour.archived = True
-        tour.completed_at = datetime.utcnow()
+        if customer.created_by != duplicate.created_by:
+            # Protokolle, Dokumente und Baustellen würden sonst bei einem fremden Kunden landen
+            return jsonify({'message': 'Kunden verschiedener Außendienstler können nicht '
+                                       'zusammengeführt werden'}), 409
+        
+        moved = merge_customers(customer, duplicate)
         db.session.commit()
-        return jsonify(tour.to_dict()), 200
+        print(f"[CUSTOMER] Zusammengeführt: {duplicate_id} -> {id} von User {user_id} ({moved})")
+        return jsonify({'message': 'Kunden zusammengeführt', 'moved': moved, 'customer': customer.to_dict()}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': str(e)}), 500
 
 
-@app.route('/api/tours/<int:id>', methods=['DELETE'])
-def delete_tour(id):
+# ============================================================
+# ÄNDERUNGS-FEED (SERVER-SENT EVENTS)
+# ============================================================
+
+EVENT_POLL_INTERVAL = 0.5
+EVENT_KEEPALIVE = 15
+# Verbindungen werden nach einigen Minuten beendet; EventSource verbindet sich
+# mit Last-Event-ID neu und bekommt Verpasstes nachgeliefert
+EVENT_STREAM_LIFETIME = 300
+EVENT_BUFFER_SIZE = 2000
+EVENT_RETENTION = 3600
+# Jeder offene Stream belegt unter gthread einen Worker-Thread (Procfile: 32).
+# Obergrenzen je Prozess und Nutzer lassen genug Threads für die übrige API;
+# darüber 503, der Browser versucht es nach EVENT_BUSY_RETRY Sekunden erneut
+EVENT_MAX_STREAMS = int(os.environ.get('EVENT_MAX_STREAMS', '8'))
+EVENT_MAX_STREAMS_PER_USER = int(os.environ.get('EVENT_MAX_STREAMS_PER_USER', '2'))
+EVENT_BUSY_RETRY = 30
+
+# Modelle, deren Änderungen im Feed erscheinen, und ihr Eigentümer-Feld
+CHANGE_FEED_MODELS = {
+    'Customer': ('customer', 'created_by'),
+    'VisitProtocol': ('protocol', 'created_by'),
+    'Document': ('document', 'created_by'),
+    'ConstructionSite': ('site', 'created_by'),
+    'ConstructionNote': ('note', 'created_by'),
+    'Tour': ('tour', 'created_by'),
+    'TourArchive': ('tour_archive', 'created_by'),
+    'User': ('user', 'id'),
+}
+
+
+class SQLiteEventBus:
+    """
+    Pub/Sub zwischen Worker-Prozessen über eine lokale SQLite-Datei (Ersatz
+    für Redis o.ä.). Pro Prozess liest ein Thread neue Ereignisse in einen
+    Ringpuffer; wartende Streams teilen sich eine Condition statt je eine Queue.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._buffer = deque(maxlen=EVENT_BUFFER_SIZE)
+        self._last_id = 0
+        self._subscribers = 0
+        self._pid = None
+        self._init_schema()
+
+    def _conn(self):
+        # Eine Verbindung pro Thread; nach fork() (Gunicorn) neu verbinden
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self):
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                entity TEXT NOT NULL,
+                entity_id INTEGER NOT NULL,
+                op TEXT NOT NULL,
+                owner_id INTEGER,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_events_created_at ON events (created_at);
+        ''')
+
+    def publish(self, changes):
+        now = time.time()
+        self._conn().executemany(
+            'INSERT INTO events (entity, entity_id, op, owner_id, created_at) VALUES (?, ?, ?, ?, ?)',
+            [(entity, entity_id, op, owner_id, now) for entity, entity_id, op, owner_id in changes])
+
+    def latest_id(self):
+        return self._conn().execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+
+    def since(self, last_id, limit=EVENT_BUFFER_SIZE):
+        rows = self._conn().execute(
+            'SELECT id, entity, entity_id, op, owner_id, created_at FROM events WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, limit)).fetchall()
+        return [{'id': row[0], 'entity': row[1], 'entity_id': row[2], 'op': row[3], 'owner': row[4],
+                 'ts': datetime.utcfromtimestamp(row[5]).strftime('%Y-%m-%d %H:%M:%S')} for row in rows]
+
+    def _ensure_poller(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._buffer.clear()
+        self._last_id = self.latest_id()
+        threading.Thread(target=self._poll, name='event-poller', daemon=True).start()
+
+    def _poll(self):
+        last_cleanup = 0
+        while True:
+            time.sleep(EVENT_POLL_INTERVAL)
+            # Ohne offene Streams nur selten nachsehen
+            if not self._subscribers and time.time() - last_cleanup < 60:
+                continue
+            try:
+                events = self.since(self._last_id)
+                if events:
+                    with self._cond:
+                        self._buffer.extend(events)
+                        self._last_id = events[-1]['id']
+                        self._cond.notify_all()
+                if time.time() - last_cleanup > 60:
+                    self._conn().execute('DELETE FROM events WHERE created_at < ?', (time.time() - EVENT_RETENTION,))
+                    last_cleanup = time.time()
+            except Exception as e:
+                print(f"[EVENTS ERROR] {str(e)}")
+
+    @contextmanager
+    def subscription(self):
+        self._ensure_poller()
+        with self._cond:
+            self._subscribers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+
+    def wait(self, after_id, timeout):
+        """Ereignisse mit id > after_id; blockiert höchstens timeout Sekunden"""
+        with self._cond:
+            if after_id < self._last_id and (not self._buffer or self._buffer[0]['id'] > after_id + 1):
+                # Nicht (mehr) im Ringpuffer, z.B. Reconnect nach längerer Pause
+                return self.since(after_id)
+            if self._last_id <= after_id:
+                self._cond.wait(timeout)
+            return [event for event in self._buffer if event['id'] > after_id]
+
+
+EVENT_BUS = SQLiteEventBus(EVENT_DB_PATH)
+
+
+def record_change(entity, entity_id, op, owner_id, session=None):
+    """Änderung für den Feed vormerken; veröffentlicht wird erst beim Commit"""
+    (session or db.session).info.setdefault('changes', {})[(entity, entity_id)] = (op, owner_id)
+
+
+def record_changes(entity, rows, op, session=None):
+    """record_change für [(id, owner_id)], z.B. die Zeilen eines Massen-Updates"""
+    for entity_id, owner_id in rows:
+        record_change(entity, entity_id, op, owner_id, session)
+
+
+# Regel: collect_changes sieht nur den ORM-Unit-of-Work. Wer Zeilen der
+# CHANGE_FEED_MODELS per db.insert/update/delete schreibt, meldet sie selbst mit
+# record_change(s) - sonst erfahren weder /api/events noch die daran hängenden
+# Caches (Vorschlagsindex, Außendienst-Übersicht) davon. Abhängige Zeilen ohne
+# eigenes Feed-Objekt (Tour-Stopps) melden ihr Elternobjekt.
+@event.listens_for(db.session, 'after_flush')
+def collect_changes(session, flush_context):
+    pending = session.info.setdefault('changes', {})
+    for objects, op in ((session.new, 'created'), (session.dirty, 'updated'), (session.deleted, 'deleted')):
+        for obj in objects:
+            spec = CHANGE_FEED_MODELS.get(type(obj).__name__)
+            if spec is None or (op == 'updated' and not session.is_modified(obj)):
+                continue
+            entity, owner_field = spec
+            key = (entity, obj.id)
+            # Angelegt und im selben Commit geändert bleibt 'created'; Löschen gewinnt immer
+            if op == 'updated' and key in pending:
+                continue
+            pending[key] = (op, getattr(obj, owner_field, None))
+
+
+@event.listens_for(db.session, 'after_commit')
+def publish_changes(session):
+    changes = session.info.pop('changes', None)
+    if not changes:
+        return
+    try:
+        EVENT_BUS.publish([(entity, entity_id, op, owner_id)
+                           for (entity, entity_id), (op, owner_id) in changes.items()])
+    except Exception as e:
+        # Der Feed ist nur ein Hinweis - die Änderung selbst ist gespeichert
+        print(f"[EVENTS ERROR] {str(e)}")
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_changes(session):
+    session.info.pop('changes', None)
+
+
+def event_visible(change, user_id, user_role, is_admin):
+    """Gleiche Sichtbarkeit wie die Listen: Außendienst nur eigene Daten"""
+    if user_role != 'Außendienst' or is_admin:
+        return True
+    return change['entity'] != 'user' and change['owner'] == user_id
+
+
+_event_streams = Counter()
+_event_streams_lock = threading.Lock()
+
+
+def claim_stream_slot(user_id):
+    """Platz für einen Stream in diesem Prozess belegen; False über einer der Obergrenzen"""
+    with _event_streams_lock:
+        if sum(_event_streams.values()) >= EVENT_MAX_STREAMS or _event_streams[user_id] >= EVENT_MAX_STREAMS_PER_USER:
+            return False
+        _event_streams[user_id] += 1
+        return True
+
+
+def release_stream_slot(user_id):
+    with _event_streams_lock:
+        _event_streams[user_id] -= 1
+        if _event_streams[user_id] <= 0:
+            del _event_streams[user_id]
+
+
+@app.route('/api/events', methods=['GET'])
+def event_stream():
+    """
+    Server-Sent Events: {entity, entity_id, op, owner, ts} je Änderung.
+    Verpasste Ereignisse per Header Last-Event-ID (setzt EventSource selbst).
+    """
     user_id, user_role, is_admin = get_current_user()
     
     if not user_id:
         return jsonify({'message': 'Nicht angemeldet'}), 401
     
     try:
-        tour = Tour.query.get(id)
-        if not tour:
-            return jsonify({'message': 'Tour nicht gefunden'}), 404
-        
-        if user_role == 'Außendienst' and tour.created_by != user_id:
-            return jsonify({'message': 'Keine Berechtigung'}), 403
-            
-        db.session.delete(tour)
-        db.session.commit()
-        return jsonify({'message': 'Tour gelöscht'}), 200
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'message': str(e)}), 500
-
-
-# ============================================================
-# INNENDIENST SPEZIAL-ENDPOINT
-# ============================================================
-
-@app.route('/api/users/aussendienst/<int:target_user_id>/data', methods=['GET'])
-def get_aussendienst_data(target_user_id):
-    """Innendienst: Lädt ALLE Daten eines Außendienst-Mitarbeiters"""
-    current_user_id, user_role, is_admin = get_current_user()
-    # KORREKTUR: Die Zeile 'current_role = session.get('role')' wurde entfernt,
-    # da sie den korrekten user_role-Wert (aus dem Header) überschreiben würde.
+        last_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or EVENT_BUS.latest_id())
+    except ValueError:
+        return jsonify({'message': 'Ungültige Last-Event-ID'}), 400
     
-    # Graceful: Bei fehlender Anmeldung leere Daten zurückgeben
-    if not current_user_id:
-        return jsonify({
-            'user': {},
-            'customers': [],
-            'active_tours': [],
-            'archived_tours': [],
-            'construction_sites': []
-        }), 200
+    if not claim_stream_slot(user_id):
+        print(f"[EVENTS] Stream abgelehnt für User {user_id}: Obergrenze erreicht")
+        return app.response_class(f'retry: {EVENT_BUSY_RETRY * 1000}\n\n', status=503, mimetype='text/event-stream',
+                                  headers={'Retry-After': str(EVENT_BUSY_RETRY), 'Cache-Control': 'no-cache'})
     
-    # Nur Innendienst oder Admin dürfen zugreifen
-    if user_role != 'Innendienst' and not is_admin:
-        return jsonify({
-            'user': {},
-            'customers': [],
-            'active_tours': [],
-            'archived_tours': [],
-            'construction_sites': []
-        }), 200
+    def generate(last_id):
+        deadline = time.time() + EVENT_STREAM_LIFETIME
+        with EVENT_BUS.subscription():
+            yield f'retry: 3000\nid: {last_id}\n\n'
+            while time.time() < deadline:
+                changes = EVENT_BUS.wait(last_id, EVENT_KEEPALIVE)
+                if not changes:
+                    yield ': keepalive\n\n'
+                    continue
+                for change in changes:
+                    last_id = change['id']
+                    if event_visible(change, user_id, user_role, is_admin):
+                        yield f"id: {change['id']}\nevent: change\ndata: {json.dumps(change)}\n\n"
     
-    try:
-        target_user = User.query.get(target_user_id)
-        if not target_user:
-            return jsonify({
-                'user': {},
-                'customers': [],
-                'active_tours': [],
-                'archived_tours': [],
-                'construction_sites': []
-            }), 200
-        
-        customers = Customer.query.filter_by(created_by=target_user_id).all()
-        active_tours = Tour.query.filter_by(created_by=target_user_id, archived=False).all()
-        archived_tours = Tour.query.filter_by(created_by=target_user_id, archived=True).all()
-        construction_sites = ConstructionSite.query.filter_by(created_by=target_user_id).all()
-        
-        print(f"[INNENDIENST] Daten für {target_user.username}: {len(customers)} Kunden, {len(active_tours)} aktive, {len(archived_tours)} archiviert, {len(construction_sites)} Baustellen")
-        
-        return jsonify({
-            'user': target_user.to_dict(),
-            'customers': [c.to_dict() for c in customers],
-            'active_tours': [t.to_dict() for t in active_tours],
-            'archived_tours': [t.to_dict() for t in archived_tours],
-            'construction_sites': [s.to_dict() for s in construction_sites]
-        }), 200
-    except Exception as e:
-        print(f"[INNENDIENST ERROR] {str(e)}")
-        return jsonify({
-            'user': {},
-            'customers': [],
-            'active_tours': [],
-            'archived_tours': [],
-            'construction_sites': []
-        }), 200
+    response = app.response_class(generate(last_id), mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Auch wenn der Client trennt, bevor der Generator startet
+    response.call_on_close(lambda: release_stream_slot(user_id))
+    return response
 
 
 # ============================================================
-# USER ROUTES
+# BENCHMARK-HILFEN
 # ============================================================
 
-@app.route('/api/users', methods=['GET'])
-def list_users():
+@contextmanager
+def bench_database():
+    """Temporäre SQLite-Datenbank mit vollständigem Schema - Benchmarks fassen echte Daten nie an"""
+    directory = tempfile.mkdtemp(prefix='customer_pro_bench_')
+    engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+    db.metadata.create_all(engine)
+    session = Session(engine)
     try:
-        users = User.query.all()
-        return jsonify([u.to_dict() for u in users]), 200
-    except Exception as e:
-        return jsonify([]), 200
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
+        shutil.rmtree(directory, ignore_errors=True)
 
 
-@app.route('/api/users', methods=['POST'])
-def create_user():
-    try:
-        data = request.get_json()
-        
-        if not data.get('username') or not data.get('password'):
-            return jsonify({'message': 'Nutzername und Passwort erforderlich'}), 400
-        
-        if User.query.filter_by(username=data['username']).first():
-            return jsonify({'message': 'Nutzername existiert bereits'}), 409
-            
-        new_user = User(
-            username=data['username'],
-            password=data['password'],
-            role=data.get('role', 'Außendienst'),
-            is_admin=data.get('is_admin', False)
-        )
-        db.session.add(new_user)
-        db.session.commit()
-        return jsonify(new_user.to_dict()), 201
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'message': str(e)}), 500
+def seed_delete_benchmark(session, children, blob):
+    """Ein Kunde mit `children` Protokollen, Dokumenten und Baustellen-Notizen"""
+    user = User(username='bench', password='x', role='Außendienst')
+    session.add(user)
+    session.flush()
+    customer = Customer(customer_number='B1', name='Benchmark GmbH', created_by=user.id)
+    session.add(customer)
+    session.flush()
+    today = datetime.utcnow().date()
+    session.execute(db.insert(VisitProtocol), [
+        {'customer_id': customer.id, 'visit_date': today, 'summary': f'Besuch {i}', 'created_by': user.id}
+        for i in range(children)])
+    session.execute(db.insert(Document), [
+        {'customer_id': customer.id, 'name': f'Foto {i}.jpg', 'type': 'Foto', 'file_data': blob, 'created_by': user.id}
+        for i in range(children)])
+    site_count = max(children // 100, 1)
+    session.execute(db.insert(ConstructionSite), [
+        {'customer_id': customer.id, 'name': f'Baustelle {i}', 'address': '-', 'created_by': user.id}
+        for i in range(site_count)])
+    site_ids = session.execute(db.select(ConstructionSite.id)).scalars().all()
+    session.execute(db.insert(ConstructionNote), [
+        {'construction_site_id': site_ids[i % site_count], 'note': f'Notiz {i}', 'created_by': user.id}
+        for i in range(children)])
+    session.commit()
+    return customer.id
 
 
-@app.route('/api/users/<int:id>', methods=['DELETE'])
-def delete_user(id):
-    try:
-        user = User.query.get(id)
-        if not user:
-            return jsonify({'message': 'Nutzer nicht gefunden'}), 404
-        if user.id == 1:
-            return jsonify({'message': 'System-Admin kann nicht gelöscht werden'}), 403
-        db.session.delete(user)
-        db.session.commit()
-        return jsonify({'message': 'Nutzer gelöscht'}), 200
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'message': str(e)}), 500
+@app.cli.command('bench-delete')
+@click.option('--children', default=3000, help='Anzahl Protokolle, Dokumente und Notizen')
+@click.option('--blob-kb', default=64, help='Größe je Dokument in KB')
+def bench_delete(children, blob_kb):
+    """Benchmark: Kunde mit vielen Kindern löschen (ORM-Traversal vs. DB-Kaskade)"""
+    blob = os.urandom(blob_kb * 1024)
+    for label, traverse in (('ORM-Traversal (alt)', True), ('DB-Kaskade (neu)', False)):
+        with bench_database() as session:
+            customer_id = seed_delete_benchmark(session, children, blob)
+            statements = []
+            listener = lambda *args: statements.append(1)
+            event.listen(session.get_bind(), 'before_cursor_execute', listener)
+            started = time.perf_counter()
+            customer = session.get(Customer, customer_id)
+            documents = [] if traverse else documents_attached_to(Customer.id == customer_id, session=session)
+            if traverse:
+                # Früheres Verhalten: alle Kinder inkl. Blobs laden und einzeln löschen
+                for site in customer.construction_sites:
+                    for note in site.notes:
+                        session.delete(note)
+                    for document in site.documents:
+                        session.delete(document)
+                    session.delete(site)
+                for protocol in customer.protocols:
+                    session.delete(protocol)
+                for document in customer.documents:
+                    session.delete(document)
+            session.delete(customer)
+            mark_orphaned_documents(documents, session)
+            session.commit()
+            request_ms = (time.perf_counter() - started) * 1000
+            request_statements = len(statements)
+            started = time.perf_counter()
+            purge_orphaned_documents(session)
+            purge_ms = (time.perf_counter() - started) * 1000
+            event.remove(session.get_bind(), 'before_cursor_execute', listener)
+            print(f"{label:22s} | Request {request_ms:8.1f} ms | Statements {request_statements:6d} | "
+                  f"Hintergrund-Purge {purge_ms:8.1f} ms")
+
+
+def bench_write_unit(user_id, number):
+    """Kleiner Schreibzugriff eines Außendienstlers: ein Kunde plus Besuchsprotokoll"""
+    def unit(session):
+        customer = Customer(customer_number=f'B{user_id}-{number}', name=f'Kunde {number}', created_by=user_id)
+        session.add(customer)
+        session.flush()
+        session.add(VisitProtocol(customer_id=customer.id, visit_date=date.today(),
+                                  summary='Besuch', created_by=user_id))
+    return unit
+
+
+def bench_writer(engine, user_id, writes, group=None):
+    """Ein Außendienstler: je Auftrag eine Transaktion (oder per Group-Commit) -> (Latenzen, Sperr-Wiederholungen)"""
+    latencies, retries = [], 0
+    with Session(engine) as session:
+        for number in range(writes):
+            started = time.perf_counter()
+            unit = bench_write_unit(user_id, number)
+            while group is None:
+                try:
+                    unit(session)
+                    session.commit()
+                    break
+                except OperationalError:
+                    # 'database is locked': ein anderer Schreiber hält die Datei
+                    session.rollback()
+                    retries += 1
+                    time.sleep(0.001)
+            if group is not None:
+                group.submit(unit)
+            latencies.append(time.perf_counter() - started)
+    return latencies, retries
+
+
+def bench_engine(path, user_ids, profile=None, timeout=5.0):
+    """Engine auf neuer Datei mit Schema und Nutzern; profile ersetzt SQLITE_PROFILE"""
+    connect_args = {'timeout': timeout}
+    if profile is not None:
+        connect_args['factory'] = type('BenchConnection', (sqlite3.Connection,), {'profile': profile})
+    engine = create_engine(f'sqlite:///{path}', connect_args=connect_args)
+    db.metadata.create_all(engine, tables=shard_tables())
+    with Session(engine) as session:
+        session.add_all([User(id=uid, username=f'bench{uid}', password='x') for uid in user_ids])
+        session.commit()
+    return engine
+
+
+def run_writers(engines, user_ids, writes, group=None):
+    """Alle Schreiber parallel -> (Transaktionen/s, p95 in ms, Sperr-Wiederholungen)"""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(user_ids)) as pool:
+        results = list(pool.map(lambda uid: bench_writer(engines[uid], uid, writes, group), user_ids))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for part, _ in results for latency in part)
+    p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000
+    return len(latencies) / elapsed, p95, sum(part for _, part in results)
+
+
+@app.cli.command('bench-shards')
+@click.option('--writers', default=8, help='Parallele Außendienstler')
+@click.option('--writes', default=200, help='Transaktionen je Außendienstler')
+def bench_shards(writers, writes):
+    """Benchmark: parallele Schreiber auf einer SQLite-Datei vs. einer Datei je Außendienstler"""
+    user_ids = list(range(1, writers + 1))
+    for label, sharded in (('Eine Datei', False), ('Datei je Mitarbeiter', True)):
+        directory = tempfile.mkdtemp(prefix='customer_pro_bench_')
+        engines = {}
+        try:
+            for user_id in user_ids:
+                name = f'shard_{user_id}.db' if sharded else 'bench.db'
+                if name not in engines:
+                    engines[name] = bench_engine(os.path.join(directory, name), user_ids)
+                engines[user_id] = engines[name]
+            rate, p95, retries = run_writers(engines, user_ids, writes)
+            print(f"{label:22s} | {rate:8.0f} Transaktionen/s | p95 {p95:7.1f} ms | "
+                  f"Sperr-Wiederholungen {retries:5d}")
+        finally:
+            for engine in set(engines.values()):
+                engine.dispose()
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+@app.cli.command('bench-sqlite')
+@click.option('--writers', default=16, help='Parallele Schreiber (Request-Threads)')
+@click.option('--writes', default=100, help='Kleine Schreibzugriffe je Schreiber')
+def bench_sqlite(writers, writes):
+    """Benchmark: Schreib-Konkurrenz auf einer Datei - SQLite-Standard vs. Profil vs. Profil mit Group-Commit"""
+    user_ids = list(range(1, writers + 1))
+    # SQLite-Standard: Rollback-Journal, synchronous=FULL, kein Warten auf Sperren
+    scenarios = (('SQLite-Standard', {}, 0, False),
+                 ('Profil', SQLITE_PROFILE, 5.0, False),
+                 ('Profil + Group-Commit', SQLITE_PROFILE, 5.0, True))
+    for label, profile, timeout, grouped in scenarios:
+        directory = tempfile.mkdtemp(prefix='customer_pro_bench_')
+        engine = bench_engine(os.path.join(directory, 'bench.db'), user_ids, profile, timeout)
+        try:
+            group = None
+            if grouped:
+                group = GroupCommitWriter(GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_BATCH,
+                                          session_factory=lambda: Session(engine))
+            rate, p95, retries = run_writers(dict.fromkeys(user_ids, engine), user_ids, writes, group)
+            batch = f' | Ø Batch {group.writes / group.batches:5.1f}' if group and group.batches else ''
+            print(f"{label:22s} | {rate:8.0f} Transaktionen/s | p95 {p95:7.1f} ms | "
+                  f"Sperr-Wiederholungen {retries:5d}{batch}")
+        finally:
+            engine.dispose()
+            shutil.rmtree(directory, ignore_errors=True)
 
 
 # ============================================================
 # INITIALISIERUNG
 # ============================================================
 
+def upgrade_schema(engine=None):
+    """
+    Fehlende Spalten und Indizes in bestehenden Tabellen ergänzen (ohne
+    Migrations-Tool). Gibt die ergänzten Spalten als 'tabelle.spalte' zurück.
+    engine: Shard-Datei statt Hauptdatenbank.
+    """
+    engine = engine or db.engine
+    added = set()
+    inspector = db.inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        columns = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            ddl = (f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {preparer.quote(column.name)} "
+                   f"{column.type.compile(dialect=engine.dialect)}")
+            if column.server_default is not None:
+                default = column.server_default.arg
+                ddl += f" DEFAULT {getattr(default, 'text', default)}"
+            try:
+                with engine.begin() as conn:
+                    conn.execute(db.text(ddl))
+                added.add(f"{table.name}.{column.name}")
+                print(f"[DB] Spalte ergänzt: {table.name}.{column.name}")
+            except Exception as e:
+                # z.B. parallel startender Worker hat die Spalte schon angelegt
+                print(f"[DB] Spalte {table.name}.{column.name} übersprungen: {str(e)}")
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    # Shards entstehen immer mit aktuellen Fremdschlüsseln
+    if engine is db.engine:
+        upgrade_foreign_keys()
+    return added
+
+
+def rebuild_sqlite_table(table):
+    """SQLite kann Constraints nicht ändern: Tabelle neu anlegen und Daten umkopieren"""
+    preparer = db.engine.dialect.identifier_preparer
+    name = preparer.quote(table.name)
+    temp_name = preparer.quote(f'{table.name}__neu')
+    ddl = str(CreateTable(table).compile(dialect=db.engine.dialect))
+    ddl = ddl.replace(f'CREATE TABLE {name} (', f'CREATE TABLE {temp_name} (', 1)
+    old_columns = {c['name'] for c in db.inspect(db.engine).get_columns(table.name)}
+    columns = ', '.join(preparer.quote(c.name) for c in table.columns if c.name in old_columns)
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        try:
+            conn.exec_driver_sql(ddl)
+            conn.exec_driver_sql(f'INSERT INTO {temp_name} ({columns}) SELECT {columns} FROM {name}')
+            conn.exec_driver_sql(f'DROP TABLE {name}')
+            conn.exec_driver_sql(f'ALTER TABLE {temp_name} RENAME TO {name}')
+            conn.commit()
+        finally:
+            conn.exec_driver_sql('PRAGMA foreign_keys=ON')
+    for index in table.indexes:
+        index.create(db.engine, checkfirst=True)
+
+
+def upgrade_foreign_keys():
+    """ON DELETE-Regeln bestehender Fremdschlüssel an die Modelle angleichen"""
+    inspector = db.inspect(db.engine)
+    dialect = db.engine.dialect.name
+    preparer = db.engine.dialect.identifier_preparer
+    normalize = lambda rule: None if not rule or rule.upper() == 'NO ACTION' else rule.upper()
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        reflected = {tuple(fk['constrained_columns']): fk for fk in inspector.get_foreign_keys(table.name)}
+        outdated = []
+        for fk in table.foreign_key_constraints:
+            current = reflected.get(tuple(fk.column_keys))
+            if current and normalize(fk.ondelete) != normalize(current.get('options', {}).get('ondelete')):
+                outdated.append((fk, current))
+        if not outdated:
+            continue
+        if dialect == 'sqlite':
+            rebuild_sqlite_table(table)
+        elif dialect == 'postgresql':
+            with db.engine.begin() as conn:
+                for fk, current in outdated:
+                    conn.execute(db.text(f"ALTER TABLE {preparer.quote(table.name)} "
+                                         f"DROP CONSTRAINT {preparer.quote(current['name'])}"))
+                    conn.execute(AddConstraint(fk))
+        else:
+            print(f"[DB] Fremdschlüssel von {table.name} auf {dialect} nicht automatisch anpassbar")
+            continue
+        print(f"[DB] Fremdschlüssel aktualisiert: {table.name}")
+
+
 def init_database():
     with app.app_context():
         # NUR Tabellen erstellen - NICHT löschen!
@@ -1074,63 +5760,67 @@ def init_database():
         db.session.add_all([admin, paul, thomas, maria])
         db.session.commit()
         
-        # PAUL Testdaten (ID 2)
-        paul_k1 = Customer(customer_number='P001', name='Pauls Kunde GmbH',
-                          address='Paulstraße 1, 10115 Berlin', phone='+49 30 111222',
-                          email='kontakt@paulskunde.de', created_by=paul.id)
-        paul_k2 = Customer(customer_number='P002', name='Paul Consulting AG',
-                          address='Paulweg 5, 80331 München', phone='+49 89 333444',
-                          email='info@paulconsulting.de', created_by=paul.id)
-        db.session.add_all([paul_k1, paul_k2])
-        db.session.flush()
-        
-        paul_site = ConstructionSite(customer_id=paul_k1.id, name='Pauls Baustelle Berlin',
-                                    address='Paulstraße 1, 10115 Berlin', status='Aktiv',
-                                    start_date=datetime(2025,1,1).date(), created_by=paul.id)
-        db.session.add(paul_site)
-        
-        paul_tour = Tour(title='Pauls Montags-Tour', created_by=paul.id)
-        db.session.add(paul_tour)
-        db.session.flush()
-        db.session.add(TourStop(tour_id=paul_tour.id, customer_name='Pauls Kunde GmbH',
-                               address='Paulstraße 1, Berlin', goal='Beratung', order=1))
-        
-        paul_arch = Tour(title='Pauls alte Tour', created_by=paul.id, archived=True,
-                        completed_at=datetime(2025,1,10))
-        db.session.add(paul_arch)
-        db.session.flush()
-        db.session.add(TourStop(tour_id=paul_arch.id, customer_name='Alter Kunde',
-                               address='Alte Str 1', goal='Abschluss', order=1))
-        
-        # THOMAS Testdaten (ID 3)
-        thomas_k1 = Customer(customer_number='T001', name='Thomas Tech Solutions',
-                            address='Thomasstraße 10, 20095 Hamburg', phone='+49 40 555666',
-                            email='info@thomastech.de', created_by=thomas.id)
-        thomas_k2 = Customer(customer_number='T002', name='Thomas Bau KG',
-                            address='Thomasallee 20, 50667 Köln', phone='+49 221 777888',
-                            email='kontakt@thomasbau.de', created_by=thomas.id)
-        db.session.add_all([thomas_k1, thomas_k2])
-        db.session.flush()
-        
-        thomas_site = ConstructionSite(customer_id=thomas_k1.id, name='Thomas Projekt Hamburg',
-                                      address='Thomasstraße 10, Hamburg', status='Planung',
-                                      start_date=datetime(2025,3,1).date(), created_by=thomas.id)
-        db.session.add(thomas_site)
-        
-        thomas_tour = Tour(title='Thomas Wochentour', created_by=thomas.id)
-        db.session.add(thomas_tour)
-        db.session.flush()
-        db.session.add(TourStop(tour_id=thomas_tour.id, customer_name='Thomas Tech Solutions',
-                               address='Thomasstraße 10, Hamburg', goal='Präsentation', order=1))
-        
-        thomas_arch = Tour(title='Thomas alte Tour', created_by=thomas.id, archived=True,
-                          completed_at=datetime(2025,1,15))
-        db.session.add(thomas_arch)
-        db.session.flush()
-        db.session.add(TourStop(tour_id=thomas_arch.id, customer_name='Alter Kunde',
-                               address='Alte Str 1', goal='Abschluss', order=1))
+        # Shard-Modus: jeder Block landet in der Datei seines Außendienstlers
+        with use_shard(paul.id):
+            # PAUL Testdaten (ID 2)
+            paul_k1 = Customer(customer_number='P001', name='Pauls Kunde GmbH',
+                              address='Paulstraße 1, 10115 Berlin', phone='+49 30 111222',
+                              email='kontakt@paulskunde.de', created_by=paul.id)
+            paul_k2 = Customer(customer_number='P002', name='Paul Consulting AG',
+                              address='Paulweg 5, 80331 München', phone='+49 89 333444',
+                              email='info@paulconsulting.de', created_by=paul.id)
+            db.session.add_all([paul_k1, paul_k2])
+            db.session.flush()
+            
+            paul_site = ConstructionSite(customer_id=paul_k1.id, name='Pauls Baustelle Berlin',
+                                        address='Paulstraße 1, 10115 Berlin', status='Aktiv',
+                                        start_date=datetime(2025,1,1).date(), created_by=paul.id)
+            db.session.add(paul_site)
+            
+            paul_tour = Tour(title='Pauls Montags-Tour', created_by=paul.id)
+            db.session.add(paul_tour)
+            db.session.flush()
+            db.session.add(TourStop(tour_id=paul_tour.id, customer_name='Pauls Kunde GmbH',
+                                   address='Paulstraße 1, Berlin', goal='Beratung', order=1))
+            
+            paul_arch = Tour(title='Pauls alte Tour', created_by=paul.id)
+            db.session.add(paul_arch)
+            db.session.flush()
+            db.session.add(TourStop(tour_id=paul_arch.id, customer_name='Alter Kunde',
+                                   address='Alte Str 1', goal='Abschluss', order=1))
+            archive_tour(paul_arch, completed_at=datetime(2025,1,10))
         
-        db.session.commit()
+        with use_shard(thomas.id):
+            # THOMAS Testdaten (ID 3)
+            thomas_k1 = Customer(customer_number='T001', name='Thomas Tech Solutions',
+                                address='Thomasstraße 10, 20095 Hamburg', phone='+49 40 555666',
+                                email='info@thomastech.de', created_by=thomas.id)
+            thomas_k2 = Customer(customer_number='T002', name='Thomas Bau KG',
+                                address='Thomasallee 20, 50667 Köln', phone='+49 221 777888',
+                                email='kontakt@thomasbau.de', created_by=thomas.id)
+            db.session.add_all([thomas_k1, thomas_k2])
+            db.session.flush()
+            
+            thomas_site = ConstructionSite(customer_id=thomas_k1.id, name='Thomas Projekt Hamburg',
+                                          address='Thomasstraße 10, Hamburg', status='Planung',
+                                          start_date=datetime(2025,3,1).date(), created_by=thomas.id)
+            db.session.add(thomas_site)
+            
+            thomas_tour = Tour(title='Thomas Wochentour', created_by=thomas.id)
+            db.session.add(thomas_tour)
+            db.session.flush()
+            db.session.add(TourStop(tour_id=thomas_tour.id, customer_name='Thomas Tech Solutions',
+                                   address='Thomasstraße 10, Hamburg', goal='Präsentation', order=1))
+            
+            thomas_arch = Tour(title='Thomas alte Tour', created_by=thomas.id)
+            db.session.add(thomas_arch)
+            db.session.flush()
+            db.session.add(TourStop(tour_id=thomas_arch.id, customer_name='Alter Kunde',
+                                   address='Alte Str 1', goal='Abschluss', order=1))
+            archive_tour(thomas_arch, completed_at=datetime(2025,1,15))
+            
+            db.session.commit()
+        rebuild_stats()
         
         print("\n" + "="*60)
         print("CUSTOMER PRO PROTOTYP - DATENBANK INITIALISIERT")
@@ -1150,9 +5840,27 @@ def init_database():
 # AUTOMATISCHE DATENBANK-INITIALISIERUNG BEIM START
 # ============================================================
 
+@contextmanager
+def startup_lock():
+    """
+    Schema-Upgrade und Migrationen laufen beim Import in jedem Gunicorn-Worker.
+    Die Sperrdatei lässt sie nacheinander laufen: der erste Worker baut z.B.
+    Tabellen neu auf, die übrigen finden danach nichts mehr zu tun.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(STARTUP_LOCK_PATH, 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
 def auto_init_database():
     """Prüft ob Tabellen existieren, wenn nicht -> erstellen"""
-    with app.app_context():
+    with startup_lock(), app.app_context():
         try:
             # Versuche einen User abzufragen
             User.query.first()
@@ -1160,7 +5868,37 @@ def auto_init_database():
         except:
             # Tabellen existieren nicht -> erstellen
             print("[DB] Erstelle Datenbank...")
+            db.session.rollback()
             init_database()
+            return
+        # Tabellen, Spalten und Indizes neuerer Versionen ergänzen
+        db.create_all()
+        added = upgrade_schema()
+        if SHARD_MODE:
+            for shard in shard_ids():
+                engine = shard_engine(shard)
+                db.metadata.create_all(engine, tables=shard_tables())
+                added |= upgrade_schema(engine)
+        if 'customers.visit_count' in added:
+            drifted = check_visit_summary(repair=True)
+            print(f"[DB] Besuchsdaten für {len(drifted)} Kunden nachgetragen")
+        if UserStat.query.first() is None:
+            rebuild_stats()
+        across_shards(archive_legacy_tours)
+
+
+@app.cli.command('geocode-backfill')
+def geocode_backfill():
+    """Fehlende Koordinaten für Kunden, Baustellen und Tour-Stopps nachtragen"""
+    for shard in visible_shards():
+        with use_shard(shard):
+            for model in (Customer, ConstructionSite, TourStop):
+                rows = model.query.filter(model.latitude.is_(None)).all()
+                for row in rows:
+                    apply_location(row, {})
+                db.session.commit()
+                located = sum(1 for row in rows if row.latitude is not None)
+                print(f"[GEO] {model.__tablename__}: {located}/{len(rows)} geokodiert")
 
 # Diese Zeile wird beim Import/Start ausgeführt
 auto_init_database()
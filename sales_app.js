@@ -114,14 +114,38 @@ function getAuthHeaders() {
     return headers;
 }
 
+// Gedrosselte Lesezugriffe (429) nach Retry-After Sekunden wiederholen. Schreibende
+// Anfragen nur mit { retry: true }: eine 429 kann auch von einem Proxy nach
+// teilweiser Verarbeitung kommen. Der Login wird nie automatisch wiederholt
+const RATE_LIMIT_MAX_RETRIES = 3;
+
+async function apiFetch(url, options = {}) {
+    const { retry, ...fetchOptions } = options;
+    const method = (fetchOptions.method || 'GET').toUpperCase();
+    const retryable = retry ?? (method === 'GET' || method === 'HEAD');
+    for (let attempt = 0; ; attempt++) {
+        const response = await fetch(url, fetchOptions);
+        if (response.status !== 429 || !retryable || attempt >= RATE_LIMIT_MAX_RETRIES) {
+            return response;
+        }
+        const seconds = parseInt(response.headers.get('Retry-After'), 10) || 1;
+        console.warn(`[RATELIMIT] Gedrosselt: ${url} - neuer Versuch in ${seconds}s`);
+        if (attempt === 0) {
+            showMessage(`Zu viele Anfragen - neuer Versuch in ${seconds} Sekunden`, 'warning');
+        }
+        await new Promise(resolve => setTimeout(resolve, seconds * 1000));
+    }
+}
+
 async function logout() {
     try {
         closeSidebarOnMobile(); // Sidebar schließen falls offen
-        await fetch(`${API_BASE_URL}/auth/logout`, {
+        await apiFetch(`${API_BASE_URL}/auth/logout`, {
             method: 'POST',
             credentials: 'include'
         });
         currentUser = null;
+        stopChangeFeed();
         localStorage.removeItem('auth_user_id');
         localStorage.removeItem('auth_username');
         localStorage.removeItem('auth_user');
@@ -135,7 +159,7 @@ async function logout() {
 
 async function checkAuth() {
     try {
-        const response = await fetch(`${API_BASE_URL}/auth/check`, {
+        const response = await apiFetch(`${API_BASE_URL}/auth/check`, {
             credentials: 'include'
         });
         const data = await response.json();
@@ -161,6 +185,7 @@ function initApp() {
     document.getElementById('user-display-role').textContent = currentUser.role;
     
     buildNavigation();
+    startChangeFeed();
     
     if (currentUser.role === 'Innendienst') {
         showContent('innendienst');
@@ -230,6 +255,69 @@ function showContent(section) {
     else if (section === 'innendienst') loadInnendienstUsers();
 }
 
+// ===================================================
+// ÄNDERUNGS-FEED (SERVER-SENT EVENTS)
+// ===================================================
+
+let changeFeed = null;
+let changeFeedTimer = null;
+let changeFeedRetryTimer = null;
+// Server lehnt bei zu vielen offenen Streams mit 503 ab - dann später neu versuchen
+const CHANGE_FEED_RETRY_MS = 30000;
+const pendingChanges = new Set();
+
+// Welche Änderungen welche sichtbare Liste neu laden
+const CHANGE_SECTIONS = {
+    customer: ['customer', 'protocol'],
+    construction: ['site'],
+    tour: ['tour'],
+    archive: ['tour_archive'],
+    admin: ['user'],
+    innendienst: ['customer', 'site', 'tour', 'tour_archive', 'protocol', 'user']
+};
+
+function startChangeFeed() {
+    if (changeFeed || typeof EventSource === 'undefined') return;
+    // EventSource sendet keine eigenen Header - funktioniert mit Session-Cookie
+    changeFeed = new EventSource(`${API_BASE_URL}/events`, { withCredentials: true });
+    changeFeed.addEventListener('change', (e) => {
+        pendingChanges.add(JSON.parse(e.data).entity);
+        // Mehrere Änderungen kurz hintereinander nur einmal nachladen
+        clearTimeout(changeFeedTimer);
+        changeFeedTimer = setTimeout(applyPendingChanges, 1000);
+    });
+    changeFeed.addEventListener('error', () => {
+        // Bei Netzwerkfehlern verbindet EventSource selbst neu, bei 503/401 gibt es auf
+        if (!changeFeed || changeFeed.readyState !== EventSource.CLOSED) return;
+        changeFeed = null;
+        clearTimeout(changeFeedRetryTimer);
+        changeFeedRetryTimer = setTimeout(startChangeFeed, CHANGE_FEED_RETRY_MS * (1 + Math.random()));
+    });
+}
+
+function stopChangeFeed() {
+    if (changeFeed) changeFeed.close();
+    changeFeed = null;
+    clearTimeout(changeFeedTimer);
+    clearTimeout(changeFeedRetryTimer);
+    pendingChanges.clear();
+}
+
+function applyPendingChanges() {
+    const active = document.querySelector('.nav-item.active');
+    const section = active ? active.dataset.section : null;
+    const relevant = (CHANGE_SECTIONS[section] || []).some(entity => pendingChanges.has(entity));
+    pendingChanges.clear();
+    if (!relevant) return;
+    
+    if (section === 'customer') loadCustomers();
+    else if (section === 'construction') loadAllConstructionSites();
+    else if (section === 'tour') loadTours();
+    else if (section === 'archive') loadArchivedTours();
+    else if (section === 'admin') loadUsers();
+    else if (section === 'innendienst') refreshInnendienstOverview();
+}
+
 // ===================================================
 // TAB-MANAGEMENT (KORRIGIERT)
 // ===================================================
@@ -259,7 +347,7 @@ async function loadCustomers() {
     container.innerHTML = '<div class="text-center py-8"><i class="fas fa-spinner fa-spin text-3xl text-blue-500"></i></div>';
 
     try {
-        const response = await fetch(`${API_BASE_URL}/customers`, {
+        const response = await apiFetch(`${API_BASE_URL}/customers`, {
             headers: getAuthHeaders(),
             credentials: 'include'
         });
@@ -312,7 +400,7 @@ async function showCustomerDetail(customerId) {
     uploadedFilesCustomer.clear();
     
     try {
-        const response = await fetch(`${API_BASE_URL}/customers/${customerId}`, {
+        const response = await apiFetch(`${API_BASE_URL}/customers/${customerId}`, {
                     headers: getAuthHeaders(),  // <--- Diese Zeile ist neu und wichtig!
                     credentials: 'include'
                 });
@@ -346,6 +434,12 @@ async function showCustomerDetail(customerId) {
         renderDocuments(customer.documents || []);
         renderConstructionSites(customer.construction_sites || []);
         
+        // Detailansicht enthält nur die neuesten Einträge - Rest seitenweise nachladen
+        const customerPages = customer.pagination || {};
+        setupLoadMore('protocols-list', `customers/${customerId}/protocols`, customerPages.protocols, customer.protocols || [], renderProtocols);
+        setupLoadMore('documents-list', `customers/${customerId}/documents`, customerPages.documents, customer.documents || [], renderDocuments);
+        setupLoadMore('construction-sites-list', `customers/${customerId}/constructionsites`, customerPages.construction_sites, customer.construction_sites || [], renderConstructionSites);
+        
         setupCustomerFileUpload();
         
         // Tabs zurücksetzen
@@ -482,7 +576,7 @@ async function saveCustomer() {
         const url = id ? `${API_BASE_URL}/customers/${id}` : `${API_BASE_URL}/customers`;
         console.log('[SAVE] Speichere Kunde:', url, data);
         
-        const response = await fetch(url, {
+        const response = await apiFetch(url, {
             method: id ? 'PUT' : 'POST',
             headers: getAuthHeaders(),
             credentials: 'include',
@@ -509,7 +603,7 @@ async function saveCustomer() {
 }
 
 function editCustomerFromDetail() {
-    fetch(`${API_BASE_URL}/customers/${currentCustomerId}`, { headers: getAuthHeaders(), credentials: 'include' })
+    apiFetch(`${API_BASE_URL}/customers/${currentCustomerId}`, { headers: getAuthHeaders(), credentials: 'include' })
         .then(r => r.json())
         .then(c => openCustomerModal(c));
 }
@@ -518,7 +612,7 @@ async function deleteCustomerFromDetail() {
     if (!(await confirmAction('Kunde wirklich löschen? Alle zugehörigen Daten werden gelöscht.'))) return;
     
     try {
-        const response = await fetch(`${API_BASE_URL}/customers/${currentCustomerId}`, {
+        const response = await apiFetch(`${API_BASE_URL}/customers/${currentCustomerId}`, {
             method: 'DELETE',
             credentials: 'include'
         });
@@ -534,6 +628,43 @@ async function deleteCustomerFromDetail() {
     }
 }
 
+// ===================================================
+// UNTERLISTEN NACHLADEN (Keyset-Pagination)
+// ===================================================
+
+const subListState = {};
+
+function setupLoadMore(containerId, path, pagination, items, renderFn) {
+    subListState[containerId] = { path, items, renderFn, cursor: pagination ? pagination.next_cursor : null };
+    if (!subListState[containerId].cursor) return;
+    
+    const remaining = pagination.count - items.length;
+    document.getElementById(containerId).insertAdjacentHTML('beforeend', `
+        <button onclick="loadMoreSubList('${containerId}')" class="w-full text-center py-2 text-sm text-blue-600">
+            <i class="fas fa-chevron-down mr-1"></i>Weitere laden (${remaining})
+        </button>
+    `);
+}
+
+async function loadMoreSubList(containerId) {
+    const state = subListState[containerId];
+    try {
+        const separator = state.path.includes('?') ? '&' : '?';
+        const response = await apiFetch(`${API_BASE_URL}/${state.path}${separator}cursor=${encodeURIComponent(state.cursor)}`, {
+            headers: getAuthHeaders(),
+            credentials: 'include'
+        });
+        if (!response.ok) return;
+        
+        const page = await response.json();
+        const items = state.items.concat(page.items);
+        state.renderFn(items);
+        setupLoadMore(containerId, state.path, { count: page.count, next_cursor: page.next_cursor }, items, state.renderFn);
+    } catch (error) {
+        console.error('[PAGINATION] Fehler beim Nachladen:', error);
+    }
+}
+
 // ===================================================
 // BESUCHSPROTOKOLLE
 // ===================================================
@@ -593,7 +724,7 @@ async function saveProtocol() {
     }
     
     try {
-        const response = await fetch(`${API_BASE_URL}/protocols`, {
+        const response = await apiFetch(`${API_BASE_URL}/protocols`, {
             method: 'POST',
             headers: getAuthHeaders(),  // FIX: Auth Headers verwenden
             credentials: 'include',
@@ -618,7 +749,7 @@ async function saveProtocol() {
 
 async function deleteProtocol(id) {
     if (!(await confirmAction('Protokoll löschen?'))) return;
-    await fetch(`${API_BASE_URL}/protocols/${id}`, { method: 'DELETE', headers: getAuthHeaders(), credentials: 'include' });
+    await apiFetch(`${API_BASE_URL}/protocols/${id}`, { method: 'DELETE', headers: getAuthHeaders(), credentials: 'include' });
     showMessage('Protokoll gelöscht', 'success');
     showCustomerDetail(currentCustomerId);
 }
@@ -627,6 +758,15 @@ async function deleteProtocol(id) {
 // DOKUMENTEN-MANAGEMENT
 // ===================================================
 
+// Vorschaubild (wenige KB) statt des Original-Blobs; große Fassung per Klick
+function documentThumbnail(doc) {
+    if (!doc.preview_url) return '';
+    const base = `${API_BASE_URL}/documents/${doc.id}/preview`;
+    return `<a href="${base}/lg" target="_blank" class="mr-3 flex-shrink-0">
+        <img src="${base}/sm" alt="${doc.name}" loading="lazy" class="w-16 h-16 object-cover rounded" onerror="this.parentElement.remove()">
+    </a>`;
+}
+
 function renderDocuments(documents) {
     const container = document.getElementById('documents-list');
     if (!documents || documents.length === 0) {
@@ -637,6 +777,7 @@ function renderDocuments(documents) {
     container.innerHTML = documents.map(doc => `
         <div class="card">
             <div class="flex justify-between items-start">
+                ${documentThumbnail(doc)}
                 <div class="flex-grow">
                     <div class="font-semibold">${doc.name}</div>
                     <div class="text-sm text-gray-500 mt-1">
@@ -758,7 +899,7 @@ function uploadSingleFile(file, customerId, siteId) {
             };
             
             try {
-                const response = await fetch(`${API_BASE_URL}/documents`, {
+                const response = await apiFetch(`${API_BASE_URL}/documents`, {
                     method: 'POST',
                     headers: getAuthHeaders(),  // FIX: Auth Headers verwenden
                     credentials: 'include',
@@ -825,7 +966,7 @@ async function saveDocument() {
         return;
     }
     
-    const response = await fetch(`${API_BASE_URL}/documents`, {
+    const response = await apiFetch(`${API_BASE_URL}/documents`, {
         method: 'POST',
         headers: getAuthHeaders(),  // FIX: Auth Headers verwenden
         credentials: 'include',
@@ -845,7 +986,7 @@ async function saveDocument() {
 
 async function deleteDocument(id) {
     if (!(await confirmAction('Dokument löschen?'))) return;
-    await fetch(`${API_BASE_URL}/documents/${id}`, { method: 'DELETE', headers: getAuthHeaders(), credentials: 'include' });
+    await apiFetch(`${API_BASE_URL}/documents/${id}`, { method: 'DELETE', headers: getAuthHeaders(), credentials: 'include' });
     showMessage('Dokument gelöscht', 'success');
     if (currentCustomerId) showCustomerDetail(currentCustomerId);
     if (currentConstructionSiteId) showConstructionSiteDetail(currentConstructionSiteId);
@@ -853,7 +994,7 @@ async function deleteDocument(id) {
 
 async function downloadDocument(id) {
     try {
-        const response = await fetch(`${API_BASE_URL}/documents/${id}/download`, { headers: getAuthHeaders(), credentials: 'include' });
+        const response = await apiFetch(`${API_BASE_URL}/documents/${id}/download`, { headers: getAuthHeaders(), credentials: 'include' });
         if (!response.ok) return;
         const data = await response.json();
         const link = document.createElement('a');
@@ -893,7 +1034,7 @@ async function loadAllConstructionSites() {
     container.innerHTML = '<div class="text-center py-8"><i class="fas fa-spinner fa-spin text-3xl text-blue-500"></i></div>';
 
     try {
-        const response = await fetch(`${API_BASE_URL}/constructionsites`, {
+        const response = await apiFetch(`${API_BASE_URL}/constructionsites`, {
             headers: getAuthHeaders(),
             credentials: 'include'
         });
@@ -928,7 +1069,7 @@ async function showConstructionSiteDetail(siteId) {
     uploadedFilesSite.clear();
     
     try {
-            const response = await fetch(`${API_BASE_URL}/constructionsites/${siteId}`, {
+            const response = await apiFetch(`${API_BASE_URL}/constructionsites/${siteId}`, {
                 headers: getAuthHeaders(),  // <--- Auch hier einfügen!
                 credentials: 'include'
             });
@@ -962,6 +1103,10 @@ async function showConstructionSiteDetail(siteId) {
         renderConstructionNotes(site.notes || []);
         renderConstructionDocuments(site.documents || []);
         
+        const sitePages = site.pagination || {};
+        setupLoadMore('construction-notes-list', `constructionsites/${siteId}/notes`, sitePages.notes, site.notes || [], renderConstructionNotes);
+        setupLoadMore('construction-documents-list', `constructionsites/${siteId}/documents`, sitePages.documents, site.documents || [], renderConstructionDocuments);
+        
         setupSiteFileUpload();
         
         // Innendienst-Modus: Bearbeitungsbuttons ausblenden
@@ -1051,6 +1196,7 @@ function renderConstructionDocuments(documents) {
     container.innerHTML = documents.map(doc => `
         <div class="bg-white border border-gray-200 p-3 rounded-lg">
             <div class="flex justify-between items-start">
+                ${documentThumbnail(doc)}
                 <div class="flex-grow">
                     <div class="font-semibold text-sm">${doc.name}</div>
                     <div class="text-xs text-gray-500 mt-1">
@@ -1192,7 +1338,7 @@ async function saveConstructionSite() {
     }
     
     const url = id ? `${API_BASE_URL}/constructionsites/${id}` : `${API_BASE_URL}/constructionsites`;
-    const response = await fetch(url, {
+    const response = await apiFetch(url, {
         method: id ? 'PUT' : 'POST',
         headers: getAuthHeaders(),  // FIX: Auth Headers verwenden
         credentials: 'include',
@@ -1212,14 +1358,14 @@ async function saveConstructionSite() {
 }
 
 function editConstructionSiteFromDetail() {
-    fetch(`${API_BASE_URL}/constructionsites/${currentConstructionSiteId}`, { headers: getAuthHeaders(), credentials: 'include' })
+    apiFetch(`${API_BASE_URL}/constructionsites/${currentConstructionSiteId}`, { headers: getAuthHeaders(), credentials: 'include' })
         .then(r => r.json())
         .then(site => openConstructionSiteModal(site));
 }
 
 async function deleteConstructionSiteFromDetail() {
     if (!(await confirmAction('Baustelle wirklich löschen?'))) return;
-    await fetch(`${API_BASE_URL}/constructionsites/${currentConstructionSiteId}`, { method: 'DELETE', headers: getAuthHeaders(), credentials: 'include' });
+    await apiFetch(`${API_BASE_URL}/constructionsites/${currentConstructionSiteId}`, { method: 'DELETE', headers: getAuthHeaders(), credentials: 'include' });
     showMessage('Baustelle gelöscht', 'success');
     showContent('construction');
 }
@@ -1243,7 +1389,7 @@ async function saveNote() {
     const text = document.getElementById('note-text').value.trim();
     if (!text) { showMessage('Notiz eingeben!', 'warning'); return; }
     
-    const response = await fetch(`${API_BASE_URL}/constructionsites/${currentConstructionSiteId}/notes`, {
+    const response = await apiFetch(`${API_BASE_URL}/constructionsites/${currentConstructionSiteId}/notes`, {
         method: 'POST',
         headers: getAuthHeaders(),  // FIX: Auth Headers verwenden
         credentials: 'include',
@@ -1263,7 +1409,7 @@ async function saveNote() {
 
 async function deleteNote(id) {
     if (!(await confirmAction('Notiz löschen?'))) return;
-    await fetch(`${API_BASE_URL}/constructionnotes/${id}`, { method: 'DELETE', headers: getAuthHeaders(), credentials: 'include' });
+    await apiFetch(`${API_BASE_URL}/constructionnotes/${id}`, { method: 'DELETE', headers: getAuthHeaders(), credentials: 'include' });
     showMessage('Notiz gelöscht', 'success');
     showConstructionSiteDetail(currentConstructionSiteId);
 }
@@ -1305,7 +1451,7 @@ async function saveSiteDocument() {
     
     if (!data.name) { showMessage('Name erforderlich!', 'warning'); return; }
     
-    const response = await fetch(`${API_BASE_URL}/documents`, {
+    const response = await apiFetch(`${API_BASE_URL}/documents`, {
         method: 'POST',
         headers: getAuthHeaders(),  // FIX: Auth Headers verwenden
         credentials: 'include',
@@ -1332,7 +1478,7 @@ async function loadTours() {
     container.innerHTML = '<div class="text-center py-8"><i class="fas fa-spinner fa-spin text-3xl text-blue-500"></i></div>';
 
     try {
-        const response = await fetch(`${API_BASE_URL}/tours?archived=false`, { 
+        const response = await apiFetch(`${API_BASE_URL}/tours?archived=false`, { 
             headers: getAuthHeaders(),
             credentials: 'include' 
         });
@@ -1384,39 +1530,45 @@ async function loadArchivedTours() {
     container.innerHTML = '<div class="text-center py-8"><i class="fas fa-spinner fa-spin text-3xl text-blue-500"></i></div>';
 
     try {
-        const response = await fetch(`${API_BASE_URL}/tours?archived=true`, { 
+        // Archiv seitenweise (neueste zuerst), weitere Seiten per "Weitere laden"
+        const response = await apiFetch(`${API_BASE_URL}/tours/archive?stops=true`, { 
             headers: getAuthHeaders(),
             credentials: 'include' 
         });
-        const tours = await response.json();
+        const page = await response.json();
 
-        if (!tours || tours.length === 0) {
+        if (!page.items || page.items.length === 0) {
             container.innerHTML = '<div class="text-center py-12 text-gray-500">Keine archivierten Touren</div>';
             return;
         }
 
-        container.innerHTML = tours.map(tour => `
-            <div class="card">
-                <div class="flex justify-between items-start mb-3">
-                    <div>
-                        <div class="font-bold text-xl">${tour.title}</div>
-                        <div class="text-sm text-gray-500 mt-1"><i class="fas fa-check-circle text-green-600 mr-1"></i>Abgeschlossen: ${tour.completed_at || '-'}</div>
-                    </div>
-                    <button onclick="deleteTour(${tour.id})" class="icon-button text-red-600"><i class="fas fa-trash"></i></button>
-                </div>
-                <div class="space-y-1">
-                    ${tour.stops.map(stop => `<div class="text-sm text-gray-700">${stop.order}. ${stop.customer_name} - ${stop.address}</div>`).join('')}
-                </div>
-            </div>
-        `).join('');
+        renderArchivedTours(page.items);
+        setupLoadMore('archive-list-container', 'tours/archive?stops=true', page, page.items, renderArchivedTours);
     } catch (error) {
         console.error('Fehler beim Laden der archivierten Touren:', error);
         container.innerHTML = '<div class="text-center py-12 text-gray-500">Keine archivierten Touren</div>';
     }
 }
 
+function renderArchivedTours(tours) {
+    document.getElementById('archive-list-container').innerHTML = tours.map(tour => `
+        <div class="card">
+            <div class="flex justify-between items-start mb-3">
+                <div>
+                    <div class="font-bold text-xl">${tour.title}</div>
+                    <div class="text-sm text-gray-500 mt-1"><i class="fas fa-check-circle text-green-600 mr-1"></i>Abgeschlossen: ${tour.completed_at || '-'} · ${tour.stop_count} Stopps</div>
+                </div>
+                <button onclick="deleteArchivedTour(${tour.id})" class="icon-button text-red-600"><i class="fas fa-trash"></i></button>
+            </div>
+            <div class="space-y-1">
+                ${tour.stops.map(stop => `<div class="text-sm text-gray-700">${stop.order}. ${stop.customer_name} - ${stop.address}</div>`).join('')}
+            </div>
+        </div>
+    `).join('');
+}
+
 async function openGoogleMapsRoute(tourId) {
-    const response = await fetch(`${API_BASE_URL}/tours?archived=false`, { headers: getAuthHeaders(), credentials: 'include' });
+    const response = await apiFetch(`${API_BASE_URL}/tours?archived=false`, { headers: getAuthHeaders(), credentials: 'include' });
     const tours = await response.json();
     const tour = tours.find(t => t.id === tourId);
     
@@ -1445,7 +1597,7 @@ function openTourModal() {
             <div class="card mb-6 bg-blue-50 border border-blue-200">
                 <h3 class="font-bold text-lg mb-3 text-blue-900">Stopp hinzufügen</h3>
                 <div class="space-y-3">
-                    <input list="customerDatalist" id="tourCustomerName" placeholder="Kundenname" onchange="fillCustomerAddress()">
+                    <input list="customerDatalist" id="tourCustomerName" placeholder="Kundenname" autocomplete="off" oninput="suggestCustomers()" onchange="fillCustomerAddress()">
                     <input type="text" id="tourAddress" placeholder="Adresse">
                     <input type="text" id="tourGoal" placeholder="Besuchsziel (optional)">
                     <button class="action-button w-full" onclick="addTourStop()"><i class="fas fa-plus mr-2"></i>Stopp hinzufügen</button>
@@ -1461,18 +1613,34 @@ function openTourModal() {
     modal.style.display = 'flex';
     currentTourStops = [];
     renderTourStops();
-    
-    // Kunden für Autocomplete laden
-    fetch(`${API_BASE_URL}/customers`, { headers: getAuthHeaders(), credentials: 'include' })
-        .then(r => r.json())
-        .then(customers => {
-            if (customers && customers.length > 0) {
-                updateCustomerDatalist(customers);
-            }
-        });
+    // Vorschläge lädt suggestCustomers() beim Tippen statt der kompletten Kundenliste
+    updateCustomerDatalist([]);
+}
+
+let customerSuggestTimer = null;
+
+async function fetchCustomerSuggestions(query, limit = 10) {
+    const response = await apiFetch(`${API_BASE_URL}/customers/suggest?q=${encodeURIComponent(query)}&limit=${limit}`, {
+        headers: getAuthHeaders(),
+        credentials: 'include'
+    });
+    return response.ok ? response.json() : [];
 }
 
-function fillCustomerAddress() {
+function suggestCustomers() {
+    const query = document.getElementById('tourCustomerName').value.trim();
+    clearTimeout(customerSuggestTimer);
+    if (!query) return;
+    customerSuggestTimer = setTimeout(async () => {
+        try {
+            updateCustomerDatalist(await fetchCustomerSuggestions(query));
+        } catch (error) {
+            console.error('Fehler beim Laden der Kundenvorschläge:', error);
+        }
+    }, 150);
+}
+
+async function fillCustomerAddress() {
     const name = document.getElementById('tourCustomerName').value;
     const datalist = document.getElementById('customerDatalist');
     if (datalist) {
@@ -1480,10 +1648,20 @@ function fillCustomerAddress() {
         for (let opt of options) {
             if (opt.value === name && opt.dataset.address) {
                 document.getElementById('tourAddress').value = opt.dataset.address;
-                break;
+                return;
             }
         }
     }
+    // Name ohne passenden Vorschlag (z.B. eingefügt): gezielt nachschlagen
+    if (!name.trim()) return;
+    try {
+        const match = (await fetchCustomerSuggestions(name, 5)).find(c => c.name === name);
+        if (match && match.address) {
+            document.getElementById('tourAddress').value = match.address;
+        }
+    } catch (error) {
+        console.error('Fehler beim Nachschlagen der Adresse:', error);
+    }
 }
 
 function renderTourStops() {
@@ -1547,7 +1725,7 @@ async function saveTour() {
     try {
         console.log('[TOUR] Speichere Tour:', title, currentTourStops);
         
-        const response = await fetch(`${API_BASE_URL}/tours`, {
+        const response = await apiFetch(`${API_BASE_URL}/tours`, {
             method: 'POST',
             headers: getAuthHeaders(),
             credentials: 'include',
@@ -1575,40 +1753,99 @@ async function saveTour() {
 
 async function completeTour(id) {
     if (!(await confirmAction('Tour als erledigt markieren und archivieren?'))) return;
-    await fetch(`${API_BASE_URL}/tours/${id}/complete`, { method: 'POST', headers: getAuthHeaders(), credentials: 'include' });
+    await apiFetch(`${API_BASE_URL}/tours/${id}/complete`, { method: 'POST', headers: getAuthHeaders(), credentials: 'include' });
     showMessage('Tour archiviert!', 'success');
     loadTours();
 }
 
 async function deleteTour(id) {
     if (!(await confirmAction('Tour löschen?'))) return;
-    await fetch(`${API_BASE_URL}/tours/${id}`, { method: 'DELETE', headers: getAuthHeaders(), credentials: 'include' });
+    await apiFetch(`${API_BASE_URL}/tours/${id}`, { method: 'DELETE', headers: getAuthHeaders(), credentials: 'include' });
     showMessage('Tour gelöscht', 'success');
     loadTours();
     loadArchivedTours();
 }
 
+async function deleteArchivedTour(id) {
+    if (!(await confirmAction('Tour löschen?'))) return;
+    await apiFetch(`${API_BASE_URL}/tours/archive/${id}`, { method: 'DELETE', headers: getAuthHeaders(), credentials: 'include' });
+    showMessage('Tour gelöscht', 'success');
+    loadArchivedTours();
+}
+
 // ===================================================
 // INNENDIENST DASHBOARD
 // ===================================================
 
 async function loadInnendienstUsers() {
     try {
-        const response = await fetch(`${API_BASE_URL}/users`, { headers: getAuthHeaders(), credentials: 'include' });
-        const users = await response.json();
+        // Eine Übersicht mit Kennzahlen aller Außendienstler statt Daten je Mitarbeiter
+        const response = await apiFetch(`${API_BASE_URL}/users/aussendienst/overview`, { headers: getAuthHeaders(), credentials: 'include' });
+        const overview = response.ok ? await response.json() : [];
         
         const select = document.getElementById('innendienst-user-select');
-        const aussendienst = users.filter(u => u.role === 'Außendienst');
-        
         select.innerHTML = '<option value="">Bitte wählen...</option>' + 
-            aussendienst.map(u => `<option value="${u.id}">${u.username}</option>`).join('');
+            overview.map(u => `<option value="${u.user_id}">${u.username}</option>`).join('');
         
+        renderInnendienstOverview(overview);
         document.getElementById('innendienst-content').style.display = 'none';
     } catch (error) {
         console.error('Fehler:', error);
     }
 }
 
+async function refreshInnendienstOverview() {
+    try {
+        const response = await apiFetch(`${API_BASE_URL}/users/aussendienst/overview`, { headers: getAuthHeaders(), credentials: 'include' });
+        if (response.ok) renderInnendienstOverview(await response.json());
+    } catch (error) {
+        console.error('Fehler:', error);
+    }
+}
+
+function renderInnendienstOverview(overview) {
+    const container = document.getElementById('innendienst-overview');
+    if (!container) return;
+    if (!overview || overview.length === 0) {
+        container.innerHTML = '<div class="text-center text-gray-500 py-4">Keine Außendienst-Mitarbeiter</div>';
+        return;
+    }
+    
+    container.innerHTML = `
+        <div class="overflow-x-auto">
+            <table class="w-full text-sm">
+                <thead>
+                    <tr class="text-left text-gray-500 border-b">
+                        <th class="py-2">Mitarbeiter</th>
+                        <th class="py-2">Kunden</th>
+                        <th class="py-2">Aktive Touren</th>
+                        <th class="py-2">Archiv</th>
+                        <th class="py-2">Baustellen</th>
+                        <th class="py-2">Letzte Aktivität</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    ${overview.map(u => `
+                        <tr class="border-b hover:bg-gray-50 cursor-pointer" onclick="selectInnendienstUser(${u.user_id})">
+                            <td class="py-2 font-semibold">${u.username}</td>
+                            <td class="py-2">${u.customers}</td>
+                            <td class="py-2">${u.active_tours}</td>
+                            <td class="py-2">${u.archived_tours}</td>
+                            <td class="py-2">${Object.entries(u.sites_by_status).map(([status, count]) => `${status}: ${count}`).join(', ') || '-'}</td>
+                            <td class="py-2 text-gray-500">${u.last_activity || '-'}</td>
+                        </tr>
+                    `).join('')}
+                </tbody>
+            </table>
+        </div>
+    `;
+}
+
+function selectInnendienstUser(userId) {
+    document.getElementById('innendienst-user-select').value = userId;
+    loadInnendienstData();
+}
+
 async function loadInnendienstData() {
     const userId = document.getElementById('innendienst-user-select').value;
     
@@ -1628,7 +1865,7 @@ async function loadInnendienstData() {
     });
     
     try {
-            const response = await fetch(`${API_BASE_URL}/users/aussendienst/${userId}/data`, {
+            const response = await apiFetch(`${API_BASE_URL}/users/aussendienst/${userId}/data`, {
                 headers: getAuthHeaders(),  // <--- Hier fehlte es auch!
                 credentials: 'include'
             });
@@ -1799,7 +2036,7 @@ async function showConstructionSiteDetailFromInnendienst(siteId) {
 
 async function loadUsers() {
     try {
-        const response = await fetch(`${API_BASE_URL}/users`, { headers: getAuthHeaders(), credentials: 'include' });
+        const response = await apiFetch(`${API_BASE_URL}/users`, { headers: getAuthHeaders(), credentials: 'include' });
         const users = await response.json();
         
         document.getElementById('user-list-body').innerHTML = users.map(u => `
@@ -1830,7 +2067,7 @@ async function createUser() {
         return; 
     }
 
-    const response = await fetch(`${API_BASE_URL}/users`, {
+    const response = await apiFetch(`${API_BASE_URL}/users`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         credentials: 'include',
@@ -1855,7 +2092,7 @@ async function createUser() {
 
 async function deleteUser(id) {
     if (!(await confirmAction('Benutzer wirklich löschen?'))) return;
-    await fetch(`${API_BASE_URL}/users/${id}`, { method: 'DELETE', headers: getAuthHeaders(), credentials: 'include' });
+    await apiFetch(`${API_BASE_URL}/users/${id}`, { method: 'DELETE', headers: getAuthHeaders(), credentials: 'include' });
     showMessage('Benutzer gelöscht', 'success');
     loadUsers();
 }